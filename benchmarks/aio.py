@@ -0,0 +1,137 @@
+# Event loop responsiveness of the asyncio facade.
+#
+#   python -m benchmarks.aio [count] [directory]
+#
+# Opens a document with `count` objects through a storage stub that delivers
+# the bytes in slow chunks, decodes every stream with bounded concurrency and
+# saves a copy, while a ticker coroutine measures how long the loop was
+# blocked. Then opens DOCUMENTS copies one after the other and all at once.
+# Exits with status 1 when the longest stall is above MAX_STALL or the copies
+# opened at once are not MIN_SPEEDUP times faster, as when reads or parsing
+# block the loop.
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+from src.core.aio import AsyncPDFFile, LocalStorage
+from src.core.objects import PDFStream
+
+MAX_STALL = 0.1
+DOCUMENTS = 4
+MIN_SPEEDUP = 2.0
+
+
+class SlowStorage(LocalStorage):
+    # stands in for a blocking client of remote storage: every chunk costs a round trip
+    chunk: int
+    latency: float
+
+    def __init__(self, chunk: int = 1 << 20, latency: float = 0.005):
+        super().__init__()
+        self.chunk = chunk
+        self.latency = latency
+
+    def _read(self, path: str) -> bytes:
+        data = LocalStorage._read(path)
+        parts = []
+        for start in range(0, len(data), self.chunk):
+            time.sleep(self.latency)
+            parts.append(data[start:start + self.chunk])
+        return b"".join(parts)
+
+    def _write(self, path: str, data: bytes) -> None:
+        time.sleep(self.latency * (len(data) // self.chunk + 1))
+        LocalStorage._write(path, data)
+
+
+def write_document(path: str, count: int) -> None:
+    payload = zlib.compress(os.urandom(1024) * 64)
+    offsets = []
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        for num in range(1, count + 1):
+            offsets.append(f.tell())
+            if num == 1:
+                body = b"<< /Type /Catalog /Pages 2 0 R >>"
+            elif num == 2:
+                body = b"<< /Type /Pages /Count 0 /Kids [] >>"
+            else:
+                body = b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(payload), payload)
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (num, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f\r\n" % (count + 1))
+        f.write(b"".join(b"%010d 00000 n\r\n" % off for off in offsets))
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count + 1, xref))
+
+
+async def ticker(stalls: list, stop: asyncio.Event, interval: float = 0.001):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        stalls.append(now - last - interval)
+        last = now
+
+
+async def run(path: str, out: str, count: int) -> float:
+    stalls = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stalls, stop))
+    start = time.perf_counter()
+    f = await AsyncPDFFile.open(path, storage=SlowStorage(), concurrency=4)
+    decoded = await asyncio.gather(*(f.decode_stream(num) for num in range(3, count + 1)))
+    for num in (3, count):
+        if not isinstance(await f.resolve(num), PDFStream):
+            raise Exception(f"object {num} did not resolve to a stream")
+    await f.save(out)
+    total = time.perf_counter() - start
+    stop.set()
+    await tick
+    print(f"{count:>7} objects  {sum(map(len, decoded)) / 1e6:>8.1f} MB decoded  total {total * 1000:>8.1f} ms  "
+          f"longest loop stall {max(stalls) * 1000:>6.1f} ms")
+    return max(stalls)
+
+
+async def open_one(path: str, count: int) -> None:
+    f = await AsyncPDFFile.open(path, storage=SlowStorage(1 << 16), concurrency=4)
+    await f.decode_stream(count)
+
+
+async def progress(path: str, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(DOCUMENTS):
+        await open_one(path, count)
+    sequential = time.perf_counter() - start
+    start = time.perf_counter()
+    await asyncio.gather(*(open_one(path, count) for _ in range(DOCUMENTS)))
+    concurrent = time.perf_counter() - start
+    print(f"{DOCUMENTS} documents  sequential {sequential * 1000:>8.1f} ms  "
+          f"concurrent {concurrent * 1000:>8.1f} ms  speedup {sequential / concurrent:.1f}x")
+    return sequential / concurrent
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 2000
+    directory = argv[1] if len(argv) > 1 else tempfile.mkdtemp()
+    path = os.path.join(directory, "bench-aio.pdf")
+    write_document(path, count)
+    failures = []
+    stall = asyncio.run(run(path, os.path.join(directory, "bench-aio-out.pdf"), count))
+    if stall > MAX_STALL:
+        failures.append(f"the loop stalled for {stall * 1000:.1f} ms, more than {MAX_STALL * 1000:.0f} ms")
+    speedup = asyncio.run(progress(path, count))
+    if speedup < MIN_SPEEDUP:
+        failures.append(f"{DOCUMENTS} documents opened at once only {speedup:.1f}x faster than one after the other")
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
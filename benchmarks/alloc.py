@@ -0,0 +1,54 @@
+# Object-number allocation benchmark.
+#
+#   python -m benchmarks.alloc [count]
+#
+# Inserts `count` small annotation dicts into a fresh document, once through
+# add_new_ref and once through add_new_refs, and reports objects per second.
+# Both should scale linearly with `count`.
+from __future__ import annotations
+
+import sys
+import time
+
+from src.core.file import PDFFile
+from src.core.objects import PDFDict, PDFName, PDFInt
+
+
+def make_annots(file: PDFFile, count: int):
+    for i in range(count):
+        yield PDFDict(file, {b"Type": PDFName(file, b"Annot"), b"Index": PDFInt(file, i)})
+
+
+def bench_single(count: int) -> float:
+    file = PDFFile("bench-alloc-single")
+    objs = list(make_annots(file, count))
+    start = time.perf_counter()
+    for obj in objs:
+        file.add_new_ref(obj)
+    file.trailer.update()
+    return time.perf_counter() - start
+
+
+def bench_bulk(count: int) -> float:
+    file = PDFFile("bench-alloc-bulk")
+    objs = list(make_annots(file, count))
+    start = time.perf_counter()
+    file.add_new_refs(objs)
+    file.trailer.update()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    total = int(argv[0]) if argv else 1_000_000
+    count = 10_000
+    while count <= total:
+        single = bench_single(count)
+        bulk = bench_bulk(count)
+        print(f"{count:>9} objects  add_new_ref {count / single:>12,.0f}/s  "
+              f"add_new_refs {count / bulk:>12,.0f}/s")
+        count *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Filter backend throughput.
+#
+#   python -m benchmarks.filters [size_mb]
+#
+# Each available backend of every filter decodes `size_mb` of page content
+# encoded by the lowest priority backend of the same filter, the pure Python
+# (or stdlib zlib) reference, and the throughput is printed next to it. The
+# predictor backends decode rows of Sub and Up only and of every PNG row
+# type. The conformance checks the backends have to pass are in
+# tests/test_filters.py.
+from __future__ import annotations
+
+import random
+import sys
+import time
+from typing import Any, Dict, Tuple
+
+from src.core.filters import FilterRegistry, Backend, PREDICTOR, row_length
+import src.core.stream  # registers the pure Python backends
+from benchmarks.synthetic import content
+
+
+def predicted(rng: random.Random, params: Dict[str, Any], rows: int,
+              kinds: Tuple[int, ...] = (0, 1, 2, 3, 4)) -> bytes:
+    _, row_len = row_length(params.get("colors", 1), params.get("bits_per_component", 8), params["columns"])
+    return b"".join(bytes([rng.choice(kinds)]) + rng.randbytes(row_len) for _ in range(rows))
+
+
+def throughput(backend: Backend, encoded: bytes, params: Dict[str, Any]) -> float:
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        backend.decode(encoded, **params)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    size = int(float(argv[0]) * (1 << 20)) if argv else 1 << 22
+    rng = random.Random(0)
+
+    missing = [(name, b.name) for name, backends in sorted(FilterRegistry.backends.items())
+               for b in backends if not b.available()]
+    for name, backend in missing:
+        print(f"{name.decode('ascii'):<18}{backend:<12}not installed")
+
+    data = content(rng, 0, size)
+    for name in (b"FlateDecode", b"LZWDecode", b"ASCII85Decode", b"ASCIIHexDecode", b"RunLengthDecode"):
+        reference = FilterRegistry.available(name)[-1]
+        encoded = reference.encode(data if name != b"LZWDecode" else data[:size // 8])
+        for backend in FilterRegistry.available(name):
+            seconds = throughput(backend, encoded, {})
+            print(f"{name.decode('ascii'):<18}{backend.name:<12}{len(encoded) / seconds / 1e6:>9.1f} MB/s in")
+    # rows of xref streams and most images use Sub and Up, Average and Paeth can only go row by row
+    params = {"predictor": 12, "colors": 3, "columns": 1024}
+    for label, kinds in (("Sub/Up", (1, 2)), ("mixed", (0, 1, 2, 3, 4))):
+        value = predicted(rng, params, size // (3 * 1024), kinds)
+        for backend in FilterRegistry.available(PREDICTOR):
+            seconds = throughput(backend, value, params)
+            print(f"{'Predictor ' + label:<18}{backend.name:<12}{len(value) / seconds / 1e6:>9.1f} MB/s in")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
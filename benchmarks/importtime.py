@@ -0,0 +1,68 @@
+# Import-time budget.
+#
+#   python -m benchmarks.importtime [runs] [budget_ms]
+#
+# Imports each module in a fresh interpreter with `python -X importtime`
+# and reports the median cumulative time. Opening a document must not load
+# the heavy optional dependencies (NumPy, Pillow, bitarray) nor the modules
+# only some features need, and src.core.file has to stay within the budget.
+# Exits with status 1 when either check fails. Run it with compiled bytecode
+# in place (python -m compileall src), otherwise the numbers include compiling.
+from __future__ import annotations
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BUDGET_MS = 30.0
+MODULES = ("src.core.file", "src.core.image", "src.core.cli")
+# must not be in sys.modules after `import src.core.file`
+LAZY_MODULES = ("numpy", "PIL", "bitarray", "dataclasses", "hashlib", "mmap", "src.core.cache",
+                "src.core.optimize", "src.core.linearize", "src.core.text", "src.core.crypt",
+                "src.core.query", "src.core.snapshot")
+LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def cumulative_ms(module: str) -> float:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, check=True, cwd=ROOT).stderr
+    for line in out.splitlines():
+        m = LINE.match(line)
+        if m and m.group(3) == module and not m.group(2):
+            return int(m.group(1)) / 1000
+    raise Exception(f"no importtime line for {module}")
+
+
+def loaded_after(module: str) -> list:
+    code = f"import sys, {module}; print(' '.join(sorted(sys.modules)))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT).stdout
+    loaded = set(out.split())
+    return [name for name in LAZY_MODULES if name in loaded]
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    runs = int(argv[0]) if argv else 7
+    budget = float(argv[1]) if len(argv) > 1 else BUDGET_MS
+    failed = False
+    for module in MODULES:
+        times = [cumulative_ms(module) for _ in range(runs)]
+        median = statistics.median(times)
+        over = module == "src.core.file" and median > budget
+        failed |= over
+        print(f"{module:<16} median {median:>7.1f} ms  min {min(times):>7.1f} ms"
+              + (f"  over budget of {budget:.0f} ms" if over else ""))
+    eager = loaded_after("src.core.file")
+    if eager:
+        failed = True
+        print("loaded by src.core.file:", ", ".join(eager))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
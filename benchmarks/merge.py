@@ -0,0 +1,66 @@
+# Merge benchmark.
+#
+#   python -m benchmarks.merge [sources] [scale]
+#
+# Generates `sources` synthetic documents of the "small" profile and merges
+# all their pages into one output, then splits the output back into one file
+# per source. The merge is timed untraced, then run again under tracemalloc:
+# its peak is printed next to the peak of merging a single source, and with
+# the streaming writer the two should stay within a small factor of each
+# other, whatever the number of sources.
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import List
+
+from src.core.file import PDFFile
+from src.core.merge import Merger
+from benchmarks.synthetic import PROFILES, generate
+
+
+def merge(paths: List[str], output: str) -> int:
+    tracemalloc.start()
+    Merger.merge(output, paths)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 100
+    profile = PROFILES["small"].scaled(float(argv[1]) if len(argv) > 1 else 1.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"source-{i}.pdf") for i in range(count)]
+        for i, path in enumerate(paths):
+            generate(path, profile, seed=i)
+        size = sum(os.path.getsize(path) for path in paths)
+
+        output = os.path.join(tmp, "merged.pdf")
+        start = time.perf_counter()
+        Merger.merge(output, paths)
+        elapsed = time.perf_counter() - start
+        single = merge(paths[:1], os.path.join(tmp, "single.pdf"))
+        peak = merge(paths, output)
+        pages = len(PDFFile(output).pages)
+        print(f"merge  {count} sources, {pages} pages, {size / 1e6:.1f} MB in {elapsed:.2f}s "
+              f"({size / elapsed / 1e6:.1f} MB/s)")
+        print(f"peak   {peak / 1e6:.2f} MB for all sources, {single / 1e6:.2f} MB for one")
+
+        groups = [range(i * profile.pages, (i + 1) * profile.pages) for i in range(count)]
+        start = time.perf_counter()
+        Merger.split(output, groups, (os.path.join(tmp, f"part-{i}.pdf") for i in range(count)))
+        elapsed = time.perf_counter() - start
+        print(f"split  {count} parts in {elapsed:.2f}s")
+        if pages != count * profile.pages:
+            print(f"expected {count * profile.pages} pages")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
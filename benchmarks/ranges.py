@@ -0,0 +1,69 @@
+# Range-request benchmark.
+#
+#   python -m benchmarks.ranges [count] [latency_ms] [directory]
+#
+# Writes a document with `count` objects and opens it through a RangeReader
+# whose fetch sleeps `latency_ms` per request, as a stand-in for HTTP range
+# requests against object storage. Touches the last page and a few scattered
+# objects, then reports the number of requests and the bytes fetched next to
+# the size of the file. Then resolves SCATTERED objects spread over the file,
+# once one at a time and once after PDFFile.prefetch(), which fetches them
+# with a single batched read.
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+
+from src.core.file import PDFFile
+from src.core.source import FileReader, RangeReader
+from benchmarks.reopen import write_document
+
+SCATTERED = 200
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 200_000
+    latency = float(argv[1]) / 1000 if len(argv) > 1 else 0.02
+    directory = argv[2] if len(argv) > 2 else tempfile.mkdtemp()
+    path = os.path.join(directory, "bench-ranges.pdf")
+    write_document(path, count)
+    local = FileReader(path)
+
+    def fetch(offset: int, length: int) -> bytes:
+        time.sleep(latency)
+        return local.read(offset, length)
+
+    remote = RangeReader(local.size, fetch)
+    start = time.perf_counter()
+    file = PDFFile(path, reader=remote)
+    opened = time.perf_counter() - start
+    file.pages[len(file.pages) - 1]
+    for num in range(count // 7, count, count // 7):
+        file.resolve(file.xref.table[num].ref)
+    total = time.perf_counter() - start
+    cached = file.doc.reader
+    print(f"{count:>9} objects  {local.size / 1e6:>8.1f} MB  open {opened * 1000:>8.1f} ms  "
+          f"total {total * 1000:>8.1f} ms  requests {remote.requests:>4}  "
+          f"fetched {remote.fetched / 1e6:>6.2f} MB  block hits {cached.hits} misses {cached.misses}")
+
+    for prefetch in (False, True):
+        remote = RangeReader(local.size, fetch)
+        file = PDFFile(path, reader=remote)
+        refs = [file.xref.table[num].ref for num in range(1, count, max(1, count // SCATTERED))]
+        before = remote.requests
+        start = time.perf_counter()
+        if prefetch:
+            file.prefetch(refs, depth=0)
+        for ref in refs:
+            file.resolve(ref)
+        elapsed = time.perf_counter() - start
+        print(f"{len(refs):>9} scattered  {'prefetch' if prefetch else 'one by one':<10}  "
+              f"{elapsed * 1000:>8.1f} ms  requests {remote.requests - before:>4}")
+    local.close()
+
+
+if __name__ == "__main__":
+    main()
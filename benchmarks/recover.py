@@ -0,0 +1,46 @@
+# Xref reconstruction benchmark.
+#
+#   python -m benchmarks.recover [count] [directory]
+#
+# Writes a document with `count` objects, cuts it off before its xref table
+# and times the open, which then rebuilds the table by scanning the buffer.
+# Reports the scan rate in MB/s next to the rate of a plain read of the file.
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+
+from src.core.file import PDFFile
+from benchmarks.reopen import write_document
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 1_000_000
+    directory = argv[1] if len(argv) > 1 else tempfile.mkdtemp()
+    path = os.path.join(directory, "bench-recover.pdf")
+    write_document(path, count)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:data.rindex(b"xref")])
+    size = os.path.getsize(path)
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        f.read()
+    read = time.perf_counter() - start
+
+    start = time.perf_counter()
+    file = PDFFile(path)
+    recover = time.perf_counter() - start
+    if not file.recovered or len(file.pages) == 0:
+        raise Exception("document was not recovered")
+    print(f"{count:>9} objects  {size / 1e6:>8.1f} MB  read {size / read / 1e6:>8.0f} MB/s  "
+          f"recover {recover * 1000:>8.1f} ms  {size / recover / 1e6:>6.0f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
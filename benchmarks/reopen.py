@@ -0,0 +1,68 @@
+# Sidecar index benchmark.
+#
+#   python -m benchmarks.reopen [count] [directory]
+#
+# Writes a document with `count` objects, then times a plain open, the first
+# open with index=True (which reads the xref and writes the .idx file) and a
+# reopen served from the index. The reopen should stay in the milliseconds
+# while the plain open grows with `count`.
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+
+from src.core.file import PDFFile
+
+PAGES = 1000
+
+
+def write_document(path: str, count: int) -> None:
+    pages = min(PAGES, max(1, count - 3))
+    kids = b" ".join(b"%d 0 R" % (3 + i) for i in range(pages))
+    offsets = []
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        for num in range(1, count + 1):
+            offsets.append(f.tell())
+            if num == 1:
+                body = b"<< /Type /Catalog /Pages 2 0 R >>"
+            elif num == 2:
+                body = b"<< /Type /Pages /Count %d /Kids [%s] /MediaBox [0 0 612 792] >>" % (pages, kids)
+            elif num < 3 + pages:
+                body = b"<< /Type /Page /Parent 2 0 R >>"
+            else:
+                body = b"<< /Type /Annot /Index %d >>" % num
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (num, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f\r\n" % (count + 1))
+        f.write(b"".join(b"%010d 00000 n\r\n" % off for off in offsets))
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count + 1, xref))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    ret = fn()
+    return ret, time.perf_counter() - start
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 1_000_000
+    directory = argv[1] if len(argv) > 1 else tempfile.mkdtemp()
+    path = os.path.join(directory, "bench-reopen.pdf")
+    write_document(path, count)
+    if os.path.exists(path + ".idx"):
+        os.remove(path + ".idx")
+
+    _, plain = timed(lambda: PDFFile(path))
+    _, build = timed(lambda: PDFFile(path, index=True))
+    file, reopen = timed(lambda: PDFFile(path, index=True))
+    _, lookup = timed(lambda: (file.pages[len(file.pages) - 1], file.resolve(file.xref.table[count].ref)))
+    print(f"{count:>9} objects  open {plain * 1000:>10.1f} ms  first indexed open {build * 1000:>10.1f} ms  "
+          f"reopen {reopen * 1000:>8.1f} ms  lookup {lookup * 1000:>6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Content-stream rewrite benchmark.
+#
+#   python -m benchmarks.rewrite [megabytes] [chunk_kb]
+#
+# Builds one Flate encoded content stream of `megabytes` of decoded text
+# operators and drops every Tj from it, once the whole-buffer way (decode,
+# parse, serialize, encode, set Stream.value) and once with
+# ContentRewriter.rewrite(), each under tracemalloc. The streaming peak
+# should be the stored data before and after plus about one chunk, while
+# the whole-buffer peak grows with the decoded size.
+from __future__ import annotations
+
+import random
+import sys
+import time
+import tracemalloc
+
+from src.core.file import PDFFile
+from src.core.objects import *
+from src.core.stream import Stream
+from src.core.filters import FilterRegistry
+from src.core.content import ContentParser, ContentRewriter
+from benchmarks.synthetic import content
+
+
+def build(file: PDFFile, data: bytes) -> PDFStream:
+    value = FilterRegistry.encode(data, b"FlateDecode")
+    return PDFStream(file, value, PDFDict(file, {b"Filter": PDFName(file, b"FlateDecode"),
+                                                 b"Length": PDFInt(file, len(value))}))
+
+
+def whole(stream: PDFStream) -> None:
+    ops = ContentParser.operations(Stream(stream).decode(), stream._file)
+    data = b"".join(ContentRewriter.operation_bytes(op, operands) for op, operands in ops if op != b"Tj")
+    Stream(stream).value = FilterRegistry.encode(data, b"FlateDecode")
+
+
+def streaming(stream: PDFStream, chunk_size: int) -> None:
+    ContentRewriter.rewrite(stream, lambda op, operands: [], {b"Tj"}, chunk_size=chunk_size)
+
+
+def measure(run, stream: PDFStream, *args) -> tuple:
+    start = time.perf_counter()
+    tracemalloc.start()
+    run(stream, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return time.perf_counter() - start, peak
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    size = int(float(argv[0] if argv else 16) * (1 << 20))
+    chunk_size = int(argv[1]) << 10 if len(argv) > 1 else 1 << 16
+    data = content(random.Random(0), 0, size)
+    file = PDFFile("rewrite")
+    stored = len(build(file, data).value)
+    print(f"stream {size / 1e6:.1f} MB decoded, {stored / 1e6:.2f} MB stored")
+
+    results = []
+    for name, run, args in (("whole", whole, ()), ("streaming", streaming, (chunk_size,))):
+        stream = build(file, data)
+        elapsed, peak = measure(run, stream, *args)
+        results.append(Stream(stream).decode())
+        print(f"{name:<10} {elapsed:6.2f}s  peak {peak / 1e6:8.2f} MB  stored {len(stream.value) / 1e6:.2f} MB")
+    if results[0] != results[1]:
+        print("outputs differ")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Snapshot benchmark and isolation checks.
+#
+#   python -m benchmarks.snapshot [snapshots] [scale]
+#
+# Generates a document of the "small" profile, takes `snapshots` snapshots
+# of it, each rotating one page, and reports the time per snapshot and edit
+# and the time to render one of them as an incremental update. Then checks
+# that writes the snapshots refuse leave nothing behind: a change to an
+# object shared with a later snapshot, and a change to an object of the
+# base file while snapshots are open, inside and outside active(); and that
+# a direct object put into two snapshots changes in one of them only. Exits
+# with status 1 when a refused or foreign value is visible afterwards or a
+# write that should be refused goes through.
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+
+from src.core.file import PDFFile
+from src.core.objects import *
+from benchmarks.synthetic import PROFILES, generate
+
+
+def refused(write) -> bool:
+    try:
+        write()
+    except Exception:
+        return True
+    return False
+
+
+def check(path: str) -> list:
+    failures = []
+    base = PDFFile(path)
+    root = base.trailer.extent[b"Root"]
+    first = base.snapshot()
+    catalog = first.edit(root)
+    catalog[b"A"] = PDFInt(first, 1)
+    second = first.snapshot()
+    # the copy of the first snapshot is shared with the second one now
+    if not refused(lambda: catalog.__setitem__(b"X", PDFInt(first, 1))):
+        failures.append("change to an object shared with a later snapshot went through")
+    for name, snapshot in (("first", first), ("second", second)):
+        if b"X" in snapshot.resolve(root).value:
+            failures.append(f"refused value visible through the {name} snapshot")
+    if b"A" not in second.resolve(root).value:
+        failures.append("second snapshot lost the change made before it was taken")
+
+    base_catalog = base.resolve(root)
+    if not refused(lambda: base_catalog.__setitem__(b"Y", PDFInt(base, 1))):
+        failures.append("change to the base file went through while snapshots are open")
+    with second.active():
+        if not refused(lambda: base_catalog.__setitem__(b"Z", PDFInt(base, 1))):
+            failures.append("change to the base file went through inside active()")
+    if b"Y" in base_catalog.value or b"Z" in base_catalog.value or base.dirty:
+        failures.append("refused value visible in the base file")
+
+    # a direct object put into the copies of two snapshots is changed through the first one only
+    third, fourth = base.snapshot(), base.snapshot()
+    shared = PDFDict(third, {})
+    third.edit(root)[b"D"] = shared
+    fourth.edit(root)[b"D"] = shared
+    third.resolve(root).value[b"D"][b"X"] = PDFInt(third, 1)
+    if b"X" in fourth.resolve(root).value[b"D"].value:
+        failures.append("change to a direct object shows through another snapshot it was put into")
+    third.close()
+    fourth.close()
+
+    first.close()
+    second.close()
+    if refused(lambda: base_catalog.__setitem__(b"Y", PDFInt(base, 1))):
+        failures.append("base file still frozen after its snapshots were closed")
+    return failures
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 1000
+    profile = PROFILES["small"].scaled(float(argv[1]) if len(argv) > 1 else 1.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "base.pdf")
+        generate(path, profile, seed=0)
+        base = PDFFile(path)
+        pages = [page.ref for page in base.pages]
+
+        start = time.perf_counter()
+        snapshots = []
+        for i in range(count):
+            snapshot = base.snapshot()
+            snapshot.edit(pages[i % len(pages)])[b"Rotate"] = PDFInt(snapshot, 90)
+            snapshots.append(snapshot)
+        elapsed = time.perf_counter() - start
+        print(f"snapshot+edit  {count} in {elapsed:.3f}s ({elapsed / count * 1e6:.0f} us each)")
+
+        start = time.perf_counter()
+        data = snapshots[-1].render()
+        print(f"render         {len(data) / 1e6:.2f} MB in {time.perf_counter() - start:.3f}s")
+        for snapshot in snapshots:
+            snapshot.close()
+
+        failures = check(path)
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# Benchmark suite over synthetic documents.
+#
+#   python -m benchmarks.suite [--profiles small,flate] [--scale 1.0] [--repeat 3]
+#                              [--output results.json] [--baseline old.json] [--tolerance 0.25]
+#
+# For every profile of benchmarks.synthetic a document is generated once, then
+# each stage is timed (best of `repeat`) and run once more under tracemalloc
+# for its peak allocation:
+#
+#   open         PDFFile(path): header, startxref, xref sections (Tokenizer, XRefParser)
+#   resolve      every object of the xref (Parser)
+#   decode       every stream through its filter chain (Filter)
+#   save         render() of the whole document
+#   incremental  incremental_update() after editing one object
+#
+# Results are printed as a table and written as JSON with --output. With
+# --baseline the run is compared to an earlier JSON file and the exit status
+# is 1 when a stage got slower than the tolerance allows.
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from src.core.file import PDFFile
+from src.core.objects import *
+from src.core.stream import Stream
+from benchmarks.synthetic import PROFILES, Profile, generate
+
+# stages faster than this are timer noise and never reported as regressions
+MIN_COMPARE_SECONDS = 0.005
+
+
+def resolve_all(file: PDFFile) -> List[PDFObject]:
+    return [file.resolve(file.xref.table[num].ref) for num in list(file.xref.table)]
+
+
+def decode_all(objs: List[PDFObject]) -> int:
+    return sum(len(Stream(obj).decode()) for obj in objs if isinstance(obj, PDFStream))
+
+
+def edit_one(file: PDFFile) -> PDFFile:
+    root = file.trailer.Root
+    root[b"Benchmark"] = PDFInt(file, 1)
+    return file
+
+
+def stages(path: str, out: str) -> Dict[str, tuple]:
+    # name: (setup, run), only run is measured
+    return {
+        "open": (lambda: path, lambda p: PDFFile(p)),
+        "resolve": (lambda: PDFFile(path), resolve_all),
+        "decode": (lambda: resolve_all(PDFFile(path)), decode_all),
+        "save": (lambda: PDFFile(path), lambda f: f.render()),
+        "incremental": (lambda: edit_one(PDFFile(path)), lambda f: f.incremental_update(out, overwrite=True)),
+    }
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], Any], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    state = setup()
+    tracemalloc.start()
+    try:
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    times.sort()
+    return {"seconds": times[0], "median": times[len(times) // 2], "peak_bytes": peak}
+
+
+def run_profile(profile: Profile, directory: str, repeat: int) -> List[Dict[str, Any]]:
+    path = os.path.join(directory, f"bench-{profile.name}.pdf")
+    start = time.perf_counter()
+    generate(path, profile)
+    generated = time.perf_counter() - start
+    file = PDFFile(path)
+    info = {"profile": profile.name, "file_bytes": os.path.getsize(path), "objects": len(file.xref.table),
+            "pages": profile.pages, "generate_seconds": round(generated, 6)}
+    results = []
+    for stage, (setup, run) in stages(path, path + ".out").items():
+        result = dict(info, stage=stage)
+        result.update(measure(setup, run, repeat))
+        results.append(result)
+    for leftover in (path, path + ".out"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    old = {(r["profile"], r["stage"]): r for r in baseline}
+    ret = []
+    for r in results:
+        prev = old.get((r["profile"], r["stage"]))
+        if prev is None or prev["seconds"] < MIN_COMPARE_SECONDS:
+            continue
+        ratio = r["seconds"] / prev["seconds"]
+        if ratio > 1 + tolerance:
+            ret.append(f"{r['profile']}/{r['stage']}: {prev['seconds'] * 1000:.1f} ms -> "
+                       f"{r['seconds'] * 1000:.1f} ms ({ratio:.2f}x)")
+    return ret
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="comma separated, default all")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies pages and filler objects")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--directory", help="where the documents are generated, default a temp directory")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    directory = args.directory or tempfile.mkdtemp()
+    results = []
+    print(f"{'profile':<14}{'stage':<13}{'objects':>9}{'MB':>9}{'best ms':>11}{'median ms':>11}{'peak MB':>9}")
+    for name in args.profiles.split(","):
+        profile = PROFILES[name].scaled(args.scale)
+        for r in run_profile(profile, directory, max(1, args.repeat)):
+            results.append(r)
+            print(f"{r['profile']:<14}{r['stage']:<13}{r['objects']:>9}{r['file_bytes'] / 1e6:>9.2f}"
+                  f"{r['seconds'] * 1000:>11.1f}{r['median'] * 1000:>11.1f}{r['peak_bytes'] / 1e6:>9.1f}")
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(), "scale": args.scale,
+                       "repeat": args.repeat, "results": results}, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print("regression", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
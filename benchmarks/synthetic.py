@@ -0,0 +1,170 @@
+# Synthetic documents for the benchmark suite.
+#
+#   python -m benchmarks.synthetic <profile> <path> [scale]
+#
+# Builds a document with the library's own writer: a page tree with the given
+# fan-out, one content stream per page encoded with a filter chain, filler
+# annotations spread over the pages, optionally a cross-reference stream in
+# place of the table and a number of incremental revisions on top.
+from __future__ import annotations
+
+import dataclasses
+import random
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from src.core.file import PDFFile
+from src.core.objects import *
+from src.core.stream import Filter
+from src.core.xref import RefSrcFromTk
+
+
+@dataclass
+class Profile:
+    name: str
+    pages: int = 100
+    fanout: int = 16
+    filler: int = 0
+    stream_size: int = 1 << 12
+    filters: Tuple[bytes, ...] = (b"FlateDecode",)
+    xref_stream: bool = False
+    revisions: int = 0
+    edits: int = 100
+
+    def scaled(self, scale: float) -> Profile:
+        return dataclasses.replace(self, pages=max(1, int(self.pages * scale)), filler=int(self.filler * scale))
+
+
+PROFILES: Dict[str, Profile] = {profile.name: profile for profile in (
+    Profile("small", pages=10, filler=100),
+    Profile("many-objects", pages=1000, filler=200_000, stream_size=256),
+    Profile("deep-tree", pages=20_000, fanout=2, stream_size=64),
+    Profile("flate", pages=200, stream_size=1 << 18),
+    Profile("lzw", pages=200, stream_size=1 << 16, filters=(b"LZWDecode",)),
+    Profile("ascii85", pages=200, stream_size=1 << 16, filters=(b"ASCII85Decode", b"FlateDecode")),
+    Profile("xref-stream", pages=1000, filler=100_000, stream_size=256, xref_stream=True),
+    Profile("revisions", pages=1000, filler=50_000, stream_size=256, revisions=20, edits=500),
+)}
+
+
+def content(rng: random.Random, page: int, size: int) -> bytes:
+    # text operators with varying numbers, compressible like real page content
+    ops = []
+    length = 0
+    while length < size:
+        op = b"BT /F1 %d Tf %d %d Td (Page %d line %d) Tj ET\n" % (
+            rng.randint(8, 14), rng.randint(36, 72), rng.randint(36, 756), page, len(ops))
+        ops.append(op)
+        length += len(op)
+    return b"".join(ops)[:size]
+
+
+def encode(data: bytes, filters: Tuple[bytes, ...]) -> bytes:
+    # filters are listed in decoding order, so encoding applies them back to front
+    for name in reversed(filters):
+        data = Filter.encode(data, name)
+    return data
+
+
+def build_page_tree(file: PDFFile, page_refs: List[IndRef], fanout: int) -> IndRef:
+    level = page_refs
+    while True:
+        nodes = []
+        for start in range(0, len(level), fanout):
+            kids = level[start:start + fanout]
+            count = 0
+            for kid in kids:
+                obj = file.resolve(kid)
+                count += obj[b"Count"].value if b"Count" in obj else 1
+            node = PDFDict(file, {b"Type": PDFName(file, b"Pages"), b"Kids": PDFArray(file, list(kids)),
+                                  b"Count": PDFInt(file, count)})
+            ref = file.add_new_ref(node)
+            for kid in kids:
+                file.resolve(kid)[b"Parent"] = ref
+            nodes.append(ref)
+        if len(nodes) == 1:
+            return nodes[0]
+        level = nodes
+
+
+def to_xref_stream(path: str) -> None:
+    # the writer only emits xref tables, so the table is swapped for an equivalent stream here
+    file = PDFFile(path)
+    offsets = {num: src.offset for num, src in file.xref.table.items() if isinstance(src, RefSrcFromTk)}
+    data = file.doc[:file.header_pos + file.last_xref_offset].tobytes()
+    num = file.xref.max_num + 1
+    offsets[num] = len(data) - file.header_pos
+    rows = bytearray(b"\x00\x00\x00\x00\x00\xff\xff")
+    for i in range(1, num + 1):
+        rows += b"\x01" + offsets[i].to_bytes(4, "big") + b"\x00\x00" if i in offsets else bytes(7)
+    extent = PDFDict(file, dict(file.trailer.extent.value))
+    extent.value.pop(b"Prev", None)
+    value = Filter.FlateEncode(bytes(rows))
+    extent.value.update({b"Type": PDFName(file, b"XRef"), b"Size": PDFInt(file, num + 1),
+                         b"W": PDFArray(file, [PDFInt(file, 1), PDFInt(file, 4), PDFInt(file, 2)]),
+                         b"Filter": PDFName(file, b"FlateDecode"), b"Length": PDFInt(file, len(value))})
+    stream = PDFStream(file, value, extent)
+    with open(path, "wb") as f:
+        f.write(data)
+        f.write(f"{num} 0 obj\n".encode('ascii') + stream.to_bytes() + b"\nendobj\n")
+        f.write(f"startxref\n{offsets[num]}\n%%EOF\n".encode('ascii'))
+
+
+def add_revisions(path: str, profile: Profile, rng: random.Random) -> None:
+    for rev in range(profile.revisions):
+        file = PDFFile(path)
+        nums = [num for num in file.xref.table if num > 0]
+        with file.edit():
+            for num in rng.sample(nums, min(profile.edits, len(nums))):
+                obj = file.resolve(file.xref.table[num].ref)
+                if isinstance(obj, PDFDict):
+                    obj[b"Rev"] = PDFInt(file, rev + 1)
+        file.incremental_update(overwrite=True)
+
+
+def generate(path: str, profile: Profile, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    file = PDFFile(path + ".new")
+    font = file.add_new_ref(PDFDict(file, {b"Type": PDFName(file, b"Font"), b"Subtype": PDFName(file, b"Type1"),
+                                           b"BaseFont": PDFName(file, b"Helvetica")}))
+    resources = PDFDict(file, {b"Font": PDFDict(file, {b"F1": font})})
+    filters = [PDFName(file, name) for name in profile.filters]
+    page_refs = []
+    for i in range(profile.pages):
+        value = encode(content(rng, i, profile.stream_size), profile.filters)
+        extent = PDFDict(file, {b"Length": PDFInt(file, len(value)),
+                                b"Filter": PDFArray(file, list(filters)) if len(filters) > 1 else filters[0]})
+        contents = file.add_new_ref(PDFStream(file, value, extent))
+        page = PDFDict(file, {b"Type": PDFName(file, b"Page"), b"Contents": contents,
+                              b"Resources": PDFDict(file, dict(resources.value)),
+                              b"MediaBox": PDFArray(file, [PDFInt(file, v) for v in (0, 0, 612, 792)])})
+        page_refs.append(file.add_new_ref(page))
+
+    annots: List[List[IndRef]] = [[] for _ in page_refs]
+    fillers = (PDFDict(file, {b"Type": PDFName(file, b"Annot"), b"Subtype": PDFName(file, b"Text"),
+                              b"Rect": PDFArray(file, [PDFInt(file, v) for v in (0, 0, 10, 10)]),
+                              b"Contents": PDFString(file, b"note %d" % i)}) for i in range(profile.filler))
+    for i, ref in enumerate(file.add_new_refs(fillers)):
+        annots[i % len(annots)].append(ref)
+    for ref, refs in zip(page_refs, annots):
+        if refs:
+            file.resolve(ref)[b"Annots"] = PDFArray(file, refs)
+
+    root = build_page_tree(file, page_refs, max(2, profile.fanout))
+    file.trailer.Root = PDFDict(file, {b"Type": PDFName(file, b"Catalog"), b"Pages": root})
+    file.save(path, overwrite=True)
+
+    if profile.xref_stream:
+        to_xref_stream(path)
+    add_revisions(path, profile, rng)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    profile = PROFILES[argv[0]].scaled(float(argv[2]) if len(argv) > 2 else 1.0)
+    generate(argv[1], profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,6 @@
+import sys
 
-from src.core.file import PDFFile
-from src.core.objects import *
-from src.core.stream import Filter, Stream
+from src.core.cli import main
 
-
-file = PDFFile('test.pdf')
-
-# with open("result", "wb") as f:
-#     for key in file.xref.table:
-#         obj = file.xref.table[key].read()
-#         if isinstance(obj, PDFStream):
-#             s = Stream(obj)
-#             try:
-#                 s.decode()
-#             except Exception as e:
-#                 f.write(str(e).encode('utf-8'))
-#                 f.write(str(obj.extent.value).encode('utf-8'))
-
-stream = file.resolve(IndRef(file, 266, 0))
-s = Stream(stream)
-s.decode().plot()
+# python main.py <command> <paths...>, same as python -m src.core
+sys.exit(main())
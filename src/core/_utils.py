@@ -1,36 +1,49 @@
 
 from __future__ import annotations
 
+import re
 from typing import Protocol
 
 
 whitespace_chars = set(b"\0\t\n\f\r ")
 delimiter_chars = set(b"()<>[]{}/%")
+string_escapes = {ord("n"): ord("\n"), ord("r"): ord("\r"), ord("t"): ord("\t"), ord("b"): ord("\b"),
+                  ord("f"): ord("\f"), ord("("): ord("("), ord(")"): ord(")"), ord("\\"): ord("\\")}
+RFIND_CHUNK_SIZE = 1 << 16
 
 
 def two_digit_hex_code(b: int, upper=True) -> str:
     if upper:
-        return f"{hex(b)[2:].upper():02}"
-    return f"{hex(b)[2:]:02}"
+        return f"{b:02X}"
+    return f"{b:02x}"
 
 
 def find_from_memoryview(x: bytes, src: memoryview, start_pos=0, end_pos=-1) -> int:
     if end_pos < 0:
         end_pos += len(src)
+    if not isinstance(src, memoryview):
+        return src.find(x, start_pos, end_pos)
 
-    for i in range(start_pos, end_pos - len(x)):
-        if src[i:i + len(x)].tobytes() == x:
-            return i
-    return -1
+    m = re.compile(re.escape(x)).search(src, start_pos, end_pos)
+    return -1 if m is None else m.start()
 
 
 def rfind_from_memoryview(x: bytes, src: memoryview, start_pos=0, end_pos=-1) -> int:
     if end_pos < 0:
         end_pos += len(src)
-
-    for i in range(end_pos-len(x), start_pos-1, -1):
-        if src[i:i + len(x)].tobytes() == x:
-            return i
+    if not isinstance(src, memoryview):
+        return src.rfind(x, start_pos, end_pos)
+
+    # backwards in chunks, keywords like %%EOF and startxref are almost always near the end
+    hi = end_pos
+    while hi - start_pos >= len(x):
+        lo = max(start_pos, hi - RFIND_CHUNK_SIZE)
+        i = src[lo:hi].tobytes().rfind(x)
+        if i != -1:
+            return lo + i
+        if lo == start_pos:
+            break
+        hi = lo + len(x) - 1
     return -1
 
 
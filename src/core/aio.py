@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Protocol, TypeVar
+
+from .file import PDFFile
+from .objects import *
+from .pages import Page
+from .stream import Stream
+
+R = TypeVar("R")
+
+
+class AsyncStorage(Protocol):
+    async def read(self, path: str) -> bytes: ...
+
+    async def write(self, path: str, data: bytes) -> None: ...
+
+
+class LocalStorage:
+    # plain files, the blocking calls run on the executor
+    executor: Optional[Executor]
+
+    def __init__(self, executor: Optional[Executor] = None):
+        self.executor = executor
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(data)
+
+    async def read(self, path: str) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._read, path)
+
+    async def write(self, path: str, data: bytes) -> None:
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write, path, data)
+
+
+class AsyncPDFFile:
+    file: PDFFile
+    storage: AsyncStorage
+    executor: Optional[Executor]
+    concurrency: int
+    _slots: asyncio.Semaphore
+    _lock: threading.Lock
+
+    def __init__(self, file: PDFFile, storage: AsyncStorage, executor: Optional[Executor] = None,
+                 concurrency: int = 4):
+        self.file = file
+        self.storage = storage
+        self.executor = executor
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # object parsing mutates shared caches, decompression of already resolved streams runs unlocked
+        self._lock = threading.Lock()
+
+    @staticmethod
+    async def open(path: str, storage: Optional[AsyncStorage] = None, executor: Optional[Executor] = None,
+                   concurrency: int = 4, recover: bool = True, password: bytes | str = b"") -> AsyncPDFFile:
+        storage = storage if storage is not None else LocalStorage(executor)
+        data = await storage.read(path)
+        loop = asyncio.get_running_loop()
+        file = await loop.run_in_executor(executor, functools.partial(PDFFile, path, recover=recover, data=data,
+                                                                       password=password))
+        return AsyncPDFFile(file, storage, executor, concurrency)
+
+    async def _run(self, fn: Callable[..., R], *args) -> R:
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _ref(self, ref: IndRef | int) -> IndRef:
+        if isinstance(ref, IndRef):
+            return ref
+        src = self.file.xref.table.get(ref)
+        return src.ref if src is not None else IndRef(self.file, ref, 0)
+
+    def _resolve(self, ref: IndRef) -> PDFObject:
+        with self._lock:
+            return self.file.resolve(ref)
+
+    def _decode(self, ref: IndRef) -> bytes:
+        obj = self._resolve(ref)
+        if not isinstance(obj, PDFStream):
+            raise Exception(f"Expect PDFStream but got {type(obj).__name__}")
+        return Stream(obj).decode()
+
+    def _page(self, index: int) -> Page:
+        with self._lock:
+            return self.file.pages[index]
+
+    def _page_count(self) -> int:
+        with self._lock:
+            return len(self.file.pages)
+
+    async def resolve(self, ref: IndRef | int) -> PDFObject:
+        return await self._run(self._resolve, self._ref(ref))
+
+    async def decode_stream(self, ref: IndRef | int) -> bytes:
+        return await self._run(self._decode, self._ref(ref))
+
+    async def page(self, index: int) -> Page:
+        return await self._run(self._page, index)
+
+    async def page_count(self) -> int:
+        return await self._run(self._page_count)
+
+    async def save(self, path: Optional[str] = None, compact: bool = False) -> Optional[Dict[IndRef, IndRef]]:
+        # takes every slot, so no resolve of this file runs while the document is rendered
+        acquired = 0
+        try:
+            for _ in range(self.concurrency):
+                await self._slots.acquire()
+                acquired += 1
+            data, renumbered = await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(self.file.render, compact))
+        finally:
+            for _ in range(acquired):
+                self._slots.release()
+        await self.storage.write(self.file.filename if path is None else path, data)
+        return renumbered
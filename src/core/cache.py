@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from typing import Sequence
+
+from .objects import *
+from .reader import Tokenizer, Parser
+from .xref import XRef, IndexedTable, RefSrcFromTk, RefSrcFromObjStm, FREE, IN_FILE, IN_OBJSTM, MISSING
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+
+INDEX_MAGIC = b"PDFIDX\r\n"
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+KEY_BLOCK_SIZE = 1 << 16
+NO_PAGES = 0xFFFFFFFF
+
+# magic, version, byte order mark, file size, mtime_ns, digest of the first and last key blocks,
+# header_pos, eof_pos, last_xref_offset, number of entries, max_num, free count, page count,
+# objstm count, objstm pair count, trailer length, crc32 of everything after the header
+HEADER = struct.Struct("=8sIHxxQq32sqqqIIIIIIII")
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+class SidecarIndex:
+    # memory mapped image of the merged xref, the object stream offset tables and the page order
+    path: str
+    trailer: PDFDict
+    page_nums: Optional[Sequence[int]]
+    _mm: mmap.mmap
+    _objstm: memoryview
+    _objstm_pairs: memoryview
+    _objstm_dir: Optional[Dict[int, Tuple[int, int]]] = None
+
+    def __init__(self, path: str, mm: mmap.mmap, trailer: PDFDict, page_nums: Optional[Sequence[int]],
+                 objstm: memoryview, objstm_pairs: memoryview):
+        self.path = path
+        self.trailer = trailer
+        self._mm = mm
+        self.page_nums = page_nums
+        self._objstm = objstm
+        self._objstm_pairs = objstm_pairs
+
+    @staticmethod
+    def path(filename: str) -> str:
+        return filename + INDEX_SUFFIX
+
+    @staticmethod
+    def key(file: PDFFile) -> Tuple[int, int, bytes]:
+        st = os.stat(file.filename)
+        doc = file.doc
+        digest = hashlib.sha256(doc[:KEY_BLOCK_SIZE].tobytes())
+        digest.update(doc[max(0, len(doc) - KEY_BLOCK_SIZE):].tobytes())
+        return st.st_size, st.st_mtime_ns, digest.digest()
+
+    def objstm_offsets(self, num: int) -> Optional[List[Tuple[int, int]]]:
+        if self._objstm_dir is None:
+            table = self._objstm
+            self._objstm_dir = {table[i]: (table[i + 1], table[i + 2]) for i in range(0, len(table), 3)}
+        entry = self._objstm_dir.get(num)
+        if entry is None:
+            return None
+        start, count = entry
+        pairs = self._objstm_pairs[2 * start:2 * (start + count)]
+        return [(pairs[i], pairs[i + 1]) for i in range(0, len(pairs), 2)]
+
+    @staticmethod
+    def load(file: PDFFile, path: str) -> Optional[SidecarIndex]:
+        # None when the index is missing, stale or damaged, the caller then rebuilds it
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            index = SidecarIndex._parse(file, path, mm)
+        except (struct.error, ValueError, TypeError, SyntaxError):
+            index = None
+        if index is None:
+            try:
+                mm.close()
+            except BufferError:
+                pass
+        return index
+
+    @staticmethod
+    def _parse(file: PDFFile, path: str, mm: mmap.mmap) -> Optional[SidecarIndex]:
+        if len(mm) < HEADER.size:
+            return None
+        (magic, version, bom, size, mtime, digest, header_pos, eof_pos, last_xref_offset, count,
+         max_num, free_count, page_count, objstm_count, pair_count, trailer_len, crc) = HEADER.unpack_from(mm)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or bom != 0xFEFF:
+            return None
+        if (size, mtime, digest) != SidecarIndex.key(file):
+            return None
+        if zlib.crc32(memoryview(mm)[HEADER.size:]) != crc:
+            return None
+
+        view = memoryview(mm)
+        pos = HEADER.size
+
+        def column(fmt: str, n: int) -> memoryview:
+            nonlocal pos
+            width = struct.calcsize(fmt)
+            col = view[pos:pos + width * n]
+            if len(col) != width * n:
+                raise ValueError("truncated index")
+            pos = _align(pos + width * n)
+            return col.cast(fmt)
+
+        trailer = column("B", trailer_len).tobytes()
+        kinds = column("B", count)
+        gens = column("H", count)
+        offsets = column("Q", count)
+        indices = column("I", count)
+        free_nums = column("I", free_count)
+        page_nums = column("I", page_count if page_count != NO_PAGES else 0)
+        objstm = column("I", 3 * objstm_count)
+        objstm_pairs = column("I", 2 * pair_count)
+
+        trailer = Parser.parse_object(Tokenizer(memoryview(trailer)), file)
+        if not isinstance(trailer, PDFDict):
+            return None
+        if (header_pos, eof_pos) != (file.header_pos, file.eof_pos):
+            # a recovered file is scanned past its last %%EOF, the key already vouches for the bytes
+            file.header_pos, file.eof_pos = header_pos, eof_pos
+            file.tk = Tokenizer(file.doc[header_pos:eof_pos])
+        xref = XRef(file)
+        xref.table = IndexedTable(file, kinds, gens, offsets, indices)
+        xref.max_num = max_num
+        xref.free_nums = free_nums.tolist()
+        file.xref = xref
+        file.last_xref_offset = last_xref_offset
+        return SidecarIndex(path, mm, trailer, page_nums if page_count != NO_PAGES else None,
+                            objstm, objstm_pairs)
+
+    @staticmethod
+    def _page_nums(file: PDFFile) -> Optional[List[int]]:
+        try:
+            ret = []
+            for page in file.pages:
+                if page.ref is None:
+                    return None
+                ret.append(page.ref.N)
+            return ret
+        except Exception:
+            return None
+
+    @staticmethod
+    def write(file: PDFFile, path: str) -> bool:
+        # best effort, a read-only location only means the next open reads the xref again
+        count = file.xref.max_num + 1
+        kinds = array("B", bytes([MISSING]) * count)
+        gens = array("H", bytes(2 * count))
+        offsets = array("Q", bytes(8 * count))
+        indices = array("I", bytes(4 * count))
+        streams: Set[int] = set()
+        for num, src in file.xref.table.items():
+            if num >= count:
+                continue
+            gens[num] = src.ref.G
+            if isinstance(src, RefSrcFromTk):
+                kinds[num] = IN_FILE
+                offsets[num] = src.offset
+            elif isinstance(src, RefSrcFromObjStm):
+                kinds[num] = IN_OBJSTM
+                offsets[num] = src.stream_num
+                indices[num] = src.index
+                streams.add(src.stream_num)
+            elif src.obj is PDFNull(file):
+                kinds[num] = FREE
+            else:
+                # only objects that are still in the file can be indexed
+                return False
+        free_nums = array("I", [num for num in file.xref.free_nums if file.xref.is_free(num)])
+
+        objstm = array("I")
+        objstm_pairs = array("I")
+        for num in sorted(streams):
+            try:
+                stream = file.object_stream(num)
+            except (SyntaxError, ValueError):
+                continue
+            objstm.extend((num, len(objstm_pairs) // 2, len(stream.offsets)))
+            for n, off in stream.offsets:
+                objstm_pairs.extend((n, off))
+
+        page_nums = SidecarIndex._page_nums(file)
+        trailer = file.trailer.extent.to_bytes()
+
+        body = bytearray()
+        for part in (trailer, kinds, gens, offsets, indices, free_nums,
+                     array("I", page_nums or []), objstm, objstm_pairs):
+            body += part if isinstance(part, bytes) else part.tobytes()
+            body += bytes(_align(len(body)) - len(body))
+
+        size, mtime, digest = SidecarIndex.key(file)
+        header = HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0xFEFF, size, mtime, digest,
+                             file.header_pos, file.eof_pos, file.last_xref_offset, count, file.xref.max_num,
+                             len(free_nums), NO_PAGES if page_nums is None else len(page_nums),
+                             len(objstm) // 3, len(objstm_pairs) // 2, len(trailer), zlib.crc32(body))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(header)
+                f.write(body)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Any, Tuple
+
+from .file import PDFFile
+from .objects import PDFStream, PDFNull, PDFDict
+from .stream import Stream
+
+GLOB_CHARS = set("*?[")
+DEFAULT_TIMEOUT = 60.0
+
+
+class Commands:
+    # every command takes an opened file and the parsed options and returns a JSON serializable dict
+    @staticmethod
+    def _output_path(path: str, options: Dict[str, Any], suffix: str) -> Optional[str]:
+        # the path of the input below the directory or glob it was found in is kept under the output directory
+        if options.get("output") is None:
+            return None
+        stem = os.path.splitext(options.get("relative") or os.path.basename(path))[0]
+        out = os.path.join(options["output"], stem + suffix)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        return out
+
+    @staticmethod
+    def stats(file: PDFFile, options: Dict[str, Any]) -> Dict[str, Any]:
+        streams = 0
+        stream_bytes = 0
+        objects = 0
+        for num in file.xref.table:
+            src = file.xref.table[num]
+            obj = file.resolve(src.ref)
+            if obj is PDFNull(file):
+                continue
+            objects += 1
+            if isinstance(obj, PDFStream):
+                streams += 1
+                stream_bytes += len(obj.value)
+        return {
+            "size": len(file.doc),
+            "version": file.doc[file.header_pos + 5:file.header_pos + 8].tobytes().decode("latin-1"),
+            "pages": len(file.pages),
+            "objects": objects,
+            "streams": streams,
+            "stream_bytes": stream_bytes,
+            "max_num": file.xref.max_num,
+            "encrypted": b"Encrypt" in file.trailer.extent,
+            "recovered": file.recovered,
+        }
+
+    @staticmethod
+    def decode_streams(file: PDFFile, options: Dict[str, Any]) -> Dict[str, Any]:
+        decoded = 0
+        decoded_bytes = 0
+        failures = []
+        for num in file.xref.table:
+            src = file.xref.table[num]
+            obj = file.resolve(src.ref)
+            if not isinstance(obj, PDFStream):
+                continue
+            try:
+                decoded_bytes += len(Stream(obj).decode())
+                decoded += 1
+            except Exception as e:
+                failures.append({"num": num, "gen": src.ref.G, "error": f"{type(e).__name__}: {e}"})
+        return {"decoded": decoded, "decoded_bytes": decoded_bytes, "failed": len(failures), "failures": failures}
+
+    @staticmethod
+    def compact(file: PDFFile, options: Dict[str, Any]) -> Dict[str, Any]:
+        out = Commands._output_path(file.filename, options, ".pdf")
+        if out is None:
+            if not options.get("in_place"):
+                raise Exception("compact needs --output or --in-place")
+            out = file.filename
+        before = len(file.doc)
+        renumbered = file.save(out, compact=True, overwrite=True)
+        return {"output": out, "size_before": before, "size_after": os.path.getsize(out),
+                "objects": len(renumbered or {})}
+
+    @staticmethod
+    def recompress(file: PDFFile, options: Dict[str, Any]) -> Dict[str, Any]:
+        out = Commands._output_path(file.filename, options, ".pdf")
+        if out is None:
+            if not options.get("in_place"):
+                raise Exception("recompress needs --output or --in-place")
+            out = file.filename
+        before = len(file.doc)
+        # the batch runs one process per file already, one thread each
+        result = file.recompress(level=options.get("level", 9), workers=1)
+        file.save(out, overwrite=True)
+        return {"output": out, "size_before": before, "size_after": os.path.getsize(out),
+                "streams": len(result.streams), "bytes_saved": result.bytes_saved, "skipped": result.skipped,
+                "backend": result.backend, "level": result.level, "seconds": round(result.seconds, 6)}
+
+    @staticmethod
+    def extract_text(file: PDFFile, options: Dict[str, Any]) -> Dict[str, Any]:
+        from .text import TextExtractor
+        extractor = TextExtractor(file)
+        pages = [extractor.page_text(page) for page in file.pages]
+        out = Commands._output_path(file.filename, options, ".txt")
+        if out is None:
+            return {"pages": len(pages), "text": pages}
+        with open(out, "w", encoding="utf-8") as f:
+            f.write("\f".join(pages))
+        return {"pages": len(pages), "output": out, "chars": sum(map(len, pages))}
+
+
+COMMANDS: Dict[str, Callable[[PDFFile, Dict[str, Any]], Dict[str, Any]]] = {
+    "stats": Commands.stats,
+    "decode-streams": Commands.decode_streams,
+    "compact": Commands.compact,
+    "recompress": Commands.recompress,
+    "extract-text": Commands.extract_text,
+}
+
+
+def iter_paths(patterns: Iterable[str], recursive: bool = False) -> Iterator[str]:
+    for path, _ in iter_inputs(patterns, recursive):
+        yield path
+
+
+def output_key(relative: str) -> str:
+    return os.path.normcase(os.path.normpath(os.path.splitext(relative)[0]))
+
+
+def iter_inputs(patterns: Iterable[str], recursive: bool = False) -> Iterator[Tuple[str, str]]:
+    # (path, path relative to the directory or the fixed part of the glob it was found in)
+    seen = set()
+    for pattern in patterns:
+        base = None
+        if os.path.isdir(pattern):
+            base = pattern
+            if recursive:
+                found = []
+                for root, _, names in os.walk(pattern):
+                    found += [os.path.join(root, name) for name in names if name.lower().endswith(".pdf")]
+            else:
+                found = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                         if name.lower().endswith(".pdf")]
+            found.sort()
+        elif GLOB_CHARS & set(pattern):
+            fixed = pattern[:min(pattern.index(c) for c in GLOB_CHARS if c in pattern)]
+            base = os.path.dirname(fixed) or os.curdir
+            found = sorted(glob.glob(pattern, recursive=recursive))
+        else:
+            found = [pattern]
+        for path in found:
+            if path not in seen:
+                seen.add(path)
+                yield path, os.path.relpath(path, base) if base is not None else os.path.basename(path)
+
+
+def run_one(command: str, path: str, options: Dict[str, Any], relative: Optional[str] = None) -> Dict[str, Any]:
+    start = time.perf_counter()
+    if relative is not None:
+        options = dict(options, relative=relative)
+    try:
+        if not path.lower().endswith(".pdf"):
+            raise Exception("not a .pdf file")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        file = PDFFile(path, index=options.get("index", False))
+        if not isinstance(file.trailer.extent.get(b"Root"), PDFDict):
+            # nothing usable was read, a command would report on (or write) an empty document
+            raise Exception("no document catalog (/Root)")
+        result = COMMANDS[command](file, options)
+        ret = {"path": path, "command": command, "ok": True, "result": result}
+    except MemoryError:
+        ret = {"path": path, "command": command, "ok": False, "kind": "memory",
+               "error": "memory cap exceeded"}
+    except Exception as e:
+        ret = {"path": path, "command": command, "ok": False, "kind": "error",
+               "error": f"{type(e).__name__}: {e}"}
+        if options.get("traceback"):
+            ret["traceback"] = traceback.format_exc()
+    ret["elapsed"] = round(time.perf_counter() - start, 6)
+    return ret
+
+
+def _worker(conn: Connection, command: str, options: Dict[str, Any], memory_cap: Optional[int]):
+    if memory_cap:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_cap, memory_cap))
+        except (ImportError, ValueError, OSError):
+            pass
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        path, relative = job
+        conn.send(run_one(command, path, options, relative))
+
+
+class WorkerPool:
+    # one long lived process per slot, a worker that hangs or dies is replaced without touching the others
+    command: str
+    options: Dict[str, Any]
+    jobs: int
+    timeout: Optional[float]
+    memory_cap: Optional[int]
+    _ctx: Any
+    _busy: Dict[Connection, Any]
+
+    def __init__(self, command: str, options: Dict[str, Any], jobs: int,
+                 timeout: Optional[float] = DEFAULT_TIMEOUT, memory_cap: Optional[int] = None):
+        self.command = command
+        self.options = options
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.memory_cap = memory_cap
+        self._ctx = multiprocessing.get_context()
+        self._busy = dict()
+
+    def _spawn(self) -> Any:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker, args=(child, self.command, self.options, self.memory_cap),
+                                    daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+
+    def _failure(self, path: str, kind: str, error: str, started: float) -> Dict[str, Any]:
+        return {"path": path, "command": self.command, "ok": False, "kind": kind, "error": error,
+                "elapsed": round(time.monotonic() - started, 6)}
+
+    def run(self, jobs: Iterable[Tuple[str, Optional[str]]]) -> Iterator[Dict[str, Any]]:
+        # jobs are (path, relative output path) pairs as iter_inputs() gives them
+        pending = iter(jobs)
+        idle = [self._spawn() for _ in range(self.jobs)]
+        try:
+            while True:
+                while idle:
+                    job = next(pending, None)
+                    if job is None:
+                        break
+                    path = job[0]
+                    process, conn = idle.pop()
+                    conn.send(job)
+                    self._busy[conn] = (process, path, time.monotonic())
+                if not self._busy:
+                    return
+
+                wait_for = None
+                if self.timeout is not None:
+                    nearest = min(started for _, _, started in self._busy.values()) + self.timeout
+                    wait_for = max(0.0, nearest - time.monotonic())
+                ready = wait(list(self._busy), wait_for)
+
+                for conn in ready:
+                    process, path, started = self._busy.pop(conn)
+                    try:
+                        yield conn.recv()
+                        idle.append((process, conn))
+                    except (EOFError, OSError):
+                        process.join()
+                        yield self._failure(path, "crash", f"worker exited with code {process.exitcode}", started)
+                        conn.close()
+                        idle.append(self._spawn())
+
+                if self.timeout is not None:
+                    now = time.monotonic()
+                    for conn, (process, path, started) in list(self._busy.items()):
+                        if now - started >= self.timeout:
+                            del self._busy[conn]
+                            process.kill()
+                            process.join()
+                            conn.close()
+                            yield self._failure(path, "timeout", f"no result after {self.timeout:g}s", started)
+                            idle.append(self._spawn())
+        finally:
+            for process, conn in idle:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+            for process, path, started in self._busy.values():
+                process.kill()
+            for process, conn in idle:
+                process.join(1)
+                if process.is_alive():
+                    process.kill()
+                conn.close()
+            self._busy = dict()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.core",
+                                     description="Run a command over many PDF files, one JSON line per file.")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into directories, ** in globs")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("-t", "--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds per file, 0 disables the limit")
+    parser.add_argument("-m", "--max-memory", type=int, default=0, help="address space cap per worker in MiB")
+    parser.add_argument("-o", "--output", help="directory for compact, recompress and extract-text results")
+    parser.add_argument("--in-place", action="store_true", help="let compact and recompress overwrite their input")
+    parser.add_argument("--level", type=int, default=9, help="Flate level of recompress")
+    parser.add_argument("--index", action="store_true", help="use and refresh sidecar indexes")
+    parser.add_argument("--traceback", action="store_true", help="include tracebacks of failed files")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    options = {"output": args.output, "in_place": args.in_place, "index": args.index, "traceback": args.traceback,
+               "level": args.level}
+    pool = WorkerPool(args.command, options, args.jobs, timeout=args.timeout or None,
+                      memory_cap=args.max_memory * (1 << 20) or None)
+    failed = 0
+
+    def emit(result: Dict[str, Any]) -> None:
+        nonlocal failed
+        failed += not result["ok"]
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    def jobs() -> Iterator[Tuple[str, str]]:
+        # two inputs written to the same output would overwrite each other, the later one fails instead
+        outputs: Dict[str, str] = dict()
+        for path, relative in iter_inputs(args.paths, args.recursive):
+            if args.output is not None:
+                key = output_key(relative)
+                if key in outputs:
+                    emit({"path": path, "command": args.command, "ok": False, "kind": "error",
+                          "error": f"output {relative} is already written for {outputs[key]}", "elapsed": 0.0})
+                    continue
+                outputs[key] = path
+            yield path, relative
+
+    for result in pool.run(jobs()):
+        emit(result)
+    return 1 if failed else 0
@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import re
+from typing import Callable, Iterable, Iterator
+
+from ._utils import whitespace_chars, delimiter_chars
+from .objects import *
+from .reader import Tokenizer, Parser
+from .stream import Stream
+from .filters import FilterRegistry
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+    from .pages import Page
+
+
+Operation = Tuple[bytes, List[PDFObject]]
+# None keeps the operation, otherwise it is replaced by what is returned: nothing drops it, the operation
+# itself among others inserts them around it
+Rewrite = Callable[[bytes, List[PDFObject]], Optional[Iterable[Operation]]]
+
+_regular = rb"[^\x00\t\n\f\r ()<>\[\]{}/%]"
+_white = rb"[\x00\t\n\f\r ]"
+
+TOKEN = re.compile(
+    _white + rb"*(%[^\r\n]*"
+    rb"|/" + _regular + rb"*"
+    rb"|" + _regular + rb"+"
+    rb"|\((?:[^()\\]|\\.)*\)"
+    rb"|<<|>>|<[^<>]*>"
+    rb"|[^\x00\t\n\f\r ])",
+    re.DOTALL
+)
+INLINE_IMAGE_END = re.compile(_white + rb"EI(?=" + _white + rb"|$)")
+INLINE_IMAGE_END_AT = re.compile(_white + rb"*EI(?=" + _white + rb"|$)")
+# what the chunked lexer reads past the declared end of inline image data before it looks for the EI there
+INLINE_IMAGE_END_MARGIN = 64
+NUMBER_START = set(b"0123456789+-.")
+CONSTANTS = {b"true": lambda file: PDFBool(file, True), b"false": lambda file: PDFBool(file, False),
+             b"null": PDFNull}
+
+INLINE_IMAGE_COLORS = {b"G": 1, b"DeviceGray": 1, b"CalGray": 1, b"I": 1, b"Indexed": 1,
+                       b"RGB": 3, b"DeviceRGB": 3, b"CalRGB": 3, b"Lab": 3,
+                       b"CMYK": 4, b"DeviceCMYK": 4}
+
+
+class ContentLexer(Tokenizer):
+    def tokens(self) -> Iterator[bytes]:
+        # comments are dropped, every other token is returned with its delimiters
+        doc = self.doc
+        while True:
+            restart = False
+            for m in TOKEN.finditer(doc, self.pos):
+                token = m.group(1)
+                if token == b"(":
+                    # nested parentheses fall back to the paren counting scanner
+                    self.pos = m.start(1)
+                    token = self.parse_string()
+                    restart = True
+                else:
+                    self.pos = m.end()
+                if token[0] != 37:  # %
+                    yield token
+                if restart or self.pos != m.end():
+                    # the consumer moved the position, e.g. over inline image data
+                    restart = True
+                    break
+            if not restart:
+                self.pos = len(doc)
+                return
+
+    def inline_image_data(self, info: PDFDict) -> bytes:
+        doc = self.doc
+        start = self.pos + 1  # single white-space after ID
+        length = ContentLexer._inline_image_length(info)
+        if length is not None:
+            end = start + length
+            m = INLINE_IMAGE_END_AT.match(doc, end)
+            if m is not None:
+                self.pos = m.end()
+                return doc[start:end].tobytes()
+        m = INLINE_IMAGE_END.search(doc, start)
+        if m is None:
+            self.pos = len(doc)
+            return doc[start:].tobytes()
+        self.pos = m.end()
+        return doc[start:m.start()].tobytes()
+
+    @staticmethod
+    def _inline_image_length(info: PDFDict) -> Optional[int]:
+        for key in (b"L", b"Length"):
+            if isinstance(info.value.get(key), PDFInt):
+                return info.value[key].value
+        if b"F" in info or b"Filter" in info:
+            return None
+        try:
+            width = info.value.get(b"W", info.value.get(b"Width")).value
+            height = info.value.get(b"H", info.value.get(b"Height")).value
+            mask = info.value.get(b"IM", info.value.get(b"ImageMask"))
+            if mask is not None and mask.value:
+                bpc, colors = 1, 1
+            else:
+                bpc = info.value.get(b"BPC", info.value.get(b"BitsPerComponent")).value
+                space = info.value.get(b"CS", info.value.get(b"ColorSpace"))
+                if isinstance(space, PDFArray):
+                    space = space.value[0]
+                colors = INLINE_IMAGE_COLORS[space.value]
+        except (AttributeError, KeyError):
+            return None
+        return (width * colors * bpc + 7) // 8 * height
+
+
+class ChunkedContentLexer(ContentLexer):
+    # the decoded data arrives in chunks; a token that reaches the end of the buffer may go on in the next
+    # chunk, so the buffer is cut before it and the next chunk appended
+    chunks: Iterator[bytes]
+    final: bool = False
+
+    def __init__(self, chunks: Iterable[bytes]):
+        super().__init__(memoryview(b""))
+        self.chunks = iter(chunks)
+
+    def _refill(self, start: int) -> None:
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.final = True
+            chunk = b""
+        self.doc = memoryview(self.doc[start:].tobytes() + chunk)
+        self.pos -= start
+
+    def tokens(self) -> Iterator[bytes]:
+        while True:
+            doc = self.doc
+            restart = False
+            for m in TOKEN.finditer(doc, self.pos):
+                start = m.start(1)
+                token = m.group(1)
+                if token == b"(":
+                    self.pos = start
+                    token = self.parse_string()
+                    restart = True
+                else:
+                    self.pos = m.end()
+                if not self.final and (self.pos >= len(doc) or token == b"<"):
+                    # "<" alone is a hex string whose ">" is in a later chunk
+                    self.pos = start
+                    self._refill(start)
+                    restart = True
+                    break
+                if token[0] != 37:  # %
+                    yield token
+                if restart or self.pos != m.end() or doc is not self.doc:
+                    restart = True
+                    break
+            if not restart:
+                # only white-space is left of the buffer
+                self.pos = len(doc)
+                if self.final:
+                    return
+                self._refill(self.pos)
+
+    def inline_image_data(self, info: PDFDict) -> bytes:
+        # with a declared length the whole data is read in first, a search for EI could stop inside it
+        length = ContentLexer._inline_image_length(info)
+        if length is not None:
+            while not self.final and len(self.doc) < self.pos + 1 + length + INLINE_IMAGE_END_MARGIN:
+                self._refill(self.pos)
+        while True:
+            pos = self.pos
+            data = super().inline_image_data(info)
+            if self.final or self.pos < len(self.doc):
+                return data
+            self.pos = pos
+            self._refill(pos)
+
+
+class ParseState:
+    # operands, and arrays or dictionaries still open, that have not met their operator yet; at the end of one
+    # content stream of a page they carry over to the next
+    operands: List[PDFObject]
+    containers: List[Tuple[bytes, List[PDFObject]]]
+
+    def __init__(self):
+        self.operands = []
+        self.containers = []
+
+    def __bool__(self):
+        return bool(self.operands or self.containers)
+
+    def to_bytes(self) -> bytes:
+        # what was read so far, as it was read
+        parts = [obj.to_bytes() for obj in self.operands]
+        for opened, items in self.containers:
+            parts.append(b"[" if opened == b"[" else b"<<")
+            parts.extend(obj.to_bytes() for obj in items)
+        return b" ".join(parts)
+
+
+class ContentParser:
+    @staticmethod
+    def operations(data: bytes | memoryview, file: PDFFile) -> Iterator[Operation]:
+        return ContentParser.lexer_operations(ContentLexer(memoryview(data)), file)
+
+    @staticmethod
+    def iter_operations(chunks: Iterable[bytes], file: PDFFile, state: Optional[ParseState] = None) -> Iterator[Operation]:
+        # e.g. over Stream.iter_decode(), only the chunk being read is kept
+        return ContentParser.lexer_operations(ChunkedContentLexer(chunks), file, state)
+
+    @staticmethod
+    def lexer_operations(lexer: ContentLexer, file: PDFFile, state: Optional[ParseState] = None) -> Iterator[Operation]:
+        # state continues the one left by the previous stream and holds what is pending at the end of this one
+        if state is None:
+            state = ParseState()
+        operands, containers = state.operands, state.containers
+        tokens = lexer.tokens()
+
+        for token in tokens:
+            if token == b"[" or token == b"<<":
+                containers.append((token, []))
+                continue
+            if token == b"]" or token == b">>":
+                if not containers:
+                    continue
+                opened, items = containers.pop()
+                obj = PDFArray(file, items) if opened == b"[" else ContentParser._to_dict(file, items)
+            else:
+                obj = ContentParser._operand(token, file)
+                if obj is None:
+                    if token == b"BI":
+                        yield b"BI", [ContentParser._inline_image(lexer, tokens, file)]
+                    else:
+                        yield token, operands
+                    operands = []
+                    containers = []
+                    continue
+            (containers[-1][1] if containers else operands).append(obj)
+        state.operands, state.containers = operands, containers
+
+    @staticmethod
+    def _operand(token: bytes, file: PDFFile) -> Optional[PDFObject]:
+        # None means the token is an operator
+        c = token[0]
+        if c in NUMBER_START:
+            try:
+                if b"." in token:
+                    return PDFFloat(file, float(token))
+                return PDFInt(file, int(token))
+            except ValueError:
+                return None
+        if c == 47:  # /
+            return PDFName(file, Parser.parse_name(token[1:]))
+        if c == 40:  # (
+            return PDFString(file, Parser.parse_literal_string(token))
+        if c == 60:  # <
+            return ContentParser._hex_string(token, file)
+        if token in CONSTANTS:
+            return CONSTANTS[token](file)
+        if c in delimiter_chars:
+            return PDFNull(file)
+        return None
+
+    @staticmethod
+    def _hex_string(token: bytes, file: PDFFile) -> PDFString:
+        token = bytes(b for b in token[1:-1] if b not in whitespace_chars)
+        if len(token) % 2:
+            token += b"0"
+        return PDFString(file, bytes.fromhex(token.decode('ascii')), show_hex=True)
+
+    @staticmethod
+    def _to_dict(file: PDFFile, items: List[PDFObject]) -> PDFDict:
+        ret = PDFDict(file)
+        for i in range(0, len(items) - 1, 2):
+            if isinstance(items[i], PDFName):
+                ret.value[items[i].value] = ret._adopt(items[i + 1])
+        return ret
+
+    @staticmethod
+    def _value(token: bytes, tokens: Iterator[bytes], file: PDFFile) -> PDFObject:
+        if token == b"[" or token == b"<<":
+            items = []
+            for t in tokens:
+                if t == b"]" or t == b">>":
+                    break
+                items.append(ContentParser._value(t, tokens, file))
+            return PDFArray(file, items) if token == b"[" else ContentParser._to_dict(file, items)
+        obj = ContentParser._operand(token, file)
+        return PDFNull(file) if obj is None else obj
+
+    @staticmethod
+    def _inline_image(lexer: ContentLexer, tokens: Iterator[bytes], file: PDFFile) -> PDFStream:
+        # BI <key value pairs> ID <binary data> EI comes out as a single PDFStream
+        items = []
+        for token in tokens:
+            if token == b"ID":
+                break
+            items.append(ContentParser._value(token, tokens, file))
+        info = ContentParser._to_dict(file, items)
+        return PDFStream(file, lexer.inline_image_data(info), info)
+
+    @staticmethod
+    def stream_operations(stream: PDFStream) -> Iterator[Operation]:
+        return ContentParser.operations(Stream(stream).decode(), stream._file)
+
+    @staticmethod
+    def page_streams(page: Page) -> List[PDFStream]:
+        contents = page.Contents
+        if isinstance(contents, PDFStream):
+            contents = [contents]
+        elif isinstance(contents, PDFArray):
+            contents = [c.resolve() for c in contents.value]
+        else:
+            contents = []
+        return [stream for stream in contents if isinstance(stream, PDFStream)]
+
+    @staticmethod
+    def page_chunks(streams: Iterable[PDFStream]) -> Iterator[bytes]:
+        # the streams of a page are one content, an operation may begin in one and end in the next;
+        # they only split between tokens, so white-space goes in between
+        for stream in streams:
+            yield from Stream(stream).iter_decode()
+            yield b"\n"
+
+    @staticmethod
+    def page_operations(page: Page) -> Iterator[Operation]:
+        return ContentParser.iter_operations(ContentParser.page_chunks(ContentParser.page_streams(page)),
+                                             page.obj._file)
+
+
+class ContentRewriter:
+    # rewrites content streams operation by operation: the stored data is decoded, parsed, serialized and
+    # Flate encoded chunk by chunk, so besides the old and the new stored data only about one chunk is held
+    @staticmethod
+    def operation_bytes(op: bytes, operands: List[PDFObject]) -> bytes:
+        if op == b"BI":
+            image = operands[0]
+            items = b"".join(PDFName(image._file, k).to_bytes() + b" " + v.to_bytes() + b" "
+                             for k, v in image.extent.value.items())
+            return b"BI " + items + b"ID " + image.value + b"\nEI\n"
+        if not operands:
+            return op + b"\n"
+        return b" ".join([obj.to_bytes() for obj in operands]) + b" " + op + b"\n"
+
+    @staticmethod
+    def iter_rewrite(chunks: Iterable[bytes], file: PDFFile, callback: Rewrite,
+                     operators: Optional[Set[bytes]] = None, head: Iterable[Operation] = (),
+                     tail: Iterable[Operation] = (), chunk_size: int = 1 << 16,
+                     state: Optional[ParseState] = None, final: bool = True) -> Iterator[bytes]:
+        # the rewritten content in pieces of about chunk_size; the callback only sees the operators given,
+        # all of them by default, and head and tail are written before and after the content. Operands still
+        # without an operator at the end are left in state when more content follows, otherwise written last
+        if state is None:
+            state = ParseState()
+        parts: List[bytes] = []
+        size = 0
+        for op, operands in ContentRewriter._operations(chunks, file, callback, operators, head, tail, state):
+            data = ContentRewriter.operation_bytes(op, operands)
+            parts.append(data)
+            size += len(data)
+            if size >= chunk_size:
+                yield b"".join(parts)
+                parts, size = [], 0
+        if final and state:
+            parts.append(state.to_bytes() + b"\n")
+            state.operands, state.containers = [], []
+        if parts:
+            yield b"".join(parts)
+
+    @staticmethod
+    def _operations(chunks: Iterable[bytes], file: PDFFile, callback: Rewrite, operators: Optional[Set[bytes]],
+                    head: Iterable[Operation], tail: Iterable[Operation], state: ParseState) -> Iterator[Operation]:
+        yield from head
+        for op, operands in ContentParser.iter_operations(chunks, file, state):
+            if operators is not None and op not in operators:
+                yield op, operands
+                continue
+            ret = callback(op, operands)
+            if ret is None:
+                yield op, operands
+            else:
+                yield from ret
+        yield from tail
+
+    @staticmethod
+    def rewrite(stream: PDFStream, callback: Rewrite, operators: Optional[Set[bytes]] = None,
+                head: Iterable[Operation] = (), tail: Iterable[Operation] = (), level: int = -1,
+                chunk_size: int = 1 << 16, state: Optional[ParseState] = None, final: bool = True) -> int:
+        # the stream is stored Flate encoded afterwards, whatever its filters were; returns the stored length
+        file = stream._file
+        encoder = FilterRegistry.encoder(b"FlateDecode", level=level)
+        out: List[bytes] = []
+        for data in ContentRewriter.iter_rewrite(Stream(stream).iter_decode(chunk_size), file, callback,
+                                                 operators, head, tail, chunk_size, state, final):
+            data = encoder.update(data)
+            if data:
+                out.append(data)
+        out.append(encoder.flush())
+        value = b"".join(out)
+        del out
+        s = Stream(stream)
+        s.Filter = PDFName(file, b"FlateDecode")
+        if b"DecodeParms" in stream.extent:
+            del stream.extent[b"DecodeParms"]
+        if b"DL" in stream.extent:
+            del stream.extent[b"DL"]
+        s.value = value
+        return len(value)
+
+    @staticmethod
+    def rewrite_page(page: Page, callback: Rewrite, operators: Optional[Set[bytes]] = None,
+                     head: Iterable[Operation] = (), tail: Iterable[Operation] = (), level: int = -1) -> int:
+        # the streams are read as one content: an operation split between two is written whole into the one
+        # holding its operator; head goes before the first stream and tail after the last
+        streams = ContentParser.page_streams(page)
+        state = ParseState()
+        total = 0
+        for i, stream in enumerate(streams):
+            last = i == len(streams) - 1
+            total += ContentRewriter.rewrite(stream, callback, operators, head if i == 0 else (),
+                                             tail if last else (), level, state=state, final=last)
+        return total
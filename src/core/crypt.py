@@ -0,0 +1,512 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from .objects import *
+from .filters import Decoder
+from .stream import Stream
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+PASSWORD_PADDING = bytes.fromhex("28BF4E5E4E758A4164004E56FFFA01082E2E00B6D0683E802F0CA9FE6453697A")
+# crypt filter methods
+NONE, RC4, AESV2, AESV3 = b"None", b"V2", b"AESV2", b"AESV3"
+IDENTITY = b"Identity"
+
+
+def _sbox() -> Tuple[List[int], List[int]]:
+    sbox, inv = [0] * 256, [0] * 256
+    p = q = 1
+    while True:
+        # p walks the multiplicative group by 3, q by its inverse
+        p = (p ^ (p << 1) ^ (0x1B if p & 0x80 else 0)) & 0xFF
+        q ^= q << 1
+        q ^= q << 2
+        q ^= q << 4
+        q &= 0xFF
+        if q & 0x80:
+            q ^= 0x09
+        x = q ^ ((q << 1) | (q >> 7)) ^ ((q << 2) | (q >> 6)) ^ ((q << 3) | (q >> 5)) ^ ((q << 4) | (q >> 4))
+        sbox[p] = (x ^ 0x63) & 0xFF
+        if p == 1:
+            break
+    sbox[0] = 0x63
+    for i, s in enumerate(sbox):
+        inv[s] = i
+    return sbox, inv
+
+
+def _mul(a: int, b: int) -> int:
+    ret = 0
+    while b:
+        if b & 1:
+            ret ^= a
+        a = ((a << 1) ^ 0x11B) if a & 0x80 else a << 1
+        b >>= 1
+    return ret
+
+
+def _tables():
+    sbox, inv = _sbox()
+    te = [(_mul(s, 2) << 24) | (s << 16) | (s << 8) | _mul(s, 3) for s in sbox]
+    td = [(_mul(s, 14) << 24) | (_mul(s, 9) << 16) | (_mul(s, 13) << 8) | _mul(s, 11) for s in inv]
+
+    def ror(table: List[int], bits: int) -> List[int]:
+        return [((v >> bits) | (v << (32 - bits))) & 0xFFFFFFFF for v in table]
+
+    return sbox, inv, [te, ror(te, 8), ror(te, 16), ror(te, 24)], [td, ror(td, 8), ror(td, 16), ror(td, 24)]
+
+
+SBOX, INV_SBOX, TE, TD = _tables()
+
+
+class AES:
+    # 32-bit table implementation of FIPS-197, used when the cryptography package is not installed
+    rounds: int
+    enc: List[int]
+    dec: Optional[List[int]] = None
+
+    def __init__(self, key: bytes):
+        nk = len(key) // 4
+        if len(key) not in (16, 24, 32):
+            raise Exception(f"Invalid AES key length {len(key)}")
+        self.rounds = nk + 6
+        w = list(struct.unpack(f">{nk}I", key))
+        rcon = 1
+        for i in range(nk, 4 * (self.rounds + 1)):
+            t = w[i - 1]
+            if i % nk == 0:
+                t = ((t << 8) | (t >> 24)) & 0xFFFFFFFF
+                t = (SBOX[t >> 24] << 24 | SBOX[(t >> 16) & 255] << 16 | SBOX[(t >> 8) & 255] << 8
+                     | SBOX[t & 255]) ^ (rcon << 24)
+                rcon = _mul(rcon, 2)
+            elif nk > 6 and i % nk == 4:
+                t = SBOX[t >> 24] << 24 | SBOX[(t >> 16) & 255] << 16 | SBOX[(t >> 8) & 255] << 8 | SBOX[t & 255]
+            w.append(w[i - nk] ^ t)
+        self.enc = w
+
+    def _decryption_keys(self) -> List[int]:
+        # equivalent inverse cipher: round keys in reverse, InvMixColumns applied to the inner ones
+        if self.dec is None:
+            td0, td1, td2, td3 = TD
+            w, dec = self.enc, []
+            for r in range(self.rounds, -1, -1):
+                for k in w[4 * r:4 * r + 4]:
+                    if 0 < r < self.rounds:
+                        k = (td0[SBOX[k >> 24]] ^ td1[SBOX[(k >> 16) & 255]] ^ td2[SBOX[(k >> 8) & 255]]
+                             ^ td3[SBOX[k & 255]])
+                    dec.append(k)
+            self.dec = dec
+        return self.dec
+
+    def encrypt_cbc(self, iv: bytes, data: bytes) -> bytes:
+        te0, te1, te2, te3 = TE
+        w, rounds, s = self.enc, self.rounds, SBOX
+        p0, p1, p2, p3 = struct.unpack(">4I", iv)
+        out = []
+        for b0, b1, b2, b3 in struct.iter_unpack(">4I", data):
+            s0, s1, s2, s3 = b0 ^ p0 ^ w[0], b1 ^ p1 ^ w[1], b2 ^ p2 ^ w[2], b3 ^ p3 ^ w[3]
+            k = 4
+            for _ in range(rounds - 1):
+                s0, s1, s2, s3 = (
+                    te0[s0 >> 24] ^ te1[(s1 >> 16) & 255] ^ te2[(s2 >> 8) & 255] ^ te3[s3 & 255] ^ w[k],
+                    te0[s1 >> 24] ^ te1[(s2 >> 16) & 255] ^ te2[(s3 >> 8) & 255] ^ te3[s0 & 255] ^ w[k + 1],
+                    te0[s2 >> 24] ^ te1[(s3 >> 16) & 255] ^ te2[(s0 >> 8) & 255] ^ te3[s1 & 255] ^ w[k + 2],
+                    te0[s3 >> 24] ^ te1[(s0 >> 16) & 255] ^ te2[(s1 >> 8) & 255] ^ te3[s2 & 255] ^ w[k + 3])
+                k += 4
+            p0 = (s[s0 >> 24] << 24 | s[(s1 >> 16) & 255] << 16 | s[(s2 >> 8) & 255] << 8 | s[s3 & 255]) ^ w[k]
+            p1 = (s[s1 >> 24] << 24 | s[(s2 >> 16) & 255] << 16 | s[(s3 >> 8) & 255] << 8 | s[s0 & 255]) ^ w[k + 1]
+            p2 = (s[s2 >> 24] << 24 | s[(s3 >> 16) & 255] << 16 | s[(s0 >> 8) & 255] << 8 | s[s1 & 255]) ^ w[k + 2]
+            p3 = (s[s3 >> 24] << 24 | s[(s0 >> 16) & 255] << 16 | s[(s1 >> 8) & 255] << 8 | s[s2 & 255]) ^ w[k + 3]
+            out.append(struct.pack(">4I", p0, p1, p2, p3))
+        return b"".join(out)
+
+    def decrypt_cbc(self, iv: bytes, data: bytes) -> bytes:
+        td0, td1, td2, td3 = TD
+        w, rounds, s = self._decryption_keys(), self.rounds, INV_SBOX
+        p0, p1, p2, p3 = struct.unpack(">4I", iv)
+        out = []
+        for b0, b1, b2, b3 in struct.iter_unpack(">4I", data):
+            s0, s1, s2, s3 = b0 ^ w[0], b1 ^ w[1], b2 ^ w[2], b3 ^ w[3]
+            k = 4
+            for _ in range(rounds - 1):
+                s0, s1, s2, s3 = (
+                    td0[s0 >> 24] ^ td1[(s3 >> 16) & 255] ^ td2[(s2 >> 8) & 255] ^ td3[s1 & 255] ^ w[k],
+                    td0[s1 >> 24] ^ td1[(s0 >> 16) & 255] ^ td2[(s3 >> 8) & 255] ^ td3[s2 & 255] ^ w[k + 1],
+                    td0[s2 >> 24] ^ td1[(s1 >> 16) & 255] ^ td2[(s0 >> 8) & 255] ^ td3[s3 & 255] ^ w[k + 2],
+                    td0[s3 >> 24] ^ td1[(s2 >> 16) & 255] ^ td2[(s1 >> 8) & 255] ^ td3[s0 & 255] ^ w[k + 3])
+                k += 4
+            out.append(struct.pack(
+                ">4I",
+                (s[s0 >> 24] << 24 | s[(s3 >> 16) & 255] << 16 | s[(s2 >> 8) & 255] << 8 | s[s1 & 255])
+                ^ w[k] ^ p0,
+                (s[s1 >> 24] << 24 | s[(s0 >> 16) & 255] << 16 | s[(s3 >> 8) & 255] << 8 | s[s2 & 255])
+                ^ w[k + 1] ^ p1,
+                (s[s2 >> 24] << 24 | s[(s1 >> 16) & 255] << 16 | s[(s0 >> 8) & 255] << 8 | s[s3 & 255])
+                ^ w[k + 2] ^ p2,
+                (s[s3 >> 24] << 24 | s[(s2 >> 16) & 255] << 16 | s[(s1 >> 8) & 255] << 8 | s[s0 & 255])
+                ^ w[k + 3] ^ p3))
+            p0, p1, p2, p3 = b0, b1, b2, b3
+        return b"".join(out)
+
+
+class Cipher:
+    # AES-CBC without padding, through the cryptography package when it is installed
+    _backend: Optional[bool] = None
+
+    @staticmethod
+    def accelerated() -> bool:
+        if Cipher._backend is None:
+            Cipher._backend = importlib.util.find_spec("cryptography") is not None
+        return Cipher._backend
+
+    @staticmethod
+    def aes_cbc(key: bytes, iv: bytes, data: bytes, encrypt: bool) -> bytes:
+        if Cipher.accelerated():
+            from cryptography.hazmat.primitives.ciphers import Cipher as _Cipher, algorithms, modes
+            cipher = _Cipher(algorithms.AES(key), modes.CBC(iv))
+            ctx = cipher.encryptor() if encrypt else cipher.decryptor()
+            return ctx.update(data) + ctx.finalize()
+        aes = AES(key)
+        return aes.encrypt_cbc(iv, data) if encrypt else aes.decrypt_cbc(iv, data)
+
+
+class RC4State:
+    x: int = 0
+    y: int = 0
+    s: List[int]
+
+    def __init__(self, key: bytes):
+        s = list(range(256))
+        j = 0
+        for i in range(256):
+            j = (j + s[i] + key[i % len(key)]) & 0xFF
+            s[i], s[j] = s[j], s[i]
+        self.s = s
+
+    def crypt(self, data: bytes) -> bytes:
+        s, x, y = self.s, self.x, self.y
+        out = bytearray(data)
+        for i in range(len(out)):
+            x = (x + 1) & 0xFF
+            y = (y + s[x]) & 0xFF
+            s[x], s[y] = s[y], s[x]
+            out[i] ^= s[(s[x] + s[y]) & 0xFF]
+        self.x, self.y = x, y
+        return bytes(out)
+
+
+def rc4(key: bytes, data: bytes) -> bytes:
+    return RC4State(key).crypt(data)
+
+
+def aes_decrypt(key: bytes, data: bytes) -> bytes:
+    # the first block is the IV, the plaintext is padded as in PKCS#5
+    data = data[:len(data) - len(data) % 16]
+    if len(data) < 32:
+        return b""
+    return unpad(Cipher.aes_cbc(key, data[:16], data[16:], False))
+
+
+def aes_encrypt(key: bytes, data: bytes) -> bytes:
+    iv = os.urandom(16)
+    pad = 16 - len(data) % 16
+    return iv + Cipher.aes_cbc(key, iv, data + bytes([pad]) * pad, True)
+
+
+def unpad(data: bytes) -> bytes:
+    pad = data[-1] if data else 0
+    if 1 <= pad <= 16 and data.endswith(bytes([pad]) * pad):
+        return data[:-pad]
+    return data
+
+
+class RC4Decoder(Decoder):
+    def __init__(self, key: bytes):
+        self.state = RC4State(key)
+
+    def update(self, data: bytes) -> bytes:
+        return self.state.crypt(data)
+
+
+class AESDecoder(Decoder):
+    # decrypts whole blocks as they arrive, the last one is held back until flush() strips the padding
+    key: bytes
+    iv: Optional[bytes] = None
+    pending: bytes
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.pending = b""
+
+    def update(self, data: bytes) -> bytes:
+        data = self.pending + data
+        if self.iv is None:
+            if len(data) < 16:
+                self.pending = data
+                return b""
+            self.iv, data = data[:16], data[16:]
+        end = max(0, (len(data) - 1) // 16 * 16)
+        self.pending = data[end:]
+        if end == 0:
+            return b""
+        ret = Cipher.aes_cbc(self.key, self.iv, data[:end], False)
+        self.iv = data[end - 16:end]
+        return ret
+
+    def flush(self) -> bytes:
+        data = self.pending[:len(self.pending) - len(self.pending) % 16]
+        self.pending = b""
+        if self.iv is None or not data:
+            return b""
+        return unpad(Cipher.aes_cbc(self.key, self.iv, data, False))
+
+
+class SecurityHandler:
+    # standard security handler, revisions 2 to 6; the file key is derived on the first decryption
+    file: PDFFile
+    encrypt: PDFDict
+    encrypt_ref: Optional[IndRef]
+    password: bytes
+    V: int
+    R: int
+    length: int
+    encrypt_metadata: bool
+    stream_method: bytes
+    string_method: bytes
+    methods: Dict[bytes, bytes]
+    keys: Dict[Tuple[int, int, bytes], bytes]
+    _key: Optional[bytes] = None
+
+    def __init__(self, file: PDFFile, encrypt: PDFObject, password: bytes | str = b""):
+        self.file = file
+        self.encrypt_ref = encrypt if isinstance(encrypt, IndRef) else None
+        encrypt = encrypt.resolve()
+        if not isinstance(encrypt, PDFDict):
+            raise Exception("Invalid /Encrypt dictionary")
+        self.encrypt = encrypt
+        if encrypt.get(b"Filter").to_python() != b"Standard":
+            raise Exception(f"Unsupported security handler {encrypt.get(b'Filter').to_python()!r}")
+        self.password = password.encode('utf-8') if isinstance(password, str) else password
+        self.V = encrypt.get(b"V").to_python() or 0
+        self.R = encrypt.get(b"R").to_python()
+        self.length = encrypt.get(b"Length").to_python() or (128 if self.V >= 4 else 40)
+        metadata = encrypt.get(b"EncryptMetadata")
+        self.encrypt_metadata = not (isinstance(metadata, PDFBool) and not metadata.value)
+        self.keys = dict()
+
+        self.methods = {IDENTITY: NONE}
+        if self.V >= 4:
+            filters = encrypt.get(b"CF")
+            for name, cf in (filters.value.items() if isinstance(filters, PDFDict) else ()):
+                method = cf.resolve().get(b"CFM").to_python() if isinstance(cf.resolve(), PDFDict) else None
+                self.methods[name] = method or NONE
+            self.stream_method = self.methods.get(encrypt.get(b"StmF").to_python() or IDENTITY, NONE)
+            self.string_method = self.methods.get(encrypt.get(b"StrF").to_python() or IDENTITY, NONE)
+        else:
+            self.stream_method = self.string_method = RC4
+
+    @property
+    def key(self) -> bytes:
+        if self._key is None:
+            self._key = self._authenticate()
+        return self._key
+
+    def _id(self) -> bytes:
+        ids = self.file.trailer.extent.get(b"ID")
+        if isinstance(ids, PDFArray) and ids.value:
+            return ids.value[0].resolve().value
+        return b""
+
+    def _entry(self, key: bytes) -> bytes:
+        value = self.encrypt.get(key)
+        return value.value if isinstance(value, PDFString) else b""
+
+    def _rc4_key(self, password: bytes) -> bytes:
+        # algorithm 2
+        n = self.length // 8 if self.R >= 3 else 5
+        h = hashlib.md5((password[:32] + PASSWORD_PADDING)[:32])
+        h.update(self._entry(b"O"))
+        h.update((self.encrypt.get(b"P").to_python() & 0xFFFFFFFF).to_bytes(4, "little"))
+        h.update(self._id())
+        if self.R >= 4 and not self.encrypt_metadata:
+            h.update(b"\xff\xff\xff\xff")
+        key = h.digest()
+        if self.R >= 3:
+            for _ in range(50):
+                key = hashlib.md5(key[:n]).digest()
+        return key[:n]
+
+    def _user_check(self, key: bytes) -> bool:
+        # algorithms 4 and 5
+        if self.R == 2:
+            return rc4(key, PASSWORD_PADDING) == self._entry(b"U")
+        x = rc4(key, hashlib.md5(PASSWORD_PADDING + self._id()).digest())
+        for i in range(1, 20):
+            x = rc4(bytes(b ^ i for b in key), x)
+        return x[:16] == self._entry(b"U")[:16]
+
+    def _owner_password(self, password: bytes) -> bytes:
+        # algorithm 7, the user password that is stored encrypted with the owner password in /O
+        n = self.length // 8 if self.R >= 3 else 5
+        key = hashlib.md5((password[:32] + PASSWORD_PADDING)[:32]).digest()
+        if self.R >= 3:
+            for _ in range(50):
+                key = hashlib.md5(key).digest()
+        key = key[:n]
+        ret = self._entry(b"O")
+        if self.R == 2:
+            return rc4(key, ret)
+        for i in range(19, -1, -1):
+            ret = rc4(bytes(b ^ i for b in key), ret)
+        return ret
+
+    def _hash(self, password: bytes, salt: bytes, udata: bytes = b"") -> bytes:
+        # algorithm 2.B for revision 6, plain SHA-256 for revision 5
+        k = hashlib.sha256(password + salt + udata).digest()
+        if self.R == 5:
+            return k
+        i = 0
+        while True:
+            e = Cipher.aes_cbc(k[:16], k[16:32], (password + k + udata) * 64, True)
+            k = (hashlib.sha256, hashlib.sha384, hashlib.sha512)[int.from_bytes(e[:16], "big") % 3](e).digest()
+            i += 1
+            if i >= 64 and e[-1] <= i - 32:
+                return k[:32]
+
+    def _authenticate(self) -> bytes:
+        password = self.password
+        if self.R >= 5:
+            password = password[:127]
+            o, u = self._entry(b"O"), self._entry(b"U")
+            # the user hash is cheaper and the usual case, both lead to the same file key
+            if self._hash(password, u[32:40]) == u[:32]:
+                return Cipher.aes_cbc(self._hash(password, u[40:48]), bytes(16), self._entry(b"UE"), False)
+            if self._hash(password, o[32:40], u[:48]) == o[:32]:
+                return Cipher.aes_cbc(self._hash(password, o[40:48], u[:48]), bytes(16), self._entry(b"OE"), False)
+            raise Exception("Incorrect password")
+        key = self._rc4_key(password)
+        if self._user_check(key):
+            return key
+        key = self._rc4_key(self._owner_password(password))
+        if self._user_check(key):
+            return key
+        raise Exception("Incorrect password")
+
+    def object_key(self, N: int, G: int, method: bytes) -> bytes:
+        # algorithm 1, cached per object since every string of an object uses the same key
+        cache_key = (N, G, method)
+        key = self.keys.get(cache_key)
+        if key is None:
+            key = self.key
+            if method != AESV3:
+                salt = b"sAlT" if method == AESV2 else b""
+                digest = hashlib.md5(key + N.to_bytes(4, "little")[:3] + G.to_bytes(2, "little") + salt).digest()
+                key = digest[:min(len(key) + 5, 16)]
+            self.keys[cache_key] = key
+        return key
+
+    def _method(self, name: Optional[bytes], default: bytes) -> bytes:
+        if name is None:
+            return default
+        if name not in self.methods:
+            raise Exception(f"Unknown crypt filter /{name.decode('latin-1')}")
+        return self.methods[name]
+
+    def _crypt(self, data: bytes, ref: IndRef, method: bytes, encrypt: bool) -> bytes:
+        if method == NONE:
+            return data
+        key = self.object_key(ref.N, ref.G, method)
+        if method == RC4:
+            return rc4(key, data)
+        if method in (AESV2, AESV3):
+            return aes_encrypt(key, data) if encrypt else aes_decrypt(key, data)
+        raise Exception(f"Unsupported crypt filter method {method.decode('latin-1')}")
+
+    def decrypt_string(self, data: bytes, ref: IndRef) -> bytes:
+        return self._crypt(data, ref, self.string_method, False)
+
+    def encrypt_string(self, data: bytes, ref: IndRef) -> bytes:
+        return self._crypt(data, ref, self.string_method, True)
+
+    def decrypt_stream(self, data: bytes, ref: IndRef, name: Optional[bytes] = None) -> bytes:
+        # name is the crypt filter a /Crypt entry of the stream picks instead of /StmF
+        return self._crypt(data, ref, self._method(name, self.stream_method), False)
+
+    def encrypt_stream(self, data: bytes, ref: IndRef, name: Optional[bytes] = None) -> bytes:
+        return self._crypt(data, ref, self._method(name, self.stream_method), True)
+
+    def decryptor(self, ref: IndRef, name: Optional[bytes] = None) -> Optional[Decoder]:
+        method = self._method(name, self.stream_method)
+        if method == NONE:
+            return None
+        key = self.object_key(ref.N, ref.G, method)
+        return RC4Decoder(key) if method == RC4 else AESDecoder(key)
+
+    def exempt(self, obj: PDFObject, ref: IndRef) -> bool:
+        # the encryption dictionary, xref streams and, with /EncryptMetadata false, metadata stay in the clear
+        if ref == self.encrypt_ref or obj is self.encrypt:
+            return True
+        if isinstance(obj, PDFStream):
+            kind = obj.extent.value.get(b"Type")
+            if isinstance(kind, PDFName):
+                return kind.value == b"XRef" or (kind.value == b"Metadata" and not self.encrypt_metadata)
+        return False
+
+    @staticmethod
+    def _strings(obj: PDFObject) -> List[PDFString]:
+        ret = []
+        stack = [obj]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, PDFString):
+                ret.append(obj)
+            elif isinstance(obj, PDFArray):
+                stack.extend(obj.value)
+            elif isinstance(obj, PDFDict):
+                stack.extend(obj.value.values())
+            elif isinstance(obj, PDFStream):
+                stack.append(obj.extent)
+        return ret
+
+    def decrypt_object(self, obj: PDFObject, ref: IndRef) -> None:
+        # called when an object is parsed: strings in place, the stream data only when it is decoded
+        if self.exempt(obj, ref):
+            return
+        if self.string_method != NONE:
+            for string in SecurityHandler._strings(obj):
+                string.value = self.decrypt_string(string.value, ref)
+        if isinstance(obj, PDFStream):
+            obj._crypt = ref
+
+    def encrypted_bytes(self, obj: PDFObject, ref: IndRef) -> bytes:
+        # to_bytes() with strings and stream data encrypted under ref, the object itself is left as it was
+        if self.exempt(obj, ref):
+            return obj.to_bytes()
+        strings = SecurityHandler._strings(obj) if self.string_method != NONE else []
+        plain = [string.value for string in strings]
+        stream = obj if isinstance(obj, PDFStream) else None
+        if stream is not None:
+            value, crypt_ref, length = stream.value, stream._crypt, stream.extent.value.get(b"Length")
+        try:
+            for string in strings:
+                string.value = self.encrypt_string(string.value, ref)
+            if stream is not None and crypt_ref != ref:
+                name = Stream.split_crypt(Stream(stream).filter_chain())[0]
+                data = value if crypt_ref is None else self.decrypt_stream(value, crypt_ref, name)
+                stream.value = self.encrypt_stream(data, ref, name)
+                stream.extent.value[b"Length"] = PDFInt(self.file, len(stream.value))
+            return obj.to_bytes()
+        finally:
+            for string, text in zip(strings, plain):
+                string.value = text
+            if stream is not None:
+                stream.value = value
+                if length is not None:
+                    stream.extent.value[b"Length"] = length
+
@@ -2,18 +2,34 @@
 from __future__ import annotations
 import os
 import io
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import TYPE_CHECKING
-from typing import Set, Optional, List
+from typing import Set, Optional, List, Dict, Iterable
 from ._utils import find_from_memoryview, rfind_from_memoryview
 
 from .reader import Tokenizer
-from .xref import XRef, XRefParser, RefSrc
+from .source import Reader, CachedReader, ReaderView
+from .stats import Stats
+from .graph import ObjectGraph
+from .pages import PageTree
+from .stream import ObjectStream
+from .xref import XRef, XRefParser, RefSrc, XREF_STREAM_KEYS
 from .objects import *
 
+if TYPE_CHECKING:
+    # loaded on first use, most opens never need them
+    from .cache import SidecarIndex
+    from .crypt import SecurityHandler
+    from .optimize import DedupResult, RecompressResult
+    from .query import ObjectIndex
+    from .snapshot import Snapshot
+    from weakref import WeakSet
+
 
 class PDFFile:
     filename: str
-    doc: memoryview
+    doc: memoryview | ReaderView
     header_pos: int = -1
     eof_pos: int = -1
     tk: Tokenizer
@@ -21,15 +37,43 @@ class PDFFile:
     last_xref_offset: int = -1
     trailer: Trailer
     updated_ref: Set[IndRef]
-
-    def __init__(self, filename: str):
+    dirty: Dict[IndRef, PDFObject]
+    resource_cache: Dict[IndRef, Any]
+    events: Stats
+    sidecar: Optional[SidecarIndex] = None
+    security: Optional[SecurityHandler] = None
+    object_index: Optional[ObjectIndex] = None
+    password: bytes | str = b""
+    recovered: bool = False
+    _edit_depth: int = 0
+    _pages: Optional[PageTree] = None
+    _snapshot_var: Optional[ContextVar] = None  # set by the first snapshot, resolve() only looks it up then
+    _snapshots: Optional[WeakSet] = None  # open snapshots, the objects of the file are frozen while there are any
+
+    def __init__(self, filename: str, index: bool | str = False, recover: bool = True,
+                 data: Optional[bytes] = None, reader: Optional[Reader] = None, password: bytes | str = b""):
         self.filename = filename
-
-        if filename.endswith('.pdf'):
-            if os.path.exists(filename):
-                self.read()
+        self.password = password
+        self.dirty = dict()
+        self.resource_cache = dict()
+        self.events = Stats()
+
+        if reader is not None:
+            self.attach(reader, index, recover)
+        elif data is not None:
+            self.load(data, index, recover)
+        elif filename.lower().endswith('.pdf') and os.path.exists(filename):
+            self.read(index, recover)
+        else:
+            self._new_body()
         self.updated_ref = set()
 
+    def _new_body(self):
+        self.doc = memoryview(b"")
+        self.tk = Tokenizer(self.doc)
+        self.xref = XRef(self)
+        self.trailer = Trailer(PDFDict(self))
+
     def _read_body(self):
         doc = self.doc
         eof = self.eof_pos
@@ -37,62 +81,199 @@ class PDFFile:
         self.xref = XRef(self)
         self.trailer = Trailer(PDFDict(self))
 
-        while True:
-            start_xref = rfind_from_memoryview(b"startxref", doc, header, eof)
-            if start_xref == -1:
-                raise Exception("Can not find offset of XRef")
-            xref_offset = int(Tokenizer(doc[start_xref+9:eof]).next())
-            if self.last_xref_offset == -1:
-                self.last_xref_offset = xref_offset
+        start_xref = rfind_from_memoryview(b"startxref", doc, header, eof)
+        if start_xref == -1:
+            raise Exception("Can not find offset of XRef")
+        xref_offset = int(Tokenizer(doc[start_xref+9:eof]).next())
+        self.last_xref_offset = xref_offset
+
+        # newest section first, following /Prev until the original table
+        seen = set()
+        while xref_offset is not None and xref_offset not in seen:
+            seen.add(xref_offset)
             xref, trailer = XRefParser.parse_xref(self.tk, self, xref_offset)
-            for k, v in xref.table.items():
-                self.xref.update(k, v)
+            stm = trailer.get(b"XRefStm")
+            if isinstance(stm, PDFInt) and stm.value not in seen:
+                # hybrid-reference file, the stream entries take precedence over the table
+                seen.add(stm.value)
+                self.xref.merge(XRefParser.parse_xref(self.tk, self, stm.value)[0])
+            self.xref.merge(xref)
             for k, v in trailer.value.items():
-                self.trailer.extent.value.setdefault(k, v)
-            break
+                if k not in XREF_STREAM_KEYS:
+                    self.trailer.extent.value.setdefault(k, v)
+            prev = trailer.get(b"Prev")
+            xref_offset = prev.value if isinstance(prev, PDFInt) else None
+
+    def _recover_body(self):
+        # objects may follow the last %%EOF of a damaged file, so the scan covers the whole buffer
+        self.eof_pos = len(self.doc)
+        self.tk = Tokenizer(self.doc[self.header_pos:])
+        self.resource_cache = dict()
+        self.xref = XRef(self)
+        xref, trailer = XRefParser.reconstruct(self.tk, self)
+        if b"Encrypt" in trailer.value and self.security is None:
+            # object streams and strings only read correctly once the security handler exists
+            self.xref, self.trailer = xref, Trailer(trailer)
+            self._init_security()
+            self.resource_cache = dict()
+            self.xref = XRef(self)
+            xref, trailer = XRefParser.reconstruct(self.tk, self)
+        self.xref = xref
+        self.trailer = Trailer(trailer)
+        self.last_xref_offset = -1
+        self.recovered = True
+
+    def _init_security(self):
+        # only the /Encrypt dictionary is read here, the key is derived on the first decryption
+        self.security = None
+        encrypt = self.trailer.extent.value.get(b"Encrypt")
+        if encrypt is not None and encrypt.resolve() is not PDFNull(self):
+            from .crypt import SecurityHandler
+            self.security = SecurityHandler(self, encrypt, self.password)
+
+    def _load_body(self, recover: bool):
+        if not recover:
+            return self._read_body()
+        try:
+            self._read_body()
+            if isinstance(self.trailer.extent.get(b"Root"), PDFDict):
+                return
+        except Exception:
+            pass
+        self._recover_body()
 
-    def read(self):
+    def read(self, index: bool | str = False, recover: bool = True):
         with open(self.filename, "rb") as f:
-            self.doc = memoryview(f.read())
-        doc = self.doc
+            data = f.read()
+        self.load(data, index, recover)
+
+    def load(self, data: bytes, index: bool | str = False, recover: bool = True):
+        self._open(memoryview(data), index, recover)
+
+    def attach(self, reader: Reader, index: bool | str = False, recover: bool = True):
+        # only the tail, the xref and the objects that are resolved get read
+        if not isinstance(reader, CachedReader):
+            reader = CachedReader(reader)
+        self._open(ReaderView(reader), index, recover)
+
+    def _open(self, doc: memoryview | ReaderView, index: bool | str, recover: bool):
+        self.doc = doc
+        self.security = None
+        self.object_index = None
         self.header_pos = find_from_memoryview(b"%PDF-", doc)
         if self.header_pos == -1:
-            raise Exception("Can not find pdf header (%PDF-)")
+            if not recover:
+                raise Exception("Can not find pdf header (%PDF-)")
+            self.header_pos = 0
 
         self.eof_pos = rfind_from_memoryview(b"%%EOF", doc)
         if self.eof_pos == -1:
-            raise Exception("Can not find pdf eof (%%EOF)")
+            if not recover:
+                raise Exception("Can not find pdf eof (%%EOF)")
+            self.eof_pos = len(doc)
 
         self.tk = Tokenizer(doc[self.header_pos:self.eof_pos])
-        self._read_body()
+        if index:
+            from .cache import SidecarIndex
+            path = index if isinstance(index, str) else SidecarIndex.path(self.filename)
+            self.sidecar = SidecarIndex.load(self, path)
+            if self.sidecar is not None:
+                self.trailer = Trailer(self.sidecar.trailer)
+            else:
+                self._load_body(recover)
+                SidecarIndex.write(self, path)
+        else:
+            self._load_body(recover)
+        self._init_security()
         self.updated_ref = set()
 
-    def save(self, filename: Optional[str] = None):
+    def save(self, filename: Optional[str] = None, compact: bool = False,
+             overwrite: bool = False, linearize: bool = False) -> Optional[Dict[IndRef, IndRef]]:
         if filename is None:
             filename = self.filename
-        buffer = io.BytesIO()
-        buffer.write(b"%PDF-2.0\n%\xdd\xdd\xdd\xdd\n")
-        ref_list = sorted([src.ref for src in self.xref.table.values()])
-        self._write_body(buffer, ref_list)
+        data, renumbered = self.render(compact, linearize)
 
-        if os.path.exists(filename):
+        if os.path.exists(filename) and not overwrite:
             Q = input(f"You are trying to override {filename}. (Y/n) ")
             if Q.strip() != "Y":
                 return
 
         with open(filename, "wb") as f:
-            f.write(buffer.getvalue())
+            f.write(data)
+        return renumbered
 
-    def incremental_update(self, filename: Optional[str] = None):
+    def render(self, compact: bool = False,
+               linearize: bool = False) -> Tuple[bytes, Optional[Dict[IndRef, IndRef]]]:
+        # the whole document as written by save(), together with the renumbering of compact()
+        self.flush()
+        buffer = io.BytesIO()
+        buffer.write(b"%PDF-2.0\n%\xdd\xdd\xdd\xdd\n")
+        if linearize:
+            from .linearize import Linearizer
+            # linearization renumbers every object, which drops unreachable ones as compact() does
+            renumbered = Linearizer.write(self, buffer)
+            return buffer.getvalue(), renumbered
+        renumbered = self.compact() if compact else None
+        self.trailer.Prev = None
+        ref_list = sorted([src.ref for src in self.xref.table.values()])
+        self._write_body(buffer, ref_list)
+        return buffer.getvalue(), renumbered
+
+    def compact(self) -> Dict[IndRef, IndRef]:
+        self.flush()
+        # reachability starts at the catalog, without one every object would be dropped
+        if not isinstance(self.trailer.extent.get(b"Root"), PDFDict):
+            raise Exception("Can not compact a document without a catalog (/Root)")
+
+        live = ObjectGraph.reachable(self, ObjectGraph.iter_refs(self.trailer.extent))
+        live.sort()
+        renumbered = {ref: IndRef(self, i + 1, 0) for i, ref in enumerate(live)}
+        self._renumber(renumbered)
+        return renumbered
+
+    def _renumber(self, renumbered: Dict[IndRef, IndRef]):
+        # objects missing from the mapping are dropped, references to them become null
+        objs = [(self.xref.resolve(ref), new_ref) for ref, new_ref in renumbered.items()]
+        xref = XRef(self)
+        for obj, new_ref in objs:
+            ObjectGraph.remap(obj, renumbered)
+            obj._ref = new_ref
+            xref.update(new_ref.N, RefSrc(new_ref, obj))
+        ObjectGraph.remap(self.trailer.extent, renumbered)
+        if self.security is not None:
+            # streams keep the number they were encrypted under in _crypt, they are re-encrypted when written
+            self.security.encrypt_ref = renumbered.get(self.security.encrypt_ref)
+
+        self.xref = xref
+        if self.object_index is not None:
+            self.object_index.renumber({ref.N: new_ref.N for ref, new_ref in renumbered.items()})
+        self.updated_ref = set(renumbered.values())
+        self.resource_cache = dict()
+        self.sidecar = None
+        self._pages = None
+
+    def deduplicate(self, min_dict_size: int = 128) -> DedupResult:
+        from .optimize import Optimizer
+        return Optimizer.deduplicate(self, min_dict_size)
+
+    def recompress(self, level: int = 9, workers: Optional[int] = None, flate: bool = False,
+                   min_saving: float = 0.01) -> RecompressResult:
+        from .optimize import Optimizer
+        return Optimizer.recompress(self, level, workers, flate, min_saving)
+
+    def incremental_update(self, filename: Optional[str] = None, overwrite: bool = False):
         if filename is None:
             filename = self.filename
+        if len(self.doc) and self.last_xref_offset == -1:
+            raise Exception("Can not append to a document without a valid xref, use save() instead")
+        self.flush()
         buffer = io.BytesIO()
-        buffer.write(self.doc)
+        buffer.write(self.doc if isinstance(self.doc, memoryview) else self.doc.tobytes())
 
         if len(self.updated_ref) > 0:
             self._write_body(buffer, sorted(self.updated_ref), self.last_xref_offset)
 
-        if os.path.exists(filename):
+        if os.path.exists(filename) and not overwrite:
             Q = input(f"You are trying to override {filename}. (Y/n) ")
             if Q.strip() != "Y":
                 return
@@ -106,55 +287,218 @@ class PDFFile:
         for ref in ref_list:
             obj = self.xref.resolve(ref)
             if obj == PDFNull(self):
-                if ref.N == 0:
+                # an update lists the entries it frees, _write_table writes them without an offset
+                if ref.N == 0 or prev_offset != -1:
                     new_ref_list.append(ref)
                 continue
             new_offsets[ref.N] = buffer.tell()
             new_ref_list.append(ref)
             buffer.write(f"{ref.N} {ref.G} obj\n".encode('ascii'))
-            buffer.write(obj.to_bytes())
+            buffer.write(self.object_bytes(obj, ref))
             buffer.write(b"\nendobj\n")
 
         self._write_table(buffer, new_ref_list, new_offsets, prev_offset)
 
     def _write_table(self, buffer: io.BytesIO, ref_list: List[IndRef],
-                     new_offsets: dict, prev_offset: int = -1):
+                     new_offsets: dict, prev_offset: int = -1, trailer: Optional[Trailer] = None):
         xref_offset = buffer.tell()
         buffer.write(b"xref\n")
-        start = ref_list[0].N
-        length = ref_list[-1].N - start + 1
-        buffer.write(f"{start} {length}\n".encode('ascii'))
+        if prev_offset == -1:
+            runs = [[ref_list[0].N, ref_list[-1].N]]
+        else:
+            # an update lists only its own objects, a gap inside a subsection would free older ones
+            runs = []
+            for ref in ref_list:
+                if runs and runs[-1][1] == ref.N - 1:
+                    runs[-1][1] = ref.N
+                else:
+                    runs.append([ref.N, ref.N])
         pointer = 0
-        for i in range(start, start+length):
-            if i == 0:
-                buffer.write(f"{0:010} {65535:05} f\r\n".encode('ascii'))
-                pointer += 1
-            elif ref_list[pointer].N == i:
-                ref = ref_list[pointer]
-                buffer.write(f"{new_offsets[i]:010} {ref.G:05} n\r\n".encode('ascii'))
-                pointer += 1
-            else:
-                buffer.write(f"{0:010} {65535:05} f\r\n".encode('ascii'))
+        for start, end in runs:
+            buffer.write(f"{start} {end - start + 1}\n".encode('ascii'))
+            for i in range(start, end + 1):
+                if i == 0:
+                    buffer.write(f"{0:010} {65535:05} f\r\n".encode('ascii'))
+                    pointer += 1
+                elif ref_list[pointer].N == i:
+                    # a listed number without an offset was freed, its entry carries the next generation
+                    ref = ref_list[pointer]
+                    if i in new_offsets:
+                        buffer.write(f"{new_offsets[i]:010} {ref.G:05} n\r\n".encode('ascii'))
+                    else:
+                        buffer.write(f"{0:010} {ref.G:05} f\r\n".encode('ascii'))
+                    pointer += 1
+                else:
+                    buffer.write(f"{0:010} {65535:05} f\r\n".encode('ascii'))
 
         buffer.write(b"trailer\n")
-        self.trailer.update()
+        if trailer is None:
+            trailer = self.trailer
+            trailer.update()
         if prev_offset != -1:
-            self.trailer.Prev = prev_offset
-        buffer.write(self.trailer.extent.to_bytes())
+            trailer.Prev = prev_offset
+        buffer.write(trailer.extent.to_bytes())
         buffer.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
 
+    def object_bytes(self, obj: PDFObject, ref: IndRef) -> bytes:
+        # an encrypted document gets its strings and streams encrypted with the key of the number written
+        if self.security is None:
+            return obj.to_bytes()
+        return self.security.encrypted_bytes(obj, ref)
+
     def resolve(self, ref: IndRef) -> PDFObject:
+        if self._snapshot_var is not None:
+            snapshot = self._snapshot_var.get()
+            if snapshot is not None and snapshot.base is self:
+                return snapshot.resolve(ref)
         return self.xref.resolve(ref)
 
+    def snapshot(self) -> Snapshot:
+        # the objects of the file are frozen until its snapshots are closed or collected
+        from .snapshot import Snapshot
+        return Snapshot(self)
+
+    def prefetch(self, root_refs: Iterable[IndRef], depth: Optional[int] = None) -> List[IndRef]:
+        # reads the closure of root_refs level by level, each level in one sweep in file order; /Parent links
+        # are not followed, the page tree would pull in every page. depth counts the levels below the roots
+        seen: Set[int] = set()
+        ret = []
+        level = list(root_refs)
+        current = 0
+        while level:
+            refs = []
+            for ref in level:
+                if ref.N not in seen:
+                    seen.add(ref.N)
+                    refs.append(ref)
+            self.xref.read_many(ref.N for ref in refs)
+            level = []
+            for ref in refs:
+                obj = self.resolve(ref)
+                if obj is PDFNull(self):
+                    continue
+                ret.append(obj._ref)
+                if depth is None or current < depth:
+                    level.extend(ObjectGraph.iter_refs(obj, (b"Parent",)))
+            current += 1
+        return ret
+
+    def build_index(self, workers: Optional[int] = None) -> ObjectIndex:
+        # one pass over every object, split between worker processes for a large unmodified file on disk
+        from .query import ObjectIndex
+        self.object_index = ObjectIndex.build(self, workers)
+        return self.object_index
+
+    def find(self, type: Optional[bytes] = None, subtype: Optional[bytes] = None, stream: Optional[bool] = None,
+             min_size: Optional[int] = None, max_size: Optional[int] = None) -> List[IndRef]:
+        # e.g. find(type=b"Font"), find(subtype=b"Image", min_size=1 << 20); builds the index on first use
+        if self.object_index is None:
+            self.build_index()
+        # objects edited outside edit() are only in dirty until the next flush
+        for ref, obj in self.dirty.items():
+            self.object_index.update(ref.N, obj)
+        return self.object_index.find(type, subtype, stream, min_size, max_size)
+
+    def stats(self) -> Dict[str, Any]:
+        # events are only recorded while Instrumentation is enabled
+        ret = {
+            "size": len(self.doc),
+            "objects": len(self.xref.table),
+            "dirty": len(self.dirty),
+            "updated": len(self.updated_ref),
+            "resource_cache": len(self.resource_cache),
+            "indexed": self.sidecar is not None,
+            "recovered": self.recovered,
+            "events": self.events.snapshot(),
+        }
+        if isinstance(self.doc, ReaderView) and isinstance(self.doc.reader, CachedReader):
+            reader = self.doc.reader
+            ret["reader"] = {"hits": reader.hits, "misses": reader.misses, "blocks": len(reader.blocks)}
+        return ret
+
+    def object_stream(self, num: int) -> ObjectStream:
+        key = IndRef(self, num, 0)
+        stream = self.resource_cache.get(key)
+        if stream is None:
+            obj = self.resolve(key)
+            if not isinstance(obj, PDFStream):
+                raise SyntaxError(f"Object {num} is not an object stream")
+            offsets = self.sidecar.objstm_offsets(num) if self.sidecar is not None else None
+            stream = ObjectStream(obj, offsets)
+            self.resource_cache[key] = stream
+        return stream
+
+    @property
+    def pages(self) -> PageTree:
+        if self._pages is None:
+            page_nums = self.sidecar.page_nums if self.sidecar is not None else None
+            self._pages = PageTree(self, page_nums)
+        return self._pages
+
     def mark_updated(self, ref: IndRef, obj: PDFObject):
+        if obj is not PDFNull(self):
+            obj._ref = ref
         if self.xref.update(ref.N, RefSrc(ref, obj), equal_update=True):
             self.updated_ref.add(ref)
+            if self.object_index is not None:
+                self.object_index.update(ref.N, obj)
+
+    def check_writable(self, ref: IndRef):
+        if self._snapshots:
+            raise Exception(f"Object {ref.N} {ref.G} R is shared by the open snapshots of this file, "
+                            f"change it through Snapshot.edit() or close them first")
+
+    def free(self, ref: IndRef):
+        # the entry gets the next generation, the next incremental update writes it as free
+        self.xref.free(ref.N)
+        self.dirty.pop(ref, None)
+        self.resource_cache.pop(ref, None)
+        self.updated_ref.discard(ref)
+        self.updated_ref.add(self.xref.table[ref.N].ref)
+        if self.object_index is not None:
+            self.object_index.update(ref.N, None)
+
+    def mark_dirty(self, ref: IndRef, obj: PDFObject):
+        # only remembered here, the xref is brought up to date by flush()
+        self.dirty[ref] = obj
+        self.resource_cache.pop(ref, None)
+        if self._pages is not None and self._pages.is_node(ref):
+            self._pages.invalidate()
+
+    def flush(self):
+        dirty, self.dirty = self.dirty, dict()
+        for ref, obj in dirty.items():
+            self.mark_updated(ref, obj)
+
+    @contextmanager
+    def edit(self):
+        self._edit_depth += 1
+        try:
+            yield self
+        finally:
+            self._edit_depth -= 1
+            if self._edit_depth == 0:
+                self.flush()
 
     def add_new_ref(self, obj: PDFObject) -> IndRef:
-        ref = IndRef(self, max(self.xref.table.keys())+1, 0)
+        ref = self.xref.allocate()
         self.mark_updated(ref, obj)
         return ref
 
+    def add_new_refs(self, objs: Iterable[PDFObject]) -> List[IndRef]:
+        xref = self.xref
+        ret = []
+        for obj in objs:
+            ref = xref.allocate()
+            obj._ref = ref
+            xref.update(ref.N, RefSrc(ref, obj), equal_update=True)
+            ret.append(ref)
+        self.updated_ref.update(ret)
+        if self.object_index is not None:
+            for ref in ret:
+                self.object_index.update(ref.N, xref.table[ref.N].obj)
+        return ret
+
 
 class Trailer:
     extent: PDFDict
@@ -165,7 +509,7 @@ class Trailer:
         self.file = extent._file
 
     def update(self):
-        self.Size = max(self.file.xref.table.keys()) + 1
+        self.Size = self.file.xref.max_num + 1
 
     @property
     def Size(self) -> int:
@@ -181,8 +525,10 @@ class Trailer:
 
     @Prev.setter
     def Prev(self, offset: Optional[int]) -> None:
-        if offset is None and b"Prev" in self.extent:
-            del self.extent[b"Prev"]
+        if offset is None:
+            if b"Prev" in self.extent:
+                del self.extent[b"Prev"]
+            return
         self.extent[b"Prev"] = PDFInt(self.file, offset)
 
     @property
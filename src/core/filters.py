@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import importlib
+import importlib.util
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# pseudo filter name of the predictor backends, FlateDecode and LZWDecode apply it after decoding
+PREDICTOR = b"Predictor"
+PREDICTED_FILTERS = {b"FlateDecode", b"LZWDecode"}
+PREDICTOR_PARAMS = ("predictor", "colors", "bits_per_component", "columns")
+
+
+def row_length(colors: int = 1, bits_per_component: int = 8, columns: int = 1) -> Tuple[int, int]:
+    # bytes per pixel (at least one) and bytes per row without the PNG filter type byte
+    return max(1, colors * bits_per_component // 8), (colors * bits_per_component * columns + 7) // 8
+
+
+def average_row(row: bytearray, prev: bytes, bpp: int) -> None:
+    for i in range(len(row)):
+        left = row[i - bpp] if i >= bpp else 0
+        row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+
+
+def paeth_row(row: bytearray, prev: bytes, bpp: int) -> None:
+    for i in range(len(row)):
+        a = row[i - bpp] if i >= bpp else 0
+        b = prev[i]
+        c = prev[i - bpp] if i >= bpp else 0
+        p = a + b - c
+        pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+        if pa <= pb and pa <= pc:
+            pred = a
+        elif pb <= pc:
+            pred = b
+        else:
+            pred = c
+        row[i] = (row[i] + pred) & 0xFF
+
+
+class Decoder(ABC):
+    # streaming entry point: update() returns what can be decoded so far, flush() the rest
+    @abstractmethod
+    def update(self, data: bytes) -> bytes:
+        raise Exception("Abstract method")
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class BufferedDecoder(Decoder):
+    # for filters without an incremental implementation, decodes everything in flush()
+    decode: Callable[..., bytes]
+    params: Dict[str, Any]
+    chunks: List[bytes]
+
+    def __init__(self, decode: Callable[..., bytes], params: Dict[str, Any]):
+        self.decode = decode
+        self.params = params
+        self.chunks = []
+
+    def update(self, data: bytes) -> bytes:
+        self.chunks.append(bytes(data))
+        return b""
+
+    def flush(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return self.decode(data, **self.params)
+
+
+class ZlibDecoder(Decoder):
+    def __init__(self, lib):
+        self.obj = lib.decompressobj()
+
+    def update(self, data: bytes) -> bytes:
+        return self.obj.decompress(data)
+
+    def flush(self) -> bytes:
+        return self.obj.flush()
+
+
+class PredictorDecoder(Decoder):
+    # feeds whole rows to the predictor backend and carries the last decoded row over
+    inner: Decoder
+    params: Dict[str, Any]
+    row_len: int
+    stride: int
+    pending: bytes
+    prev: Optional[bytes] = None
+
+    def __init__(self, inner: Decoder, params: Dict[str, Any]):
+        self.inner = inner
+        self.params = params
+        _, self.row_len = row_length(params.get("colors", 1), params.get("bits_per_component", 8),
+                                     params.get("columns", 1))
+        self.stride = self.row_len + 1 if params.get("predictor", 1) >= 10 else self.row_len
+        self.pending = b""
+
+    def _rows(self, data: bytes, final: bool) -> bytes:
+        data = self.pending + data
+        end = len(data) if final else len(data) - len(data) % self.stride
+        self.pending = data[end:]
+        if end == 0:
+            return b""
+        ret = FilterRegistry.unpredict(data[:end], prev=self.prev, **self.params)
+        self.prev = ret[len(ret) - self.row_len:]
+        return ret
+
+    def update(self, data: bytes) -> bytes:
+        return self._rows(self.inner.update(data), False)
+
+    def flush(self) -> bytes:
+        return self._rows(self.inner.flush(), True)
+
+
+class ChainDecoder(Decoder):
+    decoders: List[Decoder]
+
+    def __init__(self, decoders: List[Decoder]):
+        self.decoders = decoders
+
+    def update(self, data: bytes) -> bytes:
+        for decoder in self.decoders:
+            data = decoder.update(data)
+        return data
+
+    def flush(self) -> bytes:
+        data = b""
+        for decoder in self.decoders:
+            data = decoder.update(data) + decoder.flush()
+        return data
+
+
+class Encoder(ABC):
+    # streaming counterpart of Decoder: update() returns the encoded data available so far, flush() the rest
+    @abstractmethod
+    def update(self, data: bytes) -> bytes:
+        raise Exception("Abstract method")
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class BufferedEncoder(Encoder):
+    encode: Callable[..., bytes]
+    params: Dict[str, Any]
+    chunks: List[bytes]
+
+    def __init__(self, encode: Callable[..., bytes], params: Dict[str, Any]):
+        self.encode = encode
+        self.params = params
+        self.chunks = []
+
+    def update(self, data: bytes) -> bytes:
+        self.chunks.append(bytes(data))
+        return b""
+
+    def flush(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return self.encode(data, **self.params)
+
+
+class ZlibEncoder(Encoder):
+    def __init__(self, lib, level: int):
+        self.obj = lib.compressobj(level)
+
+    def update(self, data: bytes) -> bytes:
+        return self.obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self.obj.flush()
+
+
+class Backend(ABC):
+    # one implementation of one filter, the registry picks the available one with the highest priority
+    filter: bytes
+    name: str
+    priority: int = 0
+    module: Optional[str] = None     # optional dependency, imported on first use
+    min_size: int = 0                # smaller buffers go to the next backend
+    lib: Any = None
+
+    def __init__(self, _filter: bytes, name: str, priority: int = 0, module: Optional[str] = None,
+                 min_size: int = 0):
+        self.filter = _filter
+        self.name = name
+        self.priority = priority
+        self.module = module
+        self.min_size = min_size
+
+    def available(self) -> bool:
+        if self.module is None or self.lib is not None:
+            return True
+        try:
+            if importlib.util.find_spec(self.module) is None:
+                return False
+        except ImportError:
+            return False
+        self.lib = importlib.import_module(self.module)
+        return True
+
+    @abstractmethod
+    def decode(self, value: bytes, **params) -> bytes:
+        raise Exception("Abstract method")
+
+    def encode(self, value: bytes, **params) -> bytes:
+        raise Exception(f"{self.filter.decode('ascii')} backend {self.name} can not encode")
+
+    def can_encode(self, **params) -> bool:
+        return True
+
+    def decoder(self, **params) -> Decoder:
+        return BufferedDecoder(self.decode, params)
+
+    def encoder(self, **params) -> Encoder:
+        return BufferedEncoder(self.encode, params)
+
+    def __repr__(self):
+        return f"Backend({self.filter.decode('ascii')}, {self.name})"
+
+
+class FunctionBackend(Backend):
+    def __init__(self, _filter: bytes, name: str, decode: Callable[..., bytes],
+                 encode: Optional[Callable[..., bytes]] = None, priority: int = 0):
+        super().__init__(_filter, name, priority)
+        self._decode = decode
+        self._encode = encode
+
+    def decode(self, value: bytes, **params) -> bytes:
+        return self._decode(value, **params)
+
+    def encode(self, value: bytes, **params) -> bytes:
+        if self._encode is None:
+            return super().encode(value, **params)
+        return self._encode(value, **params)
+
+
+class ZlibBackend(Backend):
+    # zlib and the drop-in replacements with the same module interface (isal_zlib, zlib_ng)
+    max_level: int
+
+    def __init__(self, name: str, module: str, priority: int, max_level: int = 9):
+        super().__init__(b"FlateDecode", name, priority, module)
+        self.max_level = max_level
+
+    def decode(self, value: bytes) -> bytes:
+        return self.lib.decompress(value)
+
+    def encode(self, value: bytes, level: int = -1) -> bytes:
+        # -1 is the default level of the library, higher levels are capped at what it supports
+        if level < 0:
+            return self.lib.compress(value)
+        return self.lib.compress(value, min(level, self.max_level))
+
+    def can_encode(self, level: int = -1) -> bool:
+        # a level above what the library supports goes to the next backend
+        return level <= self.max_level
+
+    def decoder(self) -> Decoder:
+        return ZlibDecoder(self.lib)
+
+    def encoder(self, level: int = -1) -> Encoder:
+        return ZlibEncoder(self.lib, -1 if level < 0 else min(level, self.max_level))
+
+
+class PassthroughBackend(Backend):
+    # image codecs the library does not decode, the data stays in its encoded form
+    def __init__(self, _filter: bytes):
+        super().__init__(_filter, "passthrough")
+
+    def decode(self, value: bytes, **params) -> bytes:
+        return value
+
+    def encode(self, value: bytes, **params) -> bytes:
+        return value
+
+
+class IdentityCryptBackend(Backend):
+    # /Crypt with the Identity crypt filter, any other crypt filter needs a security handler backend
+    def __init__(self):
+        super().__init__(b"Crypt", "identity")
+
+    def decode(self, value: bytes, name: bytes = b"Identity", **params) -> bytes:
+        if name != b"Identity":
+            raise Exception(f"Crypt filter /{name.decode('latin-1')} needs a security handler")
+        return value
+
+    def encode(self, value: bytes, name: bytes = b"Identity", **params) -> bytes:
+        return self.decode(value, name)
+
+
+class NumpyPredictorBackend(Backend):
+    # vectorizes whole runs of None, Sub and Up rows, Average and Paeth rows are done one by one
+    def __init__(self):
+        super().__init__(PREDICTOR, "numpy", 20, "numpy", 1 << 16)
+
+    def decode(self, value: bytes, predictor: int = 1, colors: int = 1, bits_per_component: int = 8,
+               columns: int = 1, prev: Optional[bytes] = None) -> bytes:
+        np = self.lib
+        if predictor == 1:
+            return value
+        bpp, row_len = row_length(colors, bits_per_component, columns)
+        if predictor == 2:
+            if bits_per_component != 8:
+                raise Exception("TIFF predictor is supported only for 8 bits per component")
+            rows = -(-len(value) // row_len)
+            data = np.zeros(rows * row_len, dtype=np.uint8)
+            data[:len(value)] = np.frombuffer(value, dtype=np.uint8)
+            data = data.reshape(rows, row_len)
+            data = np.cumsum(data.reshape(rows, -1, bpp), axis=1, dtype=np.uint8)
+            return data.tobytes()[:len(value)]
+
+        stride = row_len + 1
+        rows = -(-len(value) // stride)
+        data = np.zeros(rows * stride, dtype=np.uint8)
+        data[:len(value)] = np.frombuffer(value, dtype=np.uint8)
+        data = data.reshape(rows, stride)
+        kinds = data[:, 0].astype(np.int16)
+        out = data[:, 1:].copy()
+        last = np.frombuffer(prev, dtype=np.uint8) if prev else np.zeros(row_len, dtype=np.uint8)
+        starts = np.flatnonzero(np.diff(kinds, prepend=-1))
+        for start, end in zip(starts, list(starts[1:]) + [rows]):
+            kind = kinds[start]
+            run = out[start:end]
+            if kind == 1:
+                run[:] = np.cumsum(run.reshape(end - start, -1, bpp), axis=1, dtype=np.uint8
+                                   ).reshape(end - start, row_len)
+            elif kind == 2:
+                run[0] += last
+                run[:] = np.cumsum(run, axis=0, dtype=np.uint8)
+            elif kind in (3, 4):
+                step = average_row if kind == 3 else paeth_row
+                for i in range(start, end):
+                    row = bytearray(out[i].tobytes())
+                    step(row, last.tobytes(), bpp)
+                    out[i] = np.frombuffer(row, dtype=np.uint8)
+                    last = out[i]
+            last = out[end - 1]
+        return out.tobytes()
+
+
+class FilterRegistry:
+    # filter name -> backends, the pure Python ones are registered by stream.Filter
+    backends: Dict[bytes, List[Backend]] = dict()
+    preferred: Dict[bytes, str] = dict()
+    _candidates: Dict[bytes, List[Backend]] = dict()
+
+    @staticmethod
+    def register(backend: Backend) -> None:
+        backends = FilterRegistry.backends.setdefault(backend.filter, [])
+        backends[:] = [b for b in backends if b.name != backend.name] + [backend]
+        FilterRegistry._candidates.clear()
+
+    @staticmethod
+    def unregister(_filter: bytes, name: str) -> None:
+        FilterRegistry.backends[_filter] = [b for b in FilterRegistry.backends.get(_filter, []) if b.name != name]
+        FilterRegistry._candidates.clear()
+
+    @staticmethod
+    def prefer(_filter: bytes, name: Optional[str]) -> None:
+        # pins one backend, e.g. to compare them, None returns to the automatic choice
+        if name is None:
+            FilterRegistry.preferred.pop(_filter, None)
+        elif not any(b.name == name for b in FilterRegistry.backends.get(_filter, [])):
+            raise Exception(f"No backend {name} for {_filter.decode('latin-1')}")
+        else:
+            FilterRegistry.preferred[_filter] = name
+        FilterRegistry._candidates.clear()
+
+    @staticmethod
+    def candidates(_filter: bytes) -> List[Backend]:
+        ret = FilterRegistry._candidates.get(_filter)
+        if ret is None:
+            backends = FilterRegistry.backends.get(_filter)
+            if not backends:
+                raise Exception(f"Unsupported filter {_filter.decode('latin-1')}")
+            name = FilterRegistry.preferred.get(_filter)
+            ret = [b for b in backends if name is None or b.name == name]
+            ret = sorted((b for b in ret if b.available()), key=lambda b: -b.priority)
+            FilterRegistry._candidates[_filter] = ret
+        return ret
+
+    @staticmethod
+    def available(_filter: bytes) -> List[Backend]:
+        return sorted((b for b in FilterRegistry.backends.get(_filter, []) if b.available()),
+                      key=lambda b: -b.priority)
+
+    @staticmethod
+    def select(_filter: bytes, size: int = 0) -> Backend:
+        return FilterRegistry._pick(_filter, FilterRegistry.candidates(_filter), size)
+
+    @staticmethod
+    def select_encoder(_filter: bytes, size: int = 0, **params) -> Backend:
+        # backends that can not encode with these parameters are passed over; when no other is left, e.g. one
+        # pinned with prefer(), it encodes with what it supports
+        candidates = FilterRegistry.candidates(_filter)
+        return FilterRegistry._pick(_filter, [b for b in candidates if b.can_encode(**params)] or candidates, size)
+
+    @staticmethod
+    def _pick(_filter: bytes, candidates: List[Backend], size: int) -> Backend:
+        for backend in candidates:
+            if size >= backend.min_size:
+                return backend
+        if candidates:
+            return candidates[-1]
+        raise Exception(f"No available backend for {_filter.decode('latin-1')}")
+
+    @staticmethod
+    def _split(_filter: bytes, params: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if _filter not in PREDICTED_FILTERS:
+            return params, dict()
+        return ({k: v for k, v in params.items() if k not in PREDICTOR_PARAMS},
+                {k: v for k, v in params.items() if k in PREDICTOR_PARAMS})
+
+    @staticmethod
+    def unpredict(value: bytes, prev: Optional[bytes] = None, **params) -> bytes:
+        if params.get("predictor", 1) == 1:
+            return value
+        return FilterRegistry.select(PREDICTOR, len(value)).decode(value, prev=prev, **params)
+
+    @staticmethod
+    def decode(value: bytes, _filter: bytes, **params) -> bytes:
+        params, predictor = FilterRegistry._split(_filter, params)
+        value = FilterRegistry.select(_filter, len(value)).decode(value, **params)
+        return FilterRegistry.unpredict(value, **predictor) if predictor else value
+
+    @staticmethod
+    def encode(value: bytes, _filter: bytes, **params) -> bytes:
+        if _filter.endswith(b"Encode"):
+            _filter = _filter[:-6] + b"Decode"
+        params, predictor = FilterRegistry._split(_filter, params)
+        if predictor.get("predictor", 1) != 1:
+            raise Exception("Encoding with a predictor is not supported")
+        return FilterRegistry.select_encoder(_filter, len(value), **params).encode(value, **params)
+
+    @staticmethod
+    def decoder(_filter: bytes, backend: Optional[Backend] = None, **params) -> Decoder:
+        params, predictor = FilterRegistry._split(_filter, params)
+        # streams arrive in chunks, so the backend is chosen without a size
+        ret = (backend or FilterRegistry.candidates(_filter)[0]).decoder(**params)
+        if predictor.get("predictor", 1) != 1:
+            ret = PredictorDecoder(ret, predictor)
+        return ret
+
+    @staticmethod
+    def encoder(_filter: bytes, **params) -> Encoder:
+        if _filter.endswith(b"Encode"):
+            _filter = _filter[:-6] + b"Decode"
+        params, predictor = FilterRegistry._split(_filter, params)
+        if predictor.get("predictor", 1) != 1:
+            raise Exception("Encoding with a predictor is not supported")
+        return FilterRegistry.select_encoder(_filter, **params).encoder(**params)
+
+    @staticmethod
+    def chain_decoder(chain: Iterable[Tuple[bytes, dict]]) -> Decoder:
+        return ChainDecoder([FilterRegistry.decoder(_filter, **params) for _filter, params in chain])
+
+
+# accelerated backends, probed and imported the first time their filter is used
+FilterRegistry.register(ZlibBackend("isal", "isal.isal_zlib", 30, 3))
+FilterRegistry.register(ZlibBackend("zlib-ng", "zlib_ng.zlib_ng", 20))
+FilterRegistry.register(ZlibBackend("zlib", "zlib", 10))
+FilterRegistry.register(NumpyPredictorBackend())
+for _name in (b"DCTDecode", b"JPXDecode", b"CCITTFaxDecode", b"JBIG2Decode"):
+    FilterRegistry.register(PassthroughBackend(_name))
+FilterRegistry.register(IdentityCryptBackend())
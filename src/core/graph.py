@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Collection, Dict, Iterable, Iterator, List, Set
+
+from .objects import *
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+
+class ObjectGraph:
+    @staticmethod
+    def children(obj: PDFObject) -> List[PDFObject]:
+        if isinstance(obj, PDFDict):
+            return list(obj.value.values())
+        if isinstance(obj, PDFArray):
+            return obj.value
+        if isinstance(obj, PDFStream):
+            return [obj.extent]
+        return []
+
+    @staticmethod
+    def iter_refs(obj: PDFObject, skip_keys: Collection[bytes] = ()) -> Iterator[IndRef]:
+        # walks direct objects only, indirect objects are reported but not entered
+        stack = [obj]
+        while stack:
+            curr = stack.pop()
+            if isinstance(curr, IndRef):
+                yield curr
+            elif skip_keys and isinstance(curr, PDFDict):
+                stack.extend(reversed([v for k, v in curr.value.items() if k not in skip_keys]))
+            elif isinstance(curr, (PDFDict, PDFArray, PDFStream)):
+                stack.extend(reversed(ObjectGraph.children(curr)))
+
+    @staticmethod
+    def reachable(file: PDFFile, roots: Iterable[IndRef]) -> List[IndRef]:
+        marked: Set[int] = set()
+        ret = []
+        stack = list(roots)
+        stack.reverse()
+        while stack:
+            ref = stack.pop()
+            if ref.N in marked:
+                continue
+            obj = file.resolve(ref)
+            if obj is PDFNull(file):
+                continue
+            marked.add(ref.N)
+            ret.append(file.xref.table[ref.N].ref)
+            refs = list(ObjectGraph.iter_refs(obj))
+            refs.reverse()
+            stack.extend(refs)
+        return ret
+
+    @staticmethod
+    def remap(obj: PDFObject, mapping: Dict[IndRef, IndRef], keep_missing: bool = False) -> bool:
+        # rewrites references in place, dangling references become null unless keep_missing
+        file = obj._file
+        changed = False
+        stack = [obj]
+        while stack:
+            curr = stack.pop()
+            if isinstance(curr, PDFStream):
+                stack.append(curr.extent)
+            elif isinstance(curr, PDFDict):
+                for k, v in curr.value.items():
+                    if isinstance(v, IndRef):
+                        new = mapping.get(v, v if keep_missing else PDFNull(file))
+                        if new is not v:
+                            curr.value[k] = new
+                            changed = True
+                    else:
+                        stack.append(v)
+            elif isinstance(curr, PDFArray):
+                for i, v in enumerate(curr.value):
+                    if isinstance(v, IndRef):
+                        new = mapping.get(v, v if keep_missing else PDFNull(file))
+                        if new is not v:
+                            curr.value[i] = new
+                            changed = True
+                    else:
+                        stack.append(v)
+        return changed
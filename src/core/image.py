@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import os
+from io import BytesIO
+from typing import BinaryIO, Iterator
+
+from .objects import *
+from .stream import Stream
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+    from .file import PDFFile
+
+
+PASSTHROUGH_FILTERS = {b"DCTDecode": "jpg", b"JPXDecode": "jp2"}
+COLOR_COMPONENTS = {b"DeviceGray": 1, b"CalGray": 1, b"G": 1, b"DeviceRGB": 3, b"CalRGB": 3, b"RGB": 3,
+                    b"Lab": 3, b"DeviceCMYK": 4, b"CMYK": 4, b"Separation": 1, b"Pattern": 1}
+PIL_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+
+
+class ImageXObject(Stream):
+    def __init__(self, stream: PDFStream):
+        super().__init__(stream)
+
+    @property
+    def Width(self) -> int:
+        return self.extent.get_expected(b'Width', PDFInt).to_python()
+
+    @property
+    def Height(self) -> int:
+        return self.extent.get_expected(b'Height', PDFInt).to_python()
+
+    @property
+    def ImageMask(self) -> bool:
+        mask = self.extent.get(b'ImageMask')
+        return isinstance(mask, PDFBool) and mask.value
+
+    @property
+    def BitsPerComponent(self) -> int:
+        if self.ImageMask:
+            return 1
+        bpc = self.extent.get(b'BitsPerComponent')
+        return bpc.value if isinstance(bpc, PDFInt) else 8
+
+    @property
+    def ColorSpace(self) -> Nullable[PDFName | PDFArray]:
+        return self.extent.get_expected(b'ColorSpace', Nullable[Union[PDFName, PDFArray]])
+
+    @property
+    def Decode(self) -> Optional[List[float]]:
+        decode = self.extent.get(b'Decode')
+        if isinstance(decode, PDFArray):
+            return [float(v.resolve().value) for v in decode.value]
+        return None
+
+    @property
+    def encoded_format(self) -> Optional[str]:
+        # extension of the file format the stream already contains, if it can be written as is
+        chain = self.filter_chain()
+        if chain:
+            return PASSTHROUGH_FILTERS.get(chain[-1][0])
+        return None
+
+    def encoded_data(self) -> bytes:
+        return self.decode(skip_last=1)
+
+    @staticmethod
+    def _components(space: PDFObject) -> int:
+        space = space.resolve()
+        if isinstance(space, PDFName):
+            return COLOR_COMPONENTS.get(space.value, 3)
+        if isinstance(space, PDFArray) and space.value:
+            family = space.value[0].resolve().value
+            if family in (b"Indexed", b"I"):
+                return 1
+            if family == b"ICCBased":
+                return space.value[1].resolve().extent.get_expected(b'N', PDFInt).value
+            if family == b"DeviceN":
+                return len(space.value[1].resolve().value)
+            return COLOR_COMPONENTS.get(family, 3)
+        return 1
+
+    def _color_space(self) -> Tuple[int, Optional[PDFArray]]:
+        # components per sample and, for /Indexed, the color space array holding the palette
+        if self.ImageMask:
+            return 1, None
+        space = self.ColorSpace
+        if isinstance(space, PDFArray) and space.value and space.value[0].resolve().value in (b"Indexed", b"I"):
+            return 1, space
+        return self._components(space), None
+
+    @staticmethod
+    def _lookup(space: PDFArray) -> Tuple[int, bytes]:
+        components = ImageXObject._components(space.value[1])
+        table = space.value[3].resolve()
+        if isinstance(table, PDFStream):
+            return components, Stream(table).decode()
+        return components, table.value
+
+    def samples(self) -> np.ndarray:
+        # raw samples as (height, width, components), uint8 for <= 8 bits and uint16 for 16 bits
+        import numpy as np
+        width, height, bpc = self.Width, self.Height, self.BitsPerComponent
+        components, _ = self._color_space()
+        data = self.decode()
+        row = (width * components * bpc + 7) // 8
+        if bpc == 16:
+            flat = np.frombuffer(data, dtype=">u2", count=width * components * height)
+            return flat.reshape(height, width, components)
+        rows = np.frombuffer(data, dtype=np.uint8, count=row * height).reshape(height, row)
+        if bpc == 8:
+            return rows.reshape(height, width, components)
+        bits = np.unpackbits(rows, axis=1)[:, :width * components * bpc]
+        if bpc == 1:
+            return bits.reshape(height, width, components)
+        weights = (1 << np.arange(bpc - 1, -1, -1)).astype(np.uint8)
+        packed = bits.reshape(height, width * components, bpc) @ weights
+        return packed.astype(np.uint8).reshape(height, width, components)
+
+    def to_numpy(self) -> np.ndarray:
+        # samples with /Decode applied, palette expanded and scaled to 8 bits per component
+        import numpy as np
+        bpc = self.BitsPerComponent
+        components, indexed = self._color_space()
+        samples = self.samples()
+        levels = (1 << bpc) - 1
+        if indexed is not None:
+            base_components, table = self._lookup(indexed)
+            palette = np.zeros((levels + 1) * base_components, dtype=np.uint8)
+            palette[:min(len(table), len(palette))] = np.frombuffer(table, dtype=np.uint8)[:len(palette)]
+            return palette.reshape(levels + 1, base_components)[samples[:, :, 0]]
+
+        decode = self.Decode
+        if decode is None and bpc == 8:
+            return samples
+        if decode is None:
+            decode = [0.0, 1.0] * components
+        # one lookup table per component keeps the mapping vectorized
+        codes = np.arange(levels + 1, dtype=np.float64) / levels
+        tables = np.stack([
+            np.clip((decode[2 * c] + codes * (decode[2 * c + 1] - decode[2 * c])) * 255 + 0.5, 0, 255)
+            for c in range(components)
+        ]).astype(np.uint8)
+        return tables[np.arange(components), samples]
+
+    def to_pil(self) -> Image.Image:
+        import numpy as np
+        from PIL import Image
+        if self.encoded_format is not None:
+            return Image.open(BytesIO(self.encoded_data()))
+
+        width, height, bpc = self.Width, self.Height, self.BitsPerComponent
+        components, indexed = self._color_space()
+        mode = PIL_MODES.get(components)
+        if bpc == 8 and indexed is None and self.Decode is None and mode is not None:
+            # the decoded buffer already has the layout PIL expects, share it
+            return Image.frombuffer(mode, (width, height), self.decode(), "raw", mode, 0, 1)
+        pixels = self.to_numpy()
+        mode = PIL_MODES.get(pixels.shape[2])
+        if mode is None:
+            raise Exception(f"Can not convert {pixels.shape[2]} color components to an image")
+        if pixels.shape[2] == 1:
+            pixels = pixels[:, :, 0]
+        return Image.fromarray(np.ascontiguousarray(pixels), mode)
+
+    def save(self, fp: str | BinaryIO) -> str:
+        # DCT and JPX data is copied as is, everything else is written as PNG
+        extension = self.encoded_format
+        if isinstance(fp, str) and not os.path.splitext(fp)[1]:
+            fp = f"{fp}.{extension or 'png'}"
+        if extension is not None:
+            data = self.encoded_data()
+            if isinstance(fp, str):
+                with open(fp, "wb") as f:
+                    f.write(data)
+            else:
+                fp.write(data)
+        else:
+            image = self.to_pil()
+            if image.mode == "CMYK":
+                image = image.convert("RGB")
+            image.save(fp, format="PNG")
+        return extension or "png"
+
+    @staticmethod
+    def is_image(obj: PDFObject) -> bool:
+        return isinstance(obj, PDFStream) and isinstance(obj.extent.value.get(b"Subtype"), PDFName) \
+            and obj.extent.value[b"Subtype"].value == b"Image"
+
+    @staticmethod
+    def iter_images(file: PDFFile) -> Iterator[Tuple[IndRef, ImageXObject]]:
+        for num in sorted(file.xref.table):
+            src = file.xref.table[num]
+            obj = file.resolve(src.ref)
+            if ImageXObject.is_image(obj):
+                yield src.ref, ImageXObject(obj)
+
+    @staticmethod
+    def dump(file: PDFFile, directory: str) -> List[str]:
+        os.makedirs(directory, exist_ok=True)
+        ret = []
+        for ref, image in ImageXObject.iter_images(file):
+            path = os.path.join(directory, f"{ref.N}_{ref.G}")
+            ret.append(f"{path}.{image.save(path)}")
+        return ret
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import io
+from typing import Dict, Iterable, List, Set
+
+from .objects import *
+from .graph import ObjectGraph
+from .pages import Page, INHERITABLE_KEYS
+from .stream import Filter
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+
+# catalog entries a viewer needs before the first page, they go with the catalog into the first-page xref
+DOC_LEVEL_KEYS = (b"ViewerPreferences", b"PageMode", b"Threads", b"OpenAction", b"AcroForm", b"Names", b"Lang")
+# objects of these types belong to the document structure, a page closure never enters them
+STRUCTURE_TYPES = {b"Catalog", b"Pages", b"Page"}
+OFFSET_WIDTH = 10
+
+
+class BitWriter:
+    # msb first, hint table items are packed without padding inside a column
+    buffer: bytearray
+    acc: int = 0
+    nbits: int = 0
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, value: int, bits: int) -> None:
+        if bits == 0:
+            return
+        self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+        self.nbits += bits
+        while self.nbits >= 8:
+            self.nbits -= 8
+            self.buffer.append((self.acc >> self.nbits) & 0xFF)
+        self.acc &= (1 << self.nbits) - 1
+
+    def align(self) -> None:
+        if self.nbits:
+            self.write(0, 8 - self.nbits)
+
+    def getvalue(self) -> bytes:
+        self.align()
+        return bytes(self.buffer)
+
+
+class Linearizer:
+    @staticmethod
+    def _type(obj: PDFObject) -> Optional[bytes]:
+        if isinstance(obj, PDFStream):
+            obj = obj.extent
+        if isinstance(obj, PDFDict):
+            t = obj.value.get(b"Type")
+            if isinstance(t, PDFName):
+                return t.value
+        return None
+
+    @staticmethod
+    def _closure(file: PDFFile, roots: Iterable[PDFObject], claimed: Set[int]) -> List[int]:
+        # depth first like ObjectGraph.reachable, but stops at other pages and at the page tree
+        ret = []
+        stack = [ref for root in roots for ref in ObjectGraph.iter_refs(root)]
+        stack.reverse()
+        while stack:
+            ref = stack.pop()
+            if ref.N in claimed:
+                continue
+            obj = file.resolve(ref)
+            if obj is PDFNull(file) or Linearizer._type(obj) in STRUCTURE_TYPES:
+                continue
+            claimed.add(ref.N)
+            ret.append(ref.N)
+            refs = list(ObjectGraph.iter_refs(obj))
+            refs.reverse()
+            stack.extend(refs)
+        return ret
+
+    @staticmethod
+    def _page_closure(file: PDFFile, page: Page) -> List[int]:
+        roots = [v for k, v in page.obj.value.items() if k != b"Parent"]
+        for key in INHERITABLE_KEYS:
+            if key in page.obj.value:
+                continue
+            for node in page.parents:
+                if key in node.value:
+                    roots.append(node.value[key])
+                    break
+        return [page.ref.N] + Linearizer._closure(file, roots, {page.ref.N})
+
+    @staticmethod
+    def plan(file: PDFFile) -> Dict[str, List[int]]:
+        # object numbers of every section in file order: doc (part 4), first (part 6),
+        # pages (part 7, page by page), shared (part 8) and other (part 9)
+        root = file.trailer.extent.value.get(b"Root")
+        if not isinstance(root, IndRef):
+            raise Exception("Can not linearize a document without an indirect /Root")
+        pages = list(file.pages)
+        if not pages:
+            raise Exception("Can not linearize a document without pages")
+        if any(page.ref is None for page in pages):
+            raise Exception("Can not linearize a page tree with direct page objects")
+
+        closures = [Linearizer._page_closure(file, page) for page in pages]
+        owners: Dict[int, int] = dict()
+        for i, closure in enumerate(closures):
+            for num in closure:
+                owners[num] = owners.get(num, 0) + 1
+
+        catalog = file.resolve(root)
+        doc_roots = [catalog.value[k] for k in DOC_LEVEL_KEYS if isinstance(catalog, PDFDict) and k in catalog.value]
+        doc = [root.N] + Linearizer._closure(file, doc_roots, {root.N} | set(owners))
+        placed = set(doc)
+
+        first = [num for num in closures[0] if num not in placed]
+        placed.update(first)
+        page_sections = []
+        shared = []
+        for closure in closures[1:]:
+            private = []
+            for num in closure:
+                if num in placed:
+                    continue
+                if owners[num] > 1:
+                    shared.append(num)
+                else:
+                    private.append(num)
+                placed.add(num)
+            page_sections.append(private)
+        other = [ref.N for ref in ObjectGraph.reachable(file, ObjectGraph.iter_refs(file.trailer.extent))
+                 if ref.N not in placed]
+        return {"doc": doc, "first": first, "pages": page_sections, "shared": shared, "other": other,
+                "closures": closures}
+
+    @staticmethod
+    def _hint_stream(file: PDFFile, plan: Dict[str, List[int]], lengths: Dict[int, int],
+                     offsets: Dict[int, int]) -> PDFStream:
+        first, shared = plan["first"], plan["shared"]
+        page_groups = [first] + plan["pages"]
+        page_counts = [len(group) for group in page_groups]
+        page_lengths = [sum(lengths[num] for num in group) for group in page_groups]
+
+        shared_entries = first + shared
+        shared_ids = {num: i for i, num in enumerate(shared_entries)}
+        page_shared = [[]] + [[shared_ids[num] for num in closure if num in shared_ids]
+                              for closure in plan["closures"][1:]]
+
+        min_count, min_length = min(page_counts), min(page_lengths)
+        count_bits = (max(page_counts) - min_count).bit_length()
+        length_bits = (max(page_lengths) - min_length).bit_length()
+        nshared_bits = max(map(len, page_shared)).bit_length()
+        id_bits = max(len(shared_entries) - 1, 0).bit_length()
+
+        w = BitWriter()
+        for value, bits in ((min_count, 32), (offsets[first[0]], 32), (count_bits, 16), (min_length, 32),
+                            (length_bits, 16), (0, 32), (0, 16), (min_length, 32), (length_bits, 16),
+                            (nshared_bits, 16), (id_bits, 16), (0, 16), (1, 16)):
+            w.write(value, bits)
+        for column in ([(c - min_count, count_bits) for c in page_counts],
+                       [(n - min_length, length_bits) for n in page_lengths],
+                       [(len(ids), nshared_bits) for ids in page_shared],
+                       [(i, id_bits) for ids in page_shared for i in ids],
+                       [(n - min_length, length_bits) for n in page_lengths]):
+            for value, bits in column:
+                w.write(value, bits)
+            w.align()
+        page_table = w.getvalue()
+
+        group_lengths = [lengths[num] for num in shared_entries]
+        min_group = min(group_lengths)
+        group_bits = (max(group_lengths) - min_group).bit_length()
+        w = BitWriter()
+        for value, bits in ((shared[0] if shared else 0, 32), (offsets[shared[0]] if shared else 0, 32),
+                            (len(first), 32), (len(shared_entries), 32), (0, 16), (min_group, 32), (group_bits, 16)):
+            w.write(value, bits)
+        for column in ([(n - min_group, group_bits) for n in group_lengths], [(0, 1)] * len(group_lengths)):
+            for value, bits in column:
+                w.write(value, bits)
+            w.align()
+        shared_table = w.getvalue()
+
+        data = Filter.FlateEncode(page_table + shared_table)
+        extent = PDFDict(file, {b"Filter": PDFName(file, b"FlateDecode"), b"Length": PDFInt(file, len(data)),
+                                b"S": PDFInt(file, len(page_table))})
+        return PDFStream(file, data, extent)
+
+    @staticmethod
+    def _object_bytes(file: PDFFile, num: int) -> bytes:
+        ref = IndRef(file, num, 0)
+        return f"{num} 0 obj\n".encode('ascii') + file.object_bytes(file.resolve(ref), ref) + b"\nendobj\n"
+
+    @staticmethod
+    def write(file: PDFFile, buffer: io.BytesIO) -> Dict[IndRef, IndRef]:
+        # renumbers like compact(): the main xref gets 1..m-1 for the later pages, shared and other objects,
+        # the first-page xref gets m.. for the linearization dict, catalog, hint stream and first page
+        plan = Linearizer.plan(file)
+        main = [num for section in plan["pages"] for num in section] + plan["shared"] + plan["other"]
+        m = len(main) + 1
+        lin_num = m
+        doc_nums = list(range(m + 1, m + 1 + len(plan["doc"])))
+        hint_num = m + 1 + len(plan["doc"])
+        size = hint_num + 1 + len(plan["first"])
+
+        new_nums = {num: i + 1 for i, num in enumerate(main)}
+        new_nums.update(zip(plan["doc"], doc_nums))
+        new_nums.update((num, hint_num + 1 + i) for i, num in enumerate(plan["first"]))
+        renumbered = {file.xref.table[num].ref: IndRef(file, new, 0) for num, new in new_nums.items()}
+        file._renumber(renumbered)
+
+        def renum(nums: List[int]) -> List[int]:
+            return [new_nums[num] for num in nums]
+
+        doc, first, shared = renum(plan["doc"]), renum(plan["first"]), renum(plan["shared"])
+        page_sections = [renum(section) for section in plan["pages"]]
+        other = renum(plan["other"])
+        closures = [renum(closure) for closure in plan["closures"]]
+        blobs = {num: Linearizer._object_bytes(file, num) for num in range(1, size) if num not in (lin_num, hint_num)}
+        lengths = {num: len(blob) for num, blob in blobs.items()}
+
+        file.trailer.Prev = None
+        file.trailer.Size = size
+        trailer = file.trailer.extent.to_bytes()[:-2]
+
+        def lin_dict(length: int, hint: int, hint_length: int, end: int, main_entry: int) -> bytes:
+            return (f"{lin_num} 0 obj\n<< /Linearized 1 /L {length:{OFFSET_WIDTH}} "
+                    f"/H [ {hint:{OFFSET_WIDTH}} {hint_length:{OFFSET_WIDTH}} ] /O {first[0]} "
+                    f"/E {end:{OFFSET_WIDTH}} /N {len(closures)} /T {main_entry:{OFFSET_WIDTH}} >>\nendobj\n"
+                    ).encode('ascii')
+
+        def first_xref(entries: List[int], prev: int) -> bytes:
+            table = b"".join(f"{off:010} 00000 n\r\n".encode('ascii') for off in entries)
+            return (f"xref\n{lin_num} {size - lin_num}\n".encode('ascii') + table + b"trailer\n" + trailer
+                    + f"\n/Prev {prev:{OFFSET_WIDTH}}>>\nstartxref\n0\n%%EOF\n".encode('ascii'))
+
+        # every number in the two blocks above is padded, so their length is known before the offsets are
+        start = buffer.tell()
+        xref_pos = start + len(lin_dict(0, 0, 0, 0, 0))
+        pos = xref_pos + len(first_xref([0] * (size - lin_num), 0))
+        offsets = dict()
+        for num in doc:
+            offsets[num] = pos
+            pos += lengths[num]
+        hint_pos = pos
+        # hint tables give offsets as if the hint stream were absent
+        order = first + [num for section in page_sections for num in section] + shared + other
+        for num in order:
+            offsets[num] = pos
+            pos += lengths[num]
+        virtual_end = pos
+
+        hint = Linearizer._hint_stream(file, {"first": first, "pages": page_sections, "shared": shared,
+                                              "closures": closures}, lengths, offsets)
+        hint_blob = (f"{hint_num} 0 obj\n".encode('ascii') + file.object_bytes(hint, IndRef(file, hint_num, 0))
+                     + b"\nendobj\n")
+        for num in order:
+            offsets[num] += len(hint_blob)
+        offsets[hint_num] = hint_pos
+        offsets[lin_num] = start
+
+        main_xref = virtual_end + len(hint_blob)
+        main_head = f"xref\n0 {m}".encode('ascii')
+        main_table = (main_head + b"\n" + f"{0:010} {65535:05} f\r\n".encode('ascii')
+                      + b"".join(f"{offsets[num]:010} 00000 n\r\n".encode('ascii') for num in range(1, m))
+                      + b"trailer\n" + PDFDict(file, {b"Size": PDFInt(file, m)}).to_bytes()
+                      + f"\nstartxref\n{xref_pos}\n%%EOF\n".encode('ascii'))
+        end_first = offsets[first[-1]] + lengths[first[-1]]
+        total = main_xref + len(main_table)
+
+        buffer.write(lin_dict(total, hint_pos, len(hint_blob), end_first, main_xref + len(main_head)))
+        buffer.write(first_xref([offsets[num] for num in range(lin_num, size)], main_xref))
+        for num in doc:
+            buffer.write(blobs[num])
+        buffer.write(hint_blob)
+        for num in order:
+            buffer.write(blobs[num])
+        buffer.write(main_table)
+        return renumbered
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import gc
+import io
+from array import array
+from typing import BinaryIO, Dict, Iterable, List, Sequence, Tuple
+
+from .objects import *
+from .pages import Page, INHERITABLE_KEYS
+from .stream import Stream
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+# objects of these types belong to the page tree of the source, references into it are not followed
+STRUCTURE_TYPES = {b"Catalog", b"Pages", b"Page"}
+PAGE_TREE_FANOUT = 32
+
+
+class Merger:
+    # copies the pages of any number of documents into one output, objects are written as they are reached,
+    # so what stays in memory is one source document and the offset of every written object
+    output: BinaryIO
+    offsets: array
+    leaves: List[int]
+    leaf_kids: List[List[int]]
+    pages: List[int]
+    _owned: bool
+    _map: Dict[int, int]
+    _pos: int = 0
+    _source: Optional[PDFFile] = None
+
+    def __init__(self, output: str | BinaryIO):
+        self._owned = isinstance(output, str)
+        self.output = open(output, "wb") if self._owned else output
+        self.offsets = array("Q", [0])
+        self.leaves = []
+        self.leaf_kids = []
+        self.pages = []
+        self._map = dict()
+        self._write(b"%PDF-2.0\n%\xdd\xdd\xdd\xdd\n")
+
+    def __enter__(self) -> Merger:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._owned:
+            self.output.close()
+
+    def _write(self, data: bytes) -> None:
+        self.output.write(data)
+        self._pos += len(data)
+
+    def _allocate(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets) - 1
+
+    def _write_object(self, num: int, parts: List[bytes]) -> None:
+        self.offsets[num] = self._pos
+        self._write(b"%d 0 obj\n" % num + b"".join(parts) + b"\nendobj\n")
+
+    def _type(self, obj: PDFObject) -> Optional[bytes]:
+        if isinstance(obj, PDFStream):
+            obj = obj.extent
+        if isinstance(obj, PDFDict):
+            t = obj.value.get(b"Type")
+            if isinstance(t, PDFName):
+                return t.value
+        return None
+
+    def _ref(self, ref: IndRef, pending: List[IndRef]) -> bytes:
+        # numbers are given out when a reference is first met, the object is queued to be written
+        num = self._map.get(ref.N)
+        if num is None:
+            obj = self._source.resolve(ref)
+            if obj is PDFNull(self._source) or self._type(obj) in STRUCTURE_TYPES:
+                return b"null"
+            num = self._map[ref.N] = self._allocate()
+            pending.append(ref)
+        return b"%d 0 R" % num
+
+    def _serialize(self, obj: PDFObject | list | dict | bytes, parts: List[bytes], pending: List[IndRef]) -> None:
+        # like to_bytes(), with references renumbered on the way; bytes are already serialized
+        if isinstance(obj, bytes):
+            parts.append(obj)
+        elif isinstance(obj, IndRef):
+            parts.append(self._ref(obj, pending))
+        elif isinstance(obj, (PDFDict, dict)):
+            items = obj.value if isinstance(obj, PDFDict) else obj
+            parts.append(b"<<\n")
+            for i, (k, v) in enumerate(items.items()):
+                if i:
+                    parts.append(b"\n")
+                parts.append(PDFName(self._source, k).to_bytes() + b" ")
+                self._serialize(v, parts, pending)
+            parts.append(b">>")
+        elif isinstance(obj, (PDFArray, list)):
+            parts.append(b"[ ")
+            for i, v in enumerate(obj.value if isinstance(obj, PDFArray) else obj):
+                if i:
+                    parts.append(b" ")
+                self._serialize(v, parts, pending)
+            parts.append(b" ]")
+        elif isinstance(obj, PDFStream):
+            items, value = self._stream_body(obj)
+            self._serialize(items, parts, pending)
+            parts.append(b"\nstream\n")
+            parts.append(value)
+            parts.append(b"\nendstream")
+        else:
+            parts.append(obj.to_bytes())
+
+    def _stream_body(self, stream: PDFStream) -> Tuple[Dict[bytes, PDFObject | list], bytes]:
+        # the data is copied as it is stored, only an encrypted source has it decrypted (not decoded)
+        items: Dict[bytes, PDFObject | list] = dict(stream.extent.value)
+        value = stream.value
+        if stream._crypt is not None:
+            name, chain = Stream.split_crypt(Stream(stream).filter_chain())
+            value = self._source.security.decrypt_stream(value, stream._crypt, name)
+            if name is not None:
+                for key in (b"Filter", b"DecodeParms"):
+                    entry = items.get(key)
+                    if entry is not None and isinstance(entry.resolve(), PDFArray):
+                        items[key] = entry.resolve().value[1:]
+                    else:
+                        items.pop(key, None)
+        items[b"Length"] = PDFInt(self._source, len(value))
+        return items, value
+
+    def _leaf(self) -> int:
+        if not self.leaf_kids or len(self.leaf_kids[-1]) == PAGE_TREE_FANOUT:
+            self.leaves.append(self._allocate())
+            self.leaf_kids.append([])
+        return self.leaves[-1]
+
+    def append(self, source: PDFFile | str, pages: Optional[Iterable[int]] = None,
+               password: bytes | str = b"") -> List[int]:
+        # pages are indices into source.pages, all of them by default; returns the new object numbers
+        owned = isinstance(source, str)
+        if owned:
+            from .file import PDFFile
+            source = PDFFile(source, password=password)
+        tree = source.pages
+        indices = list(range(len(tree))) if pages is None else list(pages)
+        selected = [tree[i] for i in indices]
+        self._source = source
+        self._map = dict()
+        first = len(self.pages)
+        try:
+            # every selected page gets its number first, so that links between them survive; a page selected
+            # again is written as a copy, links and the objects it uses go to the first one
+            nums = []
+            for page in selected:
+                num = self._allocate()
+                if page.ref is not None and page.ref.N not in self._map:
+                    self._map[page.ref.N] = num
+                nums.append(num)
+            for page, num in zip(selected, nums):
+                self.pages.append(num)
+                self._copy_page(page, num)
+        except BaseException:
+            # what was written stays in the output unreferenced, the pages of this source are taken out of the tree
+            dropped = set(self.pages[first:])
+            del self.pages[first:]
+            self.leaf_kids = [[kid for kid in kids if kid not in dropped] for kids in self.leaf_kids]
+            raise
+        finally:
+            self._source = None
+            self._map = dict()
+            if owned:
+                # objects point back at their file, without a collection the cycles of every source opened
+                # so far would pile up in the older generations
+                del source, tree, selected
+                gc.collect()
+        return nums
+
+    def _copy_page(self, page: Page, num: int) -> None:
+        items: Dict[bytes, PDFObject | bytes] = {k: v for k, v in page.obj.value.items() if k != b"Parent"}
+        for key in INHERITABLE_KEYS:
+            if key not in items:
+                value = page.get_inherited(key)
+                if value is not PDFNull(self._source):
+                    items[key] = value
+        items[b"Parent"] = b"%d 0 R" % self._leaf()
+        self.leaf_kids[-1].append(num)
+        pending: List[IndRef] = []
+        parts: List[bytes] = []
+        self._serialize(items, parts, pending)
+        self._write_object(num, parts)
+        # then the closure of the page, depth first in the order it is discovered
+        while pending:
+            ref = pending.pop()
+            parts = []
+            self._serialize(self._source.resolve(ref), parts, pending)
+            self._write_object(self._map[ref.N], parts)
+
+    def _write_tree(self) -> int:
+        # leaves were numbered while the pages were written, the levels above them are built now
+        level = list(zip(self.leaves, self.leaf_kids))
+        counts = {num: len(kids) for num, kids in level}
+        while len(level) > 1:
+            parents = []
+            for i in range(0, len(level), PAGE_TREE_FANOUT):
+                group = level[i:i + PAGE_TREE_FANOUT]
+                parent = self._allocate()
+                counts[parent] = sum(counts[num] for num, _ in group)
+                for num, kids in group:
+                    self._write_node(num, kids, counts[num], parent)
+                parents.append((parent, [num for num, _ in group]))
+            level = parents
+        if not level:
+            level = [(self._allocate(), [])]
+            counts[level[0][0]] = 0
+        root, kids = level[0]
+        self._write_node(root, kids, counts[root], None)
+        return root
+
+    def _write_node(self, num: int, kids: List[int], count: int, parent: Optional[int]) -> None:
+        head = b"<<\n/Type /Pages\n/Kids [ " + b" ".join(b"%d 0 R" % kid for kid in kids) + b" ]\n/Count %d" % count
+        self._write_object(num, [head + (b"\n/Parent %d 0 R" % parent if parent is not None else b"") + b">>"])
+
+    def close(self) -> None:
+        root = self._write_tree()
+        catalog = self._allocate()
+        self._write_object(catalog, [b"<<\n/Type /Catalog\n/Pages %d 0 R>>" % root])
+        xref = self._pos
+        size = len(self.offsets)
+        table = io.BytesIO()
+        table.write(b"xref\n0 %d\n" % size)
+        table.write(b"%010d 65535 f\r\n" % 0)
+        for num in range(1, size):
+            # numbers given out by an append that failed were never written
+            offset = self.offsets[num]
+            table.write(b"%010d 00000 n\r\n" % offset if offset else b"0000000000 00001 f\r\n")
+        table.write(b"trailer\n<<\n/Size %d\n/Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (size, catalog, xref))
+        self._write(table.getvalue())
+        if self._owned:
+            self.output.close()
+
+    @staticmethod
+    def merge(output: str | BinaryIO, sources: Iterable[PDFFile | str | Tuple[PDFFile | str, Sequence[int]]],
+              password: bytes | str = b"") -> None:
+        # sources are documents or (document, page indices) pairs
+        with Merger(output) as merger:
+            for source in sources:
+                if isinstance(source, tuple):
+                    merger.append(source[0], source[1], password)
+                else:
+                    merger.append(source, None, password)
+
+    @staticmethod
+    def split(source: PDFFile | str, groups: Iterable[Sequence[int]], outputs: Iterable[str | BinaryIO],
+              password: bytes | str = b"") -> None:
+        # one output per group of page indices, the source is opened once
+        if isinstance(source, str):
+            from .file import PDFFile
+            source = PDFFile(source, password=password)
+        for pages, output in zip(groups, outputs):
+            with Merger(output) as merger:
+                merger.append(source, pages)
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import Protocol, TypeVar, TYPE_CHECKING, ClassVar, Generic
 from typing import List, Dict, Optional, Tuple, Set, Any, Union, Type
-from dataclasses import dataclass
 from abc import ABC, abstractmethod
 from ._utils import Singleton
 from ._utils import delimiter_chars, whitespace_chars, two_digit_hex_code
@@ -13,15 +12,40 @@ if TYPE_CHECKING:
 
 class PDFObject(ABC):
     _ref: Optional[IndRef] = None
+    _parent: Optional[PDFObject] = None
     _file: PDFFile
     value: Any
 
     def __init__(self, file: PDFFile):
         self._file = file
 
+    def _owner(self) -> PDFObject:
+        owner = self
+        while owner._ref is None and owner._parent is not None:
+            owner = owner._parent
+        return owner
+
+    def check_writable(self):
+        # called before a change is made, the file refuses it for an object it shares with snapshots
+        owner = self._owner()
+        if owner._ref:
+            self._file.check_writable(owner._ref)
+
     def mark_modified(self):
-        if self._ref:
-            self._file.mark_updated(self._ref, self)
+        # direct objects report the change to the indirect object that owns them
+        owner = self._owner()
+        if owner._ref:
+            self._file.mark_dirty(owner._ref, owner)
+
+    def _adopt(self, child: PDFObject) -> PDFObject:
+        if isinstance(child, (PDFNull, IndRef)):
+            return child
+        if isinstance(child, (PDFDict, PDFArray)) and child._ref is None \
+                and child._parent is not None and child._parent is not self:
+            # a direct container has one parent to report its changes to, one that already has another is copied
+            child = child.__class__(child._file, child.value.copy())
+        child._parent = self
+        return child
 
     def resolve(self) -> PDFObject:
         return self
@@ -34,6 +58,17 @@ class PDFObject(ABC):
         return self.value
 
 
+class _ValueObject:
+    # the repr and equality @dataclass generated, without importing dataclasses (and inspect) at startup
+    def __repr__(self):
+        return f"{self.__class__.__name__}(value={self.value!r})"
+
+    def __eq__(self, other):
+        if other.__class__ is self.__class__:
+            return self.value == other.value
+        return NotImplemented
+
+
 class PDFNull(Singleton, PDFObject):
     value = None
 
@@ -44,8 +79,7 @@ class PDFNull(Singleton, PDFObject):
         return b'null'
 
 
-@dataclass
-class PDFBool(PDFObject):
+class PDFBool(_ValueObject, PDFObject):
     value: bool
 
     def __init__(self, file: PDFFile, value: bool):
@@ -56,8 +90,7 @@ class PDFBool(PDFObject):
         return b'true' if self.value else b'false'
 
 
-@dataclass
-class PDFInt(PDFObject):
+class PDFInt(_ValueObject, PDFObject):
     value: int
 
     def __init__(self, file: PDFFile, value: int):
@@ -68,8 +101,7 @@ class PDFInt(PDFObject):
         return str(self.value).encode('ascii')
 
 
-@dataclass
-class PDFFloat(PDFObject):
+class PDFFloat(_ValueObject, PDFObject):
     value: float
 
     def __init__(self, file: PDFFile, value: float):
@@ -112,8 +144,7 @@ class PDFString(PDFObject):
                 .replace(b'\f', b'\\f')) + b")"
 
 
-@dataclass
-class PDFName(PDFObject):
+class PDFName(_ValueObject, PDFObject):
     value: bytes
 
     def __init__(self, file: PDFFile, value: bytes):
@@ -146,9 +177,24 @@ class PDFArray(PDFObject):
         if value is None:
             value = []
         self.value = value
+        for i, v in enumerate(value):
+            value[i] = self._adopt(v)
+
+    def __getitem__(self, index: int) -> PDFObject:
+        return self.value[index]
+
+    def __setitem__(self, index: int, value: PDFObject) -> None:
+        self.check_writable()
+        self.value[index] = self._adopt(value)
+        self.mark_modified()
+
+    def __len__(self) -> int:
+        return len(self.value)
 
     def append(self, value: PDFObject) -> None:
-        self.value.append(value)
+        self.check_writable()
+        self.value.append(self._adopt(value))
+        self.mark_modified()
 
     def to_bytes(self) -> bytes:
         return b"[ " + b" ".join(map(lambda obj: obj.to_bytes(), self.value)) + b" ]"
@@ -165,6 +211,8 @@ class PDFDict(PDFObject):
         if value is None:
             value = {}
         self.value = value
+        for k, v in value.items():
+            value[k] = self._adopt(v)
 
     def __getitem__(self, key: PDFName | bytes) -> PDFObject:
         return self.value[key]
@@ -172,11 +220,14 @@ class PDFDict(PDFObject):
     def __setitem__(self, key: PDFName | bytes, value: PDFObject) -> None:
         if key in self.value and self.value[key] == value:
             return
-        self.value[key] = value
+        self.check_writable()
+        self.value[key] = self._adopt(value)
         self.mark_modified()
 
     def __delitem__(self, key: PDFName | bytes) -> None:
+        self.check_writable()
         del self.value[key]
+        self.mark_modified()
 
     def __contains__(self, key: PDFName | bytes) -> bool:
         return key in self.value
@@ -211,17 +262,17 @@ class PDFDict(PDFObject):
 class PDFStream(PDFObject):
     value: bytes
     extent: PDFDict
+    _crypt: Optional[IndRef] = None  # value is still encrypted with the key of this object
 
     def __init__(self, file: PDFFile, value: bytes, extent: PDFDict):
         super().__init__(file)
         self.value = value
-        self.extent = extent
+        self.extent = self._adopt(extent)
 
     def to_bytes(self) -> bytes:
         return self.extent.to_bytes() + b"\nstream\n" + self.value + b"\nendstream"
 
 
-@dataclass
 class IndRef(PDFObject):
     N: int
     G: int
@@ -239,9 +290,10 @@ class IndRef(PDFObject):
         return self.resolve().to_python()
 
     def resolve(self) -> PDFObject:
-        obj = self._file.resolve(self)
-        obj._ref = self
-        return obj
+        return self._file.resolve(self)
+
+    def __repr__(self):
+        return f"IndRef(N={self.N!r}, G={self.G!r})"
 
     def __gt__(self, other):
         return self.N > other.N or (self.N == other.N and self.G > other.G)
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .objects import *
+from .filters import FilterRegistry, ZlibBackend
+from .graph import ObjectGraph
+from .stream import Stream, Filter
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+
+HASH_CHUNK_SIZE = 1 << 20
+UNMERGEABLE_TYPES = {b"Catalog", b"Pages", b"Page", b"Annot", b"XRef", b"ObjStm"}
+# every annotation has them, its /Type is optional
+ANNOTATION_KEYS = (b"Subtype", b"Rect")
+# streams the writer and the reader own the encoding of
+UNRECOMPRESSED_TYPES = {b"XRef", b"ObjStm"}
+# image codecs, their data is not decoded by the library and would not shrink anyway
+IMAGE_FILTERS = {b"DCTDecode", b"JPXDecode", b"JBIG2Decode", b"CCITTFaxDecode"}
+# what a stream without a filter gains in its dictionary
+FLATE_ENTRY = len(b"\n/Filter /FlateDecode")
+
+
+@dataclass
+class DedupResult:
+    merged: Dict[IndRef, IndRef] = field(default_factory=dict)
+    bytes_saved: int = 0
+
+
+@dataclass
+class StreamSaving:
+    ref: IndRef
+    filters: List[bytes]
+    before: int
+    after: int
+
+
+@dataclass
+class RecompressResult:
+    streams: List[StreamSaving] = field(default_factory=list)
+    skipped: Dict[str, int] = field(default_factory=dict)
+    bytes_saved: int = 0
+    seconds: float = 0.0
+    backend: str = ""
+    level: int = -1
+
+
+class Optimizer:
+    @staticmethod
+    def canonical(obj: PDFObject, survivor: Callable[[IndRef], IndRef]) -> bytes:
+        # serialization independent of dict key order and of merged references
+        if isinstance(obj, IndRef):
+            return survivor(obj).to_bytes()
+        if isinstance(obj, PDFDict):
+            items = sorted(obj.value.items(), key=lambda kv: kv[0])
+            return b"<<" + b"".join(
+                PDFName(obj._file, k).to_bytes() + b" " + Optimizer.canonical(v, survivor) for k, v in items
+            ) + b">>"
+        if isinstance(obj, PDFArray):
+            return b"[" + b" ".join(Optimizer.canonical(v, survivor) for v in obj.value) + b"]"
+        if isinstance(obj, PDFString):
+            return b"<" + obj.value.hex().encode('ascii') + b">"
+        return obj.to_bytes()
+
+    @staticmethod
+    def stream_digest(stream: PDFStream) -> bytes:
+        h = hashlib.sha256()
+        view = memoryview(stream.value)
+        for i in range(0, len(view), HASH_CHUNK_SIZE):
+            h.update(view[i:i + HASH_CHUNK_SIZE])
+        return h.digest()
+
+    @staticmethod
+    def serialized_size(ref: IndRef, obj: PDFObject) -> int:
+        head = len(f"{ref.N} {ref.G} obj\n".encode('ascii')) + len(b"\nendobj\n") + 20  # 20 for the xref entry
+        if isinstance(obj, PDFStream):
+            return head + len(obj.extent.to_bytes()) + len(b"\nstream\n\nendstream") + len(obj.value)
+        return head + len(obj.to_bytes())
+
+    @staticmethod
+    def _mergeable(obj: PDFObject) -> bool:
+        extent = obj.extent if isinstance(obj, PDFStream) else obj
+        kind = extent.value.get(b"Type")
+        if isinstance(kind, PDFName) and kind.value in UNMERGEABLE_TYPES:
+            return False
+        # an annotation belongs to one page, two identical ones still have to stay apart
+        return not (isinstance(obj, PDFDict) and all(key in extent.value for key in ANNOTATION_KEYS))
+
+    @staticmethod
+    def _key(ref: IndRef, obj: PDFObject, survivor: Callable[[IndRef], IndRef], min_dict_size: int,
+             value_digests: Dict[IndRef, bytes]) -> Optional[bytes]:
+        # equal objects have equal keys; the value of a stream is hashed once, on later passes only its
+        # dictionary is serialized again. None for objects that are not compared
+        if isinstance(obj, PDFStream):
+            digest = value_digests.get(ref)
+            if digest is None:
+                return None
+            extent = Optimizer.canonical(obj.extent, survivor)
+            return b"s" + hashlib.sha256(extent + digest).digest()
+        canon = Optimizer.canonical(obj, survivor)
+        if len(canon) < min_dict_size:
+            return None
+        return b"d" + hashlib.sha256(canon).digest()
+
+    @staticmethod
+    def deduplicate(file: PDFFile, min_dict_size: int = 128) -> DedupResult:
+        result = DedupResult()
+        objs = {}
+        for num in sorted(file.xref.table):
+            src = file.xref.table[num]
+            obj = src.read()
+            if obj is PDFNull(file) or not isinstance(obj, (PDFDict, PDFStream)):
+                continue
+            if Optimizer._mergeable(obj):
+                objs[src.ref] = obj
+
+        merged = result.merged
+
+        def survivor(ref: IndRef) -> IndRef:
+            while ref in merged:
+                ref = merged[ref]
+            return ref
+
+        # only streams sharing a length can be equal, everything else is never hashed
+        by_length: Dict[int, List[IndRef]] = defaultdict(list)
+        parents: Dict[IndRef, Set[IndRef]] = defaultdict(set)
+        for ref, obj in objs.items():
+            if isinstance(obj, PDFStream):
+                by_length[len(obj.value)].append(ref)
+            for child in ObjectGraph.iter_refs(obj):
+                parents[child].add(ref)
+        value_digests = {ref: Optimizer.stream_digest(objs[ref])
+                         for refs in by_length.values() if len(refs) > 1 for ref in refs}
+
+        keys: Dict[IndRef, bytes] = {}
+        groups: Dict[bytes, Set[IndRef]] = defaultdict(set)
+        pending = set(objs)
+        # merging children can make their parents equal, so the parents of what a pass merged are
+        # looked at again until nothing more merges
+        while pending:
+            touched = set()
+            for ref in pending:
+                old = keys.pop(ref, None)
+                if old is not None:
+                    groups[old].discard(ref)
+                key = Optimizer._key(ref, objs[ref], survivor, min_dict_size, value_digests)
+                if key is not None:
+                    keys[ref] = key
+                    groups[key].add(ref)
+                    touched.add(key)
+            pending = set()
+            for key in touched:
+                refs = sorted(groups[key])
+                if len(refs) < 2:
+                    continue
+                keep = refs[0]
+                for dup in refs[1:]:
+                    result.bytes_saved += Optimizer.serialized_size(dup, objs.pop(dup))
+                    merged[dup] = keep
+                    del keys[dup]
+                    pending |= parents[dup]
+                    parents[keep] |= parents.pop(dup)
+                groups[key] = {keep}
+            pending.intersection_update(objs)
+
+        if not merged:
+            return result
+        for dup in list(merged):
+            merged[dup] = survivor(dup)
+
+        for num in list(file.xref.table):
+            src = file.xref.table[num]
+            if src.ref in merged:
+                file.free(src.ref)
+                continue
+            obj = src.read()
+            if obj is not PDFNull(file) and ObjectGraph.remap(obj, merged, keep_missing=True):
+                file.mark_updated(src.ref, obj)
+        ObjectGraph.remap(file.trailer.extent, merged, keep_missing=True)
+        return result
+
+    @staticmethod
+    def _recompress_skip(obj: PDFStream, chain: List[Tuple[bytes, dict]], flate: bool) -> Optional[str]:
+        # the reason a stream is left alone, None when it is a candidate
+        kind = obj.extent.value.get(b"Type")
+        if isinstance(kind, PDFName) and kind.value in UNRECOMPRESSED_TYPES:
+            return "structure"
+        if not len(obj.value):
+            return "empty"
+        names = [name for name, _ in chain]
+        if IMAGE_FILTERS.intersection(names):
+            return "image codec"
+        if b"Crypt" in names:
+            return "crypt filter"
+        if any(params.get("predictor", 1) != 1 for _, params in chain):
+            # the predictor is what makes these small, Flate alone would undo it
+            return "predictor"
+        if names == [b"FlateDecode"] and not flate:
+            return "flate"
+        return None
+
+    @staticmethod
+    def _recompress_one(stream: PDFStream, chain: List[Tuple[bytes, dict]], level: int,
+                        min_saving: float) -> Tuple[int, Optional[bytes]]:
+        # runs in a worker thread; the size compared is that of the stored data once decrypted, the
+        # encryption overhead is the same before and after. None when the saving is below min_saving
+        data = stream.value
+        if stream._crypt is not None:
+            data = stream._file.security.decrypt_stream(data, stream._crypt)
+        before = len(data)
+        try:
+            for name, params in chain:
+                data = Filter.decode(data, name, **params)
+        except Exception:
+            return before, None
+        ret = Filter.encode(data, b"FlateDecode", level=level)
+        limit = before * (1 - min_saving) - (0 if chain else FLATE_ENTRY)
+        return before, ret if len(ret) < limit else None
+
+    @staticmethod
+    def recompress(file: PDFFile, level: int = 9, workers: Optional[int] = None, flate: bool = False,
+                   min_saving: float = 0.01) -> RecompressResult:
+        # re-encodes streams to Flate, a result is kept when it saves at least min_saving of the stored
+        # size; Flate streams are only tried with flate=True, they are usually close to what a higher
+        # level would give
+        from concurrent.futures import ThreadPoolExecutor
+        start = time.perf_counter()
+        result = RecompressResult()
+        backend = FilterRegistry.select_encoder(b"FlateDecode", level=level)
+        result.backend = backend.name
+        result.level = min(level, backend.max_level) if isinstance(backend, ZlibBackend) else level
+        file.flush()
+        jobs = []
+        for num in sorted(file.xref.table):
+            src = file.xref.table[num]
+            obj = src.read()
+            if not isinstance(obj, PDFStream):
+                continue
+            try:
+                chain = Stream(obj).filter_chain()
+            except Exception:
+                chain = None
+            reason = "bad filter" if chain is None else Optimizer._recompress_skip(obj, chain, flate)
+            if reason is not None:
+                result.skipped[reason] = result.skipped.get(reason, 0) + 1
+                continue
+            jobs.append((src.ref, obj, chain))
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        # zlib releases the GIL while it compresses, the pure Python decoders do not
+        with ThreadPoolExecutor(max(1, workers)) as executor:
+            encoded = executor.map(lambda job: Optimizer._recompress_one(job[1], job[2], level, min_saving), jobs)
+            with file.edit():
+                for (ref, obj, chain), (before, value) in zip(jobs, encoded):
+                    if value is None:
+                        result.skipped["no gain"] = result.skipped.get("no gain", 0) + 1
+                        continue
+                    stream = Stream(obj)
+                    stream.value = value
+                    stream.Filter = PDFName(file, b"FlateDecode")
+                    if b"DecodeParms" in stream.extent:
+                        del stream.extent[b"DecodeParms"]
+                    result.streams.append(StreamSaving(ref, [name for name, _ in chain], before, len(value)))
+                    result.bytes_saved += before - len(value)
+        result.seconds = time.perf_counter() - start
+        return result
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Iterator, Sequence, overload
+
+from .objects import *
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+
+INHERITABLE_KEYS = (b"Resources", b"MediaBox", b"CropBox", b"Rotate")
+MAX_TREE_DEPTH = 256
+
+
+class Page:
+    ref: Optional[IndRef]
+    obj: PDFDict
+    parents: Tuple[PDFDict, ...]
+
+    def __init__(self, obj: PDFDict, parents: Tuple[PDFDict, ...]):
+        self.ref = obj._ref
+        self.obj = obj
+        self.parents = parents  # nearest ancestor first, shared with the tree cache
+
+    def __repr__(self):
+        return f"Page({self.ref})"
+
+    def get_inherited(self, key: bytes) -> PDFObject:
+        if key in self.obj:
+            return self.obj.get(key)
+        if key in INHERITABLE_KEYS:
+            for node in self.parents:
+                if key in node:
+                    return node.get(key)
+        return PDFNull(self.obj._file)
+
+    @property
+    def Resources(self) -> Nullable[PDFDict]:
+        return self.get_inherited(b"Resources")
+
+    @property
+    def MediaBox(self) -> Nullable[PDFArray]:
+        return self.get_inherited(b"MediaBox")
+
+    @property
+    def CropBox(self) -> Nullable[PDFArray]:
+        crop = self.get_inherited(b"CropBox")
+        if crop is PDFNull(self.obj._file):
+            return self.MediaBox
+        return crop
+
+    @property
+    def Rotate(self) -> int:
+        rotate = self.get_inherited(b"Rotate")
+        return 0 if rotate is PDFNull(self.obj._file) else rotate.to_python()
+
+    @property
+    def Contents(self) -> Nullable[PDFStream | PDFArray]:
+        return self.obj.get(b"Contents")
+
+
+class _Node:
+    obj: PDFDict
+    kids: List[PDFObject]
+    offsets: List[int]
+    count: int
+
+    def __init__(self, obj: PDFDict, kids: List[PDFObject], offsets: List[int], count: int):
+        self.obj = obj
+        self.kids = kids
+        self.offsets = offsets  # offsets[i] is the index of the first page below kids[i]
+        self.count = count
+
+
+class PageTree(Sequence):
+    file: PDFFile
+    page_nums: Optional[Sequence[int]]
+    _nodes: Dict[Any, _Node]
+    _chains: Dict[Any, Tuple[PDFDict, ...]]
+    _root: Optional[PDFDict] = None
+
+    def __init__(self, file: PDFFile, page_nums: Optional[Sequence[int]] = None):
+        self.file = file
+        self.page_nums = page_nums  # object numbers in page order, from a sidecar index
+        self._nodes = dict()
+        self._chains = dict()
+
+    @staticmethod
+    def _key(obj: PDFDict) -> Any:
+        return obj._ref if obj._ref is not None else id(obj)
+
+    @staticmethod
+    def _is_leaf(obj: PDFDict) -> bool:
+        kind = obj.get(b"Type")
+        if kind is not PDFNull(obj._file):
+            return kind.value == b"Page"
+        return b"Kids" not in obj
+
+    def is_node(self, ref: IndRef) -> bool:
+        return ref in self._nodes or ref in self._chains
+
+    def invalidate(self) -> None:
+        # the page order recorded in an index no longer holds after a structural edit
+        self.page_nums = None
+        self._nodes = dict()
+        self._chains = dict()
+        self._root = None
+
+    @property
+    def root(self) -> PDFDict:
+        if self._root is None:
+            self._root = self.file.trailer.Root.get_expected(b"Pages", PDFDict)
+        return self._root
+
+    def _node(self, obj: PDFDict) -> _Node:
+        key = self._key(obj)
+        node = self._nodes.get(key)
+        if node is None:
+            kids = obj.get(b"Kids")
+            kids = kids.value if isinstance(kids, PDFArray) else []
+            offsets = []
+            total = 0
+            for kid in kids:
+                offsets.append(total)
+                total += self._count(kid.resolve())
+            node = _Node(obj, kids, offsets, total)
+            self._nodes[key] = node
+        return node
+
+    def _count(self, obj: PDFObject) -> int:
+        if not isinstance(obj, PDFDict):
+            return 0
+        if self._is_leaf(obj):
+            return 1
+        count = obj.get(b"Count")
+        if isinstance(count, PDFInt):
+            return count.value
+        return self._node(obj).count
+
+    def __len__(self) -> int:
+        if self.page_nums is not None:
+            return len(self.page_nums)
+        return self._count(self.root)
+
+    def _chain(self, obj: PDFDict) -> Tuple[PDFDict, ...]:
+        # ancestors of an intermediate node through /Parent, nearest first
+        path = []
+        chain: Tuple[PDFDict, ...] = ()
+        while isinstance(obj, PDFDict) and len(path) < MAX_TREE_DEPTH:
+            cached = self._chains.get(self._key(obj))
+            if cached is not None:
+                chain = cached
+                break
+            path.append(obj)
+            obj = obj.get(b"Parent")
+        for node in reversed(path):
+            chain = (node,) + chain
+            self._chains[self._key(node)] = chain
+        return chain
+
+    def _locate_indexed(self, index: int) -> Page:
+        num = self.page_nums[index]
+        src = self.file.xref.table.get(num)
+        obj = self.file.resolve(src.ref) if src is not None else None
+        if not isinstance(obj, PDFDict):
+            raise IndexError("page index out of range or stale page index")
+        chain = self._chain(obj.get(b"Parent"))
+        if not chain or chain[-1] is not self.root:
+            # /Parent links that do not lead to the root, fall back to the descent
+            return self._descend(index)
+        return Page(obj, chain)
+
+    def _locate(self, index: int) -> Page:
+        if self.page_nums is not None:
+            return self._locate_indexed(index)
+        return self._descend(index)
+
+    def _descend(self, index: int) -> Page:
+        obj = self.root
+        parents: Tuple[PDFDict, ...] = ()
+        for _ in range(MAX_TREE_DEPTH):
+            node = self._node(obj)
+            # bisect_right also steps over empty subtrees sharing an offset with the next kid
+            i = bisect_right(node.offsets, index) - 1
+            if i < 0:
+                break
+            index -= node.offsets[i]
+            parents = (obj,) + parents
+            obj = node.kids[i].resolve()
+            if not isinstance(obj, PDFDict):
+                break
+            if self._is_leaf(obj):
+                if index != 0:
+                    break
+                return Page(obj, parents)
+        raise IndexError("page index out of range or broken page tree")
+
+    @overload
+    def __getitem__(self, index: int) -> Page: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Page]: ...
+
+    def __getitem__(self, index):
+        n = len(self)
+        if isinstance(index, slice):
+            indices = range(*index.indices(n))
+            if indices.step == 1 and len(indices) > 0:
+                return list(self._iter_from(indices.start, len(indices)))
+            return [self._locate(i) for i in indices]
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("page index out of range")
+        return self._locate(index)
+
+    def __iter__(self) -> Iterator[Page]:
+        return self._iter_from(0, len(self))
+
+    def _iter_from(self, start: int, length: int) -> Iterator[Page]:
+        # one descent to the first page, then an in-order walk of the remaining leaves
+        if length <= 0:
+            return
+        if self.page_nums is not None:
+            for i in range(start, start + length):
+                yield self._locate_indexed(i)
+            return
+        first = self._locate(start)
+        yield first
+        length -= 1
+
+        stack = []
+        child = first.obj
+        for depth, parent in enumerate(first.parents):
+            node = self._node(parent)
+            pos = next(i for i, kid in enumerate(node.kids) if kid.resolve() is child)
+            stack.append((node, pos + 1, first.parents[depth:]))
+            child = parent
+        stack.reverse()
+
+        while stack and length > 0:
+            node, pos, parents = stack.pop()
+            if pos >= len(node.kids):
+                continue
+            stack.append((node, pos + 1, parents))
+            obj = node.kids[pos].resolve()
+            if not isinstance(obj, PDFDict):
+                continue
+            if self._is_leaf(obj):
+                yield Page(obj, parents)
+                length -= 1
+            elif len(stack) < MAX_TREE_DEPTH:
+                stack.append((self._node(obj), 0, (obj,) + parents))
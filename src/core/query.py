@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import os
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Set
+
+from .objects import *
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+# kinds of indexed objects
+STREAM, DICT, OTHER = 0, 1, 2
+# below this many objects the pass stays in this process, starting workers costs more than it saves
+PARALLEL_MIN_OBJECTS = 50_000
+PART_SIZE = 10_000
+
+# kind, /Type, /Subtype, length of the stored stream data (-1 for anything but a stream)
+Entry = Tuple[int, Optional[bytes], Optional[bytes], int]
+
+
+class ObjectIndex:
+    # object numbers by /Type, /Subtype, kind and stream size, kept up to date by mark_updated and add_new_refs
+    file: PDFFile
+    entries: Dict[int, Entry]
+    by_type: Dict[bytes, Set[int]]
+    by_subtype: Dict[bytes, Set[int]]
+    streams: Set[int]
+    _sizes: Optional[List[Tuple[int, int]]] = None
+
+    def __init__(self, file: PDFFile):
+        self.file = file
+        self.entries = dict()
+        self.by_type = dict()
+        self.by_subtype = dict()
+        self.streams = set()
+
+    @staticmethod
+    def describe(obj: PDFObject) -> Entry:
+        if isinstance(obj, PDFStream):
+            kind, extent, size = STREAM, obj.extent, len(obj.value)
+        elif isinstance(obj, PDFDict):
+            kind, extent, size = DICT, obj, -1
+        else:
+            return OTHER, None, None, -1
+        t = extent.value.get(b"Type")
+        subtype = extent.value.get(b"Subtype")
+        return (kind, t.value if isinstance(t, PDFName) else None,
+                subtype.value if isinstance(subtype, PDFName) else None, size)
+
+    @staticmethod
+    def describe_nums(file: PDFFile, nums: Iterable[int]) -> List[Tuple[int, Entry]]:
+        # objects that are not loaded yet are parsed and dropped again, members of an object stream
+        # come from the decoded container the file caches
+        ret = []
+        table = file.xref.table
+        for num in nums:
+            src = table.get(num)
+            if src is None:
+                continue
+            obj = src.parse()
+            if obj is None or obj is PDFNull(file):
+                continue
+            ret.append((num, ObjectIndex.describe(obj)))
+        return ret
+
+    @staticmethod
+    def build(file: PDFFile, workers: Optional[int] = None) -> ObjectIndex:
+        # one pass over the xref; an unmodified document read from disk is split between worker processes
+        index = ObjectIndex(file)
+        nums = sorted(file.xref.table)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(nums) >= PARALLEL_MIN_OBJECTS and ObjectIndex._can_fork(file):
+            described = ObjectIndex._describe_parallel(file, nums, workers)
+        else:
+            described = ObjectIndex.describe_nums(file, nums)
+        for num, entry in described:
+            index._add(num, entry)
+        return index
+
+    @staticmethod
+    def _can_fork(file: PDFFile) -> bool:
+        # workers open the file themselves, what they read has to be what this process sees
+        return isinstance(file.doc, memoryview) and os.path.isfile(file.filename) \
+            and not file.updated_ref and not file.dirty and len(file.doc) == os.path.getsize(file.filename)
+
+    @staticmethod
+    def _describe_parallel(file: PDFFile, nums: List[int], workers: int) -> List[Tuple[int, Entry]]:
+        from concurrent.futures import ProcessPoolExecutor
+        # parts of consecutive numbers, members of one object stream mostly end up in the same part
+        parts = [nums[i:i + PART_SIZE] for i in range(0, len(nums), PART_SIZE)]
+        index = file.sidecar.path if file.sidecar is not None else False
+        ret = []
+        with ProcessPoolExecutor(workers, initializer=_open_worker,
+                                 initargs=(file.filename, file.password, index)) as executor:
+            for described in executor.map(_describe_part, parts):
+                ret.extend(described)
+        return ret
+
+    def _add(self, num: int, entry: Entry) -> None:
+        self.entries[num] = entry
+        kind, t, subtype, size = entry
+        if t is not None:
+            self.by_type.setdefault(t, set()).add(num)
+        if subtype is not None:
+            self.by_subtype.setdefault(subtype, set()).add(num)
+        if kind == STREAM:
+            self.streams.add(num)
+            self._sizes = None
+
+    def _remove(self, num: int) -> None:
+        entry = self.entries.pop(num, None)
+        if entry is None:
+            return
+        kind, t, subtype, size = entry
+        if t is not None:
+            self.by_type[t].discard(num)
+        if subtype is not None:
+            self.by_subtype[subtype].discard(num)
+        if kind == STREAM:
+            self.streams.discard(num)
+            self._sizes = None
+
+    def update(self, num: int, obj: PDFObject) -> None:
+        self._remove(num)
+        if obj is not None and obj is not PDFNull(self.file):
+            self._add(num, ObjectIndex.describe(obj))
+
+    def renumber(self, mapping: Dict[int, int]) -> None:
+        # numbers missing from the mapping were dropped
+        entries = self.entries
+        self.entries, self.by_type, self.by_subtype, self.streams = dict(), dict(), dict(), set()
+        self._sizes = None
+        for num, entry in entries.items():
+            if num in mapping:
+                self._add(mapping[num], entry)
+
+    def _by_size(self, min_size: Optional[int], max_size: Optional[int]) -> Set[int]:
+        if self._sizes is None:
+            self._sizes = sorted((self.entries[num][3], num) for num in self.streams)
+        lo = 0 if min_size is None else bisect_left(self._sizes, (min_size, -1))
+        hi = len(self._sizes) if max_size is None else bisect_right(self._sizes, (max_size, 1 << 62))
+        return {num for _, num in self._sizes[lo:hi]}
+
+    def find(self, type: Optional[bytes] = None, subtype: Optional[bytes] = None, stream: Optional[bool] = None,
+             min_size: Optional[int] = None, max_size: Optional[int] = None) -> List[IndRef]:
+        # a size bound implies stream=True; the result is in object number order
+        candidates: List[Set[int]] = []
+        if type is not None:
+            candidates.append(self.by_type.get(type, set()))
+        if subtype is not None:
+            candidates.append(self.by_subtype.get(subtype, set()))
+        if min_size is not None or max_size is not None:
+            candidates.append(self._by_size(min_size, max_size))
+        elif stream:
+            candidates.append(self.streams)
+        if candidates:
+            candidates.sort(key=len)
+            nums = set(candidates[0]).intersection(*candidates[1:])
+        else:
+            nums = set(self.entries)
+        if stream is False:
+            nums -= self.streams
+
+        table = self.file.xref.table
+        ret = []
+        for num in sorted(nums):
+            # entries freed since are skipped, a reused number has been updated through mark_updated
+            src = table.get(num)
+            if src is not None and not self.file.xref.is_free(num):
+                ret.append(src.ref)
+        return ret
+
+
+_worker_file: Optional[PDFFile] = None
+
+
+def _open_worker(filename: str, password: bytes | str, index: bool | str) -> None:
+    global _worker_file
+    from .file import PDFFile
+    _worker_file = PDFFile(filename, index=index, password=password)
+
+
+def _describe_part(nums: List[int]) -> List[Tuple[int, Entry]]:
+    return ObjectIndex.describe_nums(_worker_file, nums)
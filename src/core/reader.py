@@ -1,15 +1,20 @@
 
 from __future__ import annotations
 
-from ._utils import delimiter_chars, whitespace_chars
+import re
+
+from ._utils import delimiter_chars, whitespace_chars, string_escapes
 from .objects import *
+from .source import ReaderView, search
+
+ENDSTREAM = re.compile(rb"(?:\r\n|\r|\n)?endstream")
 
 
 class Tokenizer:
-    doc: memoryview
+    doc: memoryview | ReaderView
     pos: int
 
-    def __init__(self, doc: memoryview):
+    def __init__(self, doc: memoryview | ReaderView):
         self.doc = doc
         self.pos = 0
 
@@ -104,6 +109,54 @@ class Tokenizer:
 
 
 class Parser:
+    @staticmethod
+    def parse_literal_string(token: bytes) -> bytes:
+        token = token[1:-1]
+        if b"\\" not in token:
+            return token
+        ret = bytearray()
+        i = 0
+        while i < len(token):
+            if token[i] == ord("\\") and i + 1 < len(token):
+                i += 1
+                start = i
+                while i < len(token) and ord('0') <= token[i] <= ord('7'):
+                    i += 1
+                    if i >= start + 3:
+                        break
+                if i > start:
+                    ret.append(int(token[start:i], 8) & 0xFF)
+                elif token[i] in string_escapes:
+                    ret.append(string_escapes[token[i]])
+                    i += 1
+                elif token[i] == ord("\r"):
+                    # line continuation
+                    i += 2 if token[i + 1:i + 2] == b"\n" else 1
+                elif token[i] == ord("\n"):
+                    i += 1
+                else:
+                    ret.append(token[i])
+                    i += 1
+            else:
+                ret.append(token[i])
+                i += 1
+        return bytes(ret)
+
+    @staticmethod
+    def parse_name(token: bytes) -> bytes:
+        if b"#" not in token:
+            return token
+        ret = bytearray()
+        i = 0
+        while i < len(token):
+            if token[i] == ord('#') and i + 2 < len(token):
+                ret.append(int(token[i+1:i+3], 16))
+                i += 3
+            else:
+                ret.append(token[i])
+                i += 1
+        return bytes(ret)
+
     @staticmethod
     def parse_object(tk: Tokenizer, file: PDFFile) -> PDFObject:
         token = tk.next()
@@ -114,43 +167,11 @@ class Parser:
         elif token == b"false":
             return PDFBool(file, False)
         elif token.startswith(b"("):
-            token = token[1:-1]
-            ret = bytearray()
-            i = 0
-            while i < len(token):
-                if token[i] == ord("\\"):
-                    i += 1
-                    start = i
-                    while i < len(token) and ord('0') <= token[i] <= ord('7'):
-                        i += 1
-                        if i >= start + 3:
-                            break
-                    if i > start:
-                        ret.append(int(token[start:i], 8))
-                    else:
-                        if token[i] in b"\n\r\t\b\f()\\":
-                            ret.append(token[i])
-                            i += 1
-                        else:
-                            ret.append(token[start])
-                else:
-                    ret.append(token[i])
-                    i += 1
-            return PDFString(file, bytes(ret))
+            return PDFString(file, Parser.parse_literal_string(token))
         elif token.startswith(b"<") and token.endswith(b">"):
             return PDFString(file, bytes.fromhex(token[1:-1].decode('ascii')), show_hex=True)
         elif token == b"/":
-            token = tk.next()
-            ret = bytearray()
-            i = 0
-            while i < len(token):
-                if token[i] == ord('#') and i + 3 < len(token):
-                    ret.append(int(token[i+1:i+3], 16))
-                    i += 3
-                else:
-                    ret.append(token[i])
-                    i += 1
-            return PDFName(file, bytes(ret))
+            return PDFName(file, Parser.parse_name(tk.next()))
         elif token == b"[":
             ret = PDFArray(file)
             while not tk.is_end():
@@ -171,16 +192,26 @@ class Parser:
                 ret[key.value] = val
             if tk.peek() == b"stream":
                 tk.next()
-                length = ret[PDFName(file, b"Length")].value
+                length = ret.value.get(b"Length")
+                if isinstance(length, IndRef):
+                    # resolving may move a tokenizer shared with the xref
+                    pos = tk.pos
+                    length = length.resolve()
+                    tk.pos = pos
                 start_pos = tk.pos + 1
                 if tk.doc[tk.pos] == ord('\r') and tk.pos + 1 < len(tk.doc):
                     if tk.doc[tk.pos + 1] == ord('\n'):
                         start_pos += 1
-                value = tk.doc[start_pos:start_pos + length].tobytes()
-                tk.seek(start_pos + length)
-                if tk.next() != b"endstream":
+                if isinstance(length, PDFInt):
+                    tk.seek(start_pos + length.value)
+                    if tk.next() == b"endstream":
+                        return PDFStream(file, tk.doc[start_pos:start_pos + length.value].tobytes(), ret)
+                # missing or wrong /Length, the data ends at the endstream keyword
+                m = search(ENDSTREAM, tk.doc, start_pos)
+                if m is None:
                     raise SyntaxError("Unterminated stream")
-                return PDFStream(file, value, ret)
+                tk.seek(m[1])
+                return PDFStream(file, tk.doc[start_pos:m[0]].tobytes(), ret)
             return ret
         else:
             try:
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import io
+import os
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Set
+
+from .file import PDFFile, Trailer
+from .objects import *
+from .xref import RefSrc
+
+# the snapshot references of the base file resolve through, one per thread or task
+ACTIVE_SNAPSHOT: ContextVar[Optional[Snapshot]] = ContextVar("active_snapshot", default=None)
+
+
+class Snapshot:
+    # a view of the base file plus the objects changed in it; unchanged objects are the ones the base file
+    # has loaded, shared by every snapshot and never written to, so reading takes no lock and makes no copy
+    base: PDFFile
+    overlay: Dict[int, RefSrc]
+    owned: Set[int]
+    trailer: Trailer
+    max_num: int
+    security: Any
+
+    def __init__(self, base: PDFFile, parent: Optional[Snapshot] = None):
+        if base.dirty or base._edit_depth:
+            raise Exception("Flush the changes of the base file before taking a snapshot")
+        self.base = base
+        self.security = base.security
+        base._snapshot_var = ACTIVE_SNAPSHOT
+        if base._snapshots is None:
+            base._snapshots = weakref.WeakSet()
+        base._snapshots.add(self)
+        if parent is None:
+            self.overlay = dict()
+            self.max_num = base.xref.max_num
+            trailer = base.trailer.extent
+        else:
+            # the changes of the parent are shared until either side edits them again
+            self.overlay = dict(parent.overlay)
+            self.max_num = parent.max_num
+            parent.owned = set()
+            trailer = parent.trailer.extent
+        self.owned = set()
+        self.trailer = Trailer(self._copy(trailer))
+
+    def snapshot(self) -> Snapshot:
+        return Snapshot(self.base, self)
+
+    def close(self) -> None:
+        # the base file can be changed again once none of its snapshots is open
+        self.base._snapshots.discard(self)
+
+    def __enter__(self) -> Snapshot:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @contextmanager
+    def active(self) -> Iterator[Snapshot]:
+        # within the block references read from objects of the base file resolve through this snapshot
+        token = ACTIVE_SNAPSHOT.set(self)
+        try:
+            yield self
+        finally:
+            ACTIVE_SNAPSHOT.reset(token)
+
+    def resolve(self, ref: IndRef) -> PDFObject:
+        src = self.overlay.get(ref.N)
+        if src is None:
+            return self.base.xref.resolve(ref)
+        if src.ref.G != ref.G:
+            return PDFNull(self.base)
+        return src.obj
+
+    def _copy(self, obj: PDFObject) -> PDFObject:
+        # direct objects are copied, references are bound to this snapshot; stream data is shared
+        if isinstance(obj, IndRef):
+            return IndRef(self, obj.N, obj.G)
+        if isinstance(obj, PDFDict):
+            return PDFDict(self, {k: self._copy(v) for k, v in obj.value.items()})
+        if isinstance(obj, PDFArray):
+            return PDFArray(self, [self._copy(v) for v in obj.value])
+        if isinstance(obj, PDFStream):
+            copy = PDFStream(self, obj.value, self._copy(obj.extent))
+            copy._crypt = obj._crypt
+            return copy
+        if isinstance(obj, PDFString):
+            return PDFString(self, obj.value, obj.show_hex)
+        if isinstance(obj, PDFNull):
+            return obj
+        return obj.__class__(self, obj.value)
+
+    def edit(self, ref: IndRef) -> PDFObject:
+        # copy on write: the first edit of an object copies it into this snapshot, later ones return that copy
+        src = self.overlay.get(ref.N)
+        if ref.N in self.owned and src.ref.G == ref.G:
+            return src.obj
+        obj = self.resolve(ref)
+        if obj is PDFNull(self.base):
+            raise Exception(f"Object {ref.N} {ref.G} R is free")
+        copy = self._copy(obj)
+        self._set(IndRef(self, ref.N, ref.G), copy)
+        return copy
+
+    def _set(self, ref: IndRef, obj: PDFObject) -> None:
+        if obj is not PDFNull(self.base):
+            obj._ref = ref
+        self.overlay[ref.N] = RefSrc(ref, obj)
+        self.owned.add(ref.N)
+
+    def check_writable(self, ref: IndRef) -> None:
+        # an object that is not owned is shared with a snapshot taken since, edit() gives a copy of its own
+        if ref.N not in self.owned:
+            raise Exception(f"Object {ref.N} {ref.G} R is shared with another snapshot, change it through edit()")
+
+    def mark_dirty(self, ref: IndRef, obj: PDFObject) -> None:
+        # check_writable() only lets owned objects change, commit() writes them as they are then
+        pass
+
+    def add_new_ref(self, obj: PDFObject) -> IndRef:
+        # numbers are not reused, a freed one may still be reachable from another snapshot
+        self.max_num += 1
+        ref = IndRef(self, self.max_num, 0)
+        self._set(ref, obj)
+        return ref
+
+    def delete(self, ref: IndRef) -> None:
+        if self.resolve(ref) is not PDFNull(self.base):
+            self._set(IndRef(self, ref.N, ref.G + 1), PDFNull(self.base))
+
+    def changed(self) -> List[IndRef]:
+        return sorted(src.ref for src in self.overlay.values())
+
+    def render(self) -> bytes:
+        # the base document followed by one update section holding the changed objects
+        base = self.base
+        if len(base.doc) and base.last_xref_offset == -1:
+            raise Exception("Can not append to a document without a valid xref, use save() instead")
+        buffer = io.BytesIO()
+        buffer.write(base.doc if isinstance(base.doc, memoryview) else base.doc.tobytes())
+        ref_list = self.changed()
+        if not ref_list:
+            return buffer.getvalue()
+        new_offsets = dict()
+        for ref in ref_list:
+            obj = self.overlay[ref.N].obj
+            if obj is PDFNull(base):
+                continue
+            new_offsets[ref.N] = buffer.tell()
+            buffer.write(f"{ref.N} {ref.G} obj\n".encode('ascii'))
+            buffer.write(base.object_bytes(obj, ref))
+            buffer.write(b"\nendobj\n")
+        self.trailer.Size = self.max_num + 1
+        base._write_table(buffer, ref_list, new_offsets, base.last_xref_offset, self.trailer)
+        return buffer.getvalue()
+
+    def commit(self, filename: Optional[str] = None, overwrite: bool = False):
+        # the update is appended to what the base file read; when that was the file on disk and it has grown
+        # since, another commit went first and this one would drop its changes
+        if filename is None:
+            filename = self.base.filename
+        if filename == self.base.filename and isinstance(self.base.doc, memoryview) \
+                and os.path.isfile(filename) and os.path.getsize(filename) != len(self.base.doc):
+            raise Exception(f"{filename} changed since the snapshot was taken")
+        data = self.render()
+
+        if os.path.exists(filename) and not overwrite:
+            Q = input(f"You are trying to override {filename}. (Y/n) ")
+            if Q.strip() != "Y":
+                return
+
+        with open(filename, "wb") as f:
+            f.write(data)
+        self.close()
@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple, Dict
+
+Range = Tuple[int, int]  # offset, length
+
+BLOCK_SIZE = 1 << 16
+MAX_BLOCKS = 1024
+READAHEAD_BLOCKS = 2
+COALESCE_GAP = 1 << 16
+VIEW_WINDOW = 1 << 12
+
+
+class Reader(ABC):
+    # random access to the bytes of a document, without holding all of them
+    size: int
+
+    @abstractmethod
+    def read(self, offset: int, length: int) -> bytes:
+        raise Exception("Abstract method")
+
+    def read_ranges(self, ranges: List[Range]) -> List[bytes]:
+        return [self.read(offset, length) for offset, length in ranges]
+
+    def prefetch(self, ranges: List[Range]) -> None:
+        # the ranges are about to be read, only a reader with a cache has something to do
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class BytesReader(Reader):
+    data: memoryview
+
+    def __init__(self, data: bytes | memoryview):
+        self.data = memoryview(data)
+        self.size = len(self.data)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self.data[offset:offset + length].tobytes()
+
+
+class FileReader(Reader):
+    # local stand-in for remote storage, reads only the requested ranges
+    path: str
+    _fd: int
+    _lock: threading.Lock
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self.size = os.fstat(self._fd).st_size
+        self._lock = threading.Lock()
+
+    def read(self, offset: int, length: int) -> bytes:
+        length = max(0, min(length, self.size - offset))
+        if hasattr(os, "pread"):
+            return os.pread(self._fd, length, offset)
+        with self._lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            return os.read(self._fd, length)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class RangeReader(Reader):
+    # adapter for range requests, ranges close to each other are fetched with a single request
+    fetch: Callable[[int, int], bytes]
+    max_gap: int
+    requests: int = 0
+    fetched: int = 0
+
+    def __init__(self, size: int, fetch: Callable[[int, int], bytes], max_gap: int = COALESCE_GAP):
+        self.size = size
+        self.fetch = fetch
+        self.max_gap = max_gap
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self.read_ranges([(offset, length)])[0]
+
+    @staticmethod
+    def coalesce(ranges: List[Range], max_gap: int) -> List[Range]:
+        merged: List[List[int]] = []
+        for offset, length in sorted(ranges):
+            if merged and offset <= merged[-1][0] + merged[-1][1] + max_gap:
+                merged[-1][1] = max(merged[-1][1], offset + length - merged[-1][0])
+            else:
+                merged.append([offset, length])
+        return [(offset, length) for offset, length in merged]
+
+    def read_ranges(self, ranges: List[Range]) -> List[bytes]:
+        ranges = [(offset, max(0, min(length, self.size - offset))) for offset, length in ranges]
+        fetched = []
+        for offset, length in RangeReader.coalesce(ranges, self.max_gap):
+            length = max(0, min(length, self.size - offset))
+            fetched.append((offset, self.fetch(offset, length)))
+            self.requests += 1
+            self.fetched += length
+        ret = []
+        for offset, length in ranges:
+            for start, data in fetched:
+                if start <= offset and offset + length <= start + len(data):
+                    ret.append(data[offset - start:offset - start + length])
+                    break
+            else:
+                ret.append(b"")
+        return ret
+
+
+class CachedReader(Reader):
+    # fixed size blocks in an LRU, a miss also fetches the next few blocks
+    inner: Reader
+    block_size: int
+    max_blocks: int
+    readahead: int
+    blocks: OrderedDict[int, bytes]
+    hits: int = 0
+    misses: int = 0
+    _lock: threading.Lock
+
+    def __init__(self, inner: Reader, block_size: int = BLOCK_SIZE, max_blocks: int = MAX_BLOCKS,
+                 readahead: int = READAHEAD_BLOCKS):
+        self.inner = inner
+        self.size = inner.size
+        self.block_size = block_size
+        self.max_blocks = max(1, max_blocks)
+        self.readahead = readahead
+        self.blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, indices: List[int]) -> Dict[int, bytes]:
+        last = (self.size - 1) // self.block_size
+        ret = dict()
+        missing = []
+        with self._lock:
+            for i in indices:
+                block = self.blocks.get(i)
+                if block is None:
+                    missing.append(i)
+                else:
+                    self.blocks.move_to_end(i)
+                    ret[i] = block
+                    self.hits += 1
+        if missing:
+            self.misses += len(missing)
+            wanted = sorted(set(missing) | set(range(missing[-1] + 1, min(last, missing[-1] + self.readahead) + 1)))
+            runs: List[List[int]] = []
+            for i in wanted:
+                if i in ret or (i not in missing and i in self.blocks):
+                    continue
+                if runs and runs[-1][1] == i - 1:
+                    runs[-1][1] = i
+                else:
+                    runs.append([i, i])
+            ranges = [(lo * self.block_size, (hi - lo + 1) * self.block_size) for lo, hi in runs]
+            with self._lock:
+                for (lo, hi), data in zip(runs, self.inner.read_ranges(ranges)):
+                    for i in range(lo, hi + 1):
+                        block = data[(i - lo) * self.block_size:(i - lo + 1) * self.block_size]
+                        self.blocks[i] = block
+                        self.blocks.move_to_end(i)
+                        if i in missing:
+                            ret[i] = block
+                while len(self.blocks) > self.max_blocks:
+                    self.blocks.popitem(last=False)
+        return ret
+
+    def read(self, offset: int, length: int) -> bytes:
+        length = max(0, min(length, self.size - offset))
+        if length == 0:
+            return b""
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        blocks = self._load(list(range(first, last + 1)))
+        data = b"".join(blocks[i] for i in range(first, last + 1))
+        start = offset - first * self.block_size
+        return data[start:start + length]
+
+    def prefetch(self, ranges: List[Range]) -> None:
+        # all missing blocks in one read_ranges() call, as many as the cache holds
+        indices = set()
+        for offset, length in ranges:
+            length = max(0, min(length, self.size - offset))
+            if length:
+                indices.update(range(offset // self.block_size, (offset + length - 1) // self.block_size + 1))
+        if indices:
+            self._load(sorted(indices)[:self.max_blocks])
+
+    def close(self) -> None:
+        self.blocks.clear()
+        self.inner.close()
+
+
+class ReaderView:
+    # the part of memoryview Tokenizer and Parser use, backed by a Reader
+    reader: Reader
+    start: int
+    stop: int
+    # (first position, bytes) of the last window read, swapped in one assignment so that a thread never
+    # sees the position of one window with the bytes of another
+    _cache: Tuple[int, bytes] = (0, b"")
+
+    def __init__(self, reader: Reader, start: int = 0, stop: Optional[int] = None):
+        self.reader = reader
+        self.start = start
+        self.stop = reader.size if stop is None else stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.stop - self.start)
+            if step != 1:
+                raise ValueError("ReaderView supports contiguous slices only")
+            view = ReaderView(self.reader, self.start + start, self.start + max(start, stop))
+            # the window holds absolute positions, a slice can keep using it
+            view._cache = self._cache
+            return view
+        pos = self.start + index if index >= 0 else self.stop + index
+        if not self.start <= pos < self.stop:
+            raise IndexError("ReaderView index out of range")
+        lo, window = self._cache
+        if not lo <= pos < lo + len(window):
+            lo = pos - pos % VIEW_WINDOW
+            window = self.reader.read(lo, VIEW_WINDOW)
+            self._cache = (lo, window)
+        return window[pos - lo]
+
+    def tobytes(self) -> bytes:
+        lo, window = self._cache
+        if lo <= self.start and self.stop <= lo + len(window):
+            return window[self.start - lo:self.stop - lo]
+        return self.reader.read(self.start, self.stop - self.start)
+
+    def find(self, x: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        end = len(self) if end is None else end
+        pos = start
+        while pos < end:
+            chunk = self[pos:min(end, pos + BLOCK_SIZE + len(x) - 1)].tobytes()
+            i = chunk.find(x)
+            if i != -1:
+                return pos + i
+            pos += BLOCK_SIZE
+        return -1
+
+    def rfind(self, x: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        end = len(self) if end is None else end
+        hi = end
+        while hi - start >= len(x):
+            lo = max(start, hi - BLOCK_SIZE)
+            i = self[lo:hi].tobytes().rfind(x)
+            if i != -1:
+                return lo + i
+            if lo == start:
+                break
+            hi = lo + len(x) - 1
+        return -1
+
+    def search(self, pattern: re.Pattern, pos: int = 0, overlap: int = 64) -> Optional[Tuple[int, int]]:
+        # (start, end) of the first match, matches longer than the overlap may be missed at block borders
+        while pos < len(self):
+            chunk = self[pos:pos + BLOCK_SIZE + overlap].tobytes()
+            m = pattern.search(chunk)
+            if m is not None and (m.end() < len(chunk) or pos + len(chunk) >= len(self)):
+                return pos + m.start(), pos + m.end()
+            pos += BLOCK_SIZE
+        return None
+
+
+def search(pattern: re.Pattern, doc: memoryview | ReaderView, pos: int = 0) -> Optional[Tuple[int, int]]:
+    if isinstance(doc, ReaderView):
+        return doc.search(pattern, pos)
+    m = pattern.search(doc, pos)
+    return None if m is None else (m.start(), m.end())
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+# event, amount (bytes or objects), seconds
+Hook = Callable[[str, int, float], None]
+
+# events recorded by the library
+XREF_PARSE = "xref.parse"            # bytes of one xref section, table or stream
+OBJECT_PARSE = "object.parse"        # bytes tokenized for one indirect object
+OBJSTM_PARSE = "objstm.parse"        # one object read out of an object stream
+RESOLVE_HIT = "resolve.hit"
+RESOLVE_MISS = "resolve.miss"
+FILTER_PREFIX = "filter."            # input bytes of one filter step, e.g. filter.FlateDecode
+DECRYPT = "decrypt"                  # bytes of one stream decrypted when it is decoded
+
+
+class Stats:
+    calls: Dict[str, int]
+    amounts: Dict[str, int]
+    seconds: Dict[str, float]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.calls = dict()
+        self.amounts = dict()
+        self.seconds = dict()
+
+    def add(self, event: str, amount: int = 0, seconds: float = 0.0) -> None:
+        self.calls[event] = self.calls.get(event, 0) + 1
+        self.amounts[event] = self.amounts.get(event, 0) + amount
+        self.seconds[event] = self.seconds.get(event, 0.0) + seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        ret = dict()
+        for event, calls in self.calls.items():
+            amount, seconds = self.amounts[event], self.seconds[event]
+            ret[event] = {"calls": calls, "amount": amount, "seconds": seconds,
+                          "rate": amount / seconds if seconds > 0 else 0.0}
+        return ret
+
+
+class Instrumentation:
+    # off by default, every call site checks `enabled` before it reads the clock
+    enabled: bool = False
+    stats: Stats = Stats()
+    hooks: List[Hook] = []
+
+    @staticmethod
+    def enable(hook: Optional[Hook] = None) -> None:
+        if hook is not None:
+            Instrumentation.add_hook(hook)
+        Instrumentation.enabled = True
+
+    @staticmethod
+    def disable() -> None:
+        Instrumentation.enabled = False
+
+    @staticmethod
+    def add_hook(hook: Hook) -> None:
+        if hook not in Instrumentation.hooks:
+            Instrumentation.hooks.append(hook)
+
+    @staticmethod
+    def remove_hook(hook: Hook) -> None:
+        if hook in Instrumentation.hooks:
+            Instrumentation.hooks.remove(hook)
+
+    @staticmethod
+    def clock() -> float:
+        return perf_counter() if Instrumentation.enabled else 0.0
+
+    @staticmethod
+    def record(file: Optional[PDFFile], event: str, amount: int = 0, start: float = 0.0) -> None:
+        # start is a clock() reading, zero for events that are only counted
+        seconds = perf_counter() - start if start else 0.0
+        Instrumentation.stats.add(event, amount, seconds)
+        if file is not None:
+            file.events.add(event, amount, seconds)
+        for hook in Instrumentation.hooks:
+            hook(event, amount, seconds)
@@ -1,32 +1,40 @@
 
 from __future__ import annotations
 
-from typing import List
-from bitarray import bitarray
+from typing import Iterator, List
 import zlib
-from PIL import Image
 from io import BytesIO
 from ._utils import whitespace_chars, camel_to_snake
 from .objects import *
 from .reader import Tokenizer, Parser
-from .file import PDFFile
+from .stats import Instrumentation, FILTER_PREFIX, DECRYPT
+from .filters import FilterRegistry, FunctionBackend, ChainDecoder, PREDICTOR, row_length, average_row, paeth_row
+
+if TYPE_CHECKING:
+    from .file import PDFFile
 
 
 class Stream:
+    stream: PDFStream
     extent: PDFDict
     value: bytes
     file: PDFFile
     decoded_value: Optional[bytes] = None
 
     def __init__(self, stream: PDFStream):
+        self.stream = stream
         self.extent = stream.extent
         self.value = stream.value
         self.file = stream.extent._file
 
     def __setattr__(self, key, value):
         if key == 'value' and hasattr(self, key):
+            self.stream.check_writable()
             super().__setattr__(key, value)
+            self.stream.value = value
+            self.stream._crypt = None
             self.extent[b'Length'] = PDFInt(self.file, len(value))
+            self.stream.mark_modified()
         else:
             super().__setattr__(key, value)
 
@@ -43,47 +51,91 @@ class Stream:
         self.extent[b'Filter'] = value
 
     @property
-    def DecodeParams(self) -> Nullable[PDFDict | PDFArray]:
-        return self.extent.get_expected(b'DecodeParams', Nullable[Union[PDFDict, PDFArray]])
+    def DecodeParms(self) -> Nullable[PDFDict | PDFArray]:
+        return self.extent.get_expected(b'DecodeParms', Nullable[Union[PDFDict, PDFArray]])
 
-    @DecodeParams.setter
-    def DecodeParams(self, value: Nullable[PDFDict | PDFArray]):
-        self.extent[b'DecodeParams'] = value
+    @DecodeParms.setter
+    def DecodeParms(self, value: Nullable[PDFDict | PDFArray]):
+        self.extent[b'DecodeParms'] = value
 
     @property
     def DL(self) -> Nullable[PDFInt]:
         return self.extent.get_expected(b'DL', Nullable[PDFInt])
 
-    def decode(self):
+    def filter_chain(self) -> List[Tuple[bytes, dict]]:
         filters = self.Filter.to_python()
         if filters is None:
-            self.decoded_value = self.value
-            return self.decoded_value
+            return []
         if isinstance(filters, bytes):
             filters = [filters]
 
-        params = self.DecodeParams.to_python()
+        params = self.DecodeParms.to_python()
         if params is None:
             params = [dict() for _ in range(len(filters))]
         if isinstance(params, dict):
             params = [params]
 
-        params = [{camel_to_snake(k.decode('utf-8')): v for k, v in param.items()} for param in params]
+        params = [{camel_to_snake(k.decode('utf-8')): v for k, v in (param or {}).items()} for param in params]
+        return list(zip(filters, params))
 
+    @staticmethod
+    def split_crypt(chain: List[Tuple[bytes, dict]]) -> Tuple[Optional[bytes], List[Tuple[bytes, dict]]]:
+        # a leading /Crypt filter names the crypt filter of the stream, the security handler applies it
+        if chain and chain[0][0] == b'Crypt':
+            return chain[0][1].get('name', b'Identity'), chain[1:]
+        return None, chain
+
+    def decode(self, skip_last: int = 0):
+        chain = self.filter_chain()
         dv = self.value
-        for i in range(len(filters)):
-            dv = Filter.decode(dv, filters[i], **params[i])
-
-        self.decoded_value = dv
-        return self.decoded_value
+        ref = self.stream._crypt
+        if ref is not None:
+            start = Instrumentation.clock()
+            name, chain = Stream.split_crypt(chain)
+            dv = self.file.security.decrypt_stream(dv, ref, name)
+            if Instrumentation.enabled:
+                Instrumentation.record(self.file, DECRYPT, len(self.value), start)
+        for _filter, params in chain[:len(chain) - skip_last]:
+            start = Instrumentation.clock()
+            size = len(dv)
+            dv = Filter.decode(dv, _filter, **params)
+            if Instrumentation.enabled:
+                Instrumentation.record(self.file, FILTER_PREFIX + _filter.decode('latin-1'), size, start)
+
+        if skip_last == 0:
+            self.decoded_value = dv
+        return dv
+
+    def iter_decode(self, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        # decodes piece by piece with the streaming entry points of the filters
+        chain = self.filter_chain()
+        ref = self.stream._crypt
+        if ref is not None:
+            name, chain = Stream.split_crypt(chain)
+            decryptor = self.file.security.decryptor(ref, name)
+        decoder = FilterRegistry.chain_decoder(chain)
+        if ref is not None and decryptor is not None:
+            decoder = ChainDecoder([decryptor, decoder])
+        value = self.value
+        for start in range(0, len(value), chunk_size):
+            data = decoder.update(value[start:start + chunk_size])
+            if data:
+                yield data
+        data = decoder.flush()
+        if data:
+            yield data
 
 
 class ObjectStream(Stream):
-    def __init__(self, stream: PDFStream):
+    offsets: List[Tuple[int, int]]
+    data: memoryview
+
+    def __init__(self, stream: PDFStream, offsets: Optional[List[Tuple[int, int]]] = None):
         super().__init__(stream)
-        self.obj = []
+        self.offsets = []
+        self.data = memoryview(b"")
         if len(self.value):
-            self._read(self.decode())
+            self._read(self.decode(), offsets)
 
     @property
     def Type(self) -> bytes:
@@ -113,29 +165,40 @@ class ObjectStream(Stream):
     def Extends(self, value: Nullable[PDFStream]):
         self.extent[b'Extends'] = value
 
-    def _read(self, value: bytes) -> None:
-        tk = Tokenizer(memoryview(value))
-        self.obj = []
-        while tk.pos < self.First and len(self.obj) < self.N:
-            n = int(tk.next())
+    def _read(self, value: bytes, offsets: Optional[List[Tuple[int, int]]] = None) -> None:
+        # only the offset table is read here, members are parsed on demand
+        self.data = memoryview(value)
+        if offsets is not None:
+            self.offsets = offsets
+            return
+        tk = Tokenizer(self.data)
+        first, n = self.First, self.N
+        self.offsets = []
+        while tk.pos < first and len(self.offsets) < n:
+            num = int(tk.next())
             off = int(tk.next())
-            pos = tk.pos
-            tk.seek(off + self.First)
-            self.obj.append(Parser.parse_object(tk, self.file))
-            self.file.mark_updated(IndRef(self.file, n, 0), self.obj[-1])
-            tk.seek(pos)
+            self.offsets.append((num, off + first))
+
+    def read_object(self, index: int, num: Optional[int] = None) -> PDFObject:
+        if not 0 <= index < len(self.offsets):
+            return PDFNull(self.file)
+        n, off = self.offsets[index]
+        if num is not None and n != num:
+            raise SyntaxError("IndRef is different from expected")
+        tk = Tokenizer(self.data)
+        tk.seek(off)
+        return Parser.parse_object(tk, self.file)
 
 
 class Filter:
+    # the static methods below are the pure Python backends, decode and encode go through the registry
     @staticmethod
     def decode(value: bytes, _filter: bytes, **kwargs) -> bytes:
-        return getattr(Filter, _filter.decode('ascii'))(value, **kwargs)
+        return FilterRegistry.decode(value, _filter, **kwargs)
 
     @staticmethod
     def encode(value: bytes, _filter: bytes, **kwargs) -> bytes:
-        if _filter.endswith(b'Decode'):
-            _filter = _filter.replace(b'Decode', b'Encode')
-        return getattr(Filter, _filter.decode('ascii'))(value, **kwargs)
+        return FilterRegistry.encode(value, _filter, **kwargs)
 
     @staticmethod
     def ASCIIHexDecode(value: bytes) -> bytes:
@@ -157,12 +220,7 @@ class Filter:
 
     @staticmethod
     def ASCIIHexEncode(value: bytes) -> bytes:
-        ret = bytearray()
-        for b in value:
-            x = hex(b)[2:].upper().encode('ascii')
-            for i in x:
-                ret.append(i)
-        return bytes(ret)
+        return value.hex().upper().encode('ascii') + b">"
 
     @staticmethod
     def ASCII85Decode(value: bytes) -> bytes:
@@ -243,6 +301,7 @@ class Filter:
 
     @staticmethod
     def LZWEncode(value: bytes) -> bytes:
+        from bitarray import bitarray
         dictionary = {bytes([i]): i for i in range(256)}
         next_code = 258
         w = b""
@@ -270,20 +329,58 @@ class Filter:
                 dictionary[wc] = next_code
                 next_code += 1
                 if next_code >= (1 << word_size):
-                    word_size += 1
-                    if word_size > 12:
+                    if word_size == 12:
+                        # table full, the clear code still goes out at the current width
                         add(256)
                         dictionary = {bytes([i]): i for i in range(256)}
                         next_code = 258
                         word_size = 9
-                        w = b""
-                        continue
+                    else:
+                        word_size += 1
                 w = bytes([c])
         if w:
             add(dictionary[w])
         add(257)  # EOD marker
         return bytes(result)
 
+    @staticmethod
+    def unpredict(value: bytes, predictor: int = 1, colors: int = 1,
+                  bits_per_component: int = 8, columns: int = 1, prev: Optional[bytes] = None) -> bytes:
+        # prev is the decoded row before value, when a stream is unpredicted in pieces
+        if predictor == 1:
+            return value
+        bpp, row_len = row_length(colors, bits_per_component, columns)
+
+        if predictor == 2:
+            if bits_per_component != 8:
+                raise Exception("TIFF predictor is supported only for 8 bits per component")
+            ret = bytearray(value)
+            for start in range(0, len(ret), row_len):
+                for i in range(start + bpp, min(start + row_len, len(ret))):
+                    ret[i] = (ret[i] + ret[i - bpp]) & 0xFF
+            return bytes(ret)
+
+        # PNG predictors, every row starts with its own filter type byte
+        ret = bytearray()
+        prev = bytearray(prev) if prev else bytearray(row_len)
+        for start in range(0, len(value), row_len + 1):
+            kind = value[start]
+            row = bytearray(value[start + 1:start + 1 + row_len])
+            row.extend(bytes(row_len - len(row)))
+            if kind == 1:
+                for i in range(bpp, row_len):
+                    row[i] = (row[i] + row[i - bpp]) & 0xFF
+            elif kind == 2:
+                for i in range(row_len):
+                    row[i] = (row[i] + prev[i]) & 0xFF
+            elif kind == 3:
+                average_row(row, prev, bpp)
+            elif kind == 4:
+                paeth_row(row, prev, bpp)
+            ret.extend(row)
+            prev = row
+        return bytes(ret)
+
     @staticmethod
     def LZWDecode(
             value: bytes,
@@ -293,6 +390,12 @@ class Filter:
             columns: int = 1,
             early_change: int = 1
     ) -> bytes:
+        return Filter.unpredict(Filter._lzw_decode(value, early_change), predictor, colors,
+                                bits_per_component, columns)
+
+    @staticmethod
+    def _lzw_decode(value: bytes, early_change: int = 1) -> bytes:
+        from bitarray import bitarray
         # 초기 테이블
         dictionary = {i: bytes([i]) for i in range(256)}
         clear_code = 256
@@ -329,8 +432,10 @@ class Filter:
                 bef = dictionary[code]
             elif code == next_code:
                 dictionary[next_code] = bef + bef[:1]
+                ret += dictionary[next_code]
                 next_code += 1
                 word_size += 1 if next_code >= (1 << word_size) - early_change else 0
+                word_size = min(word_size, 12)
                 bef = dictionary[code]
             else:
                 print(bef, pos, code, next_code, len(bitstream), word_size)
@@ -342,69 +447,61 @@ class Filter:
         return zlib.compress(value)
 
     @staticmethod
-    def FlateDecode(value: bytes) -> bytes:
-        return zlib.decompress(value)
+    def FlateDecode(
+            value: bytes,
+            predictor: int = 1,
+            colors: int = 1,
+            bits_per_component: int = 8,
+            columns: int = 1
+    ) -> bytes:
+        return Filter.unpredict(zlib.decompress(value), predictor, colors, bits_per_component, columns)
 
     @staticmethod
     def RunLengthEncode(value: bytes) -> bytes:
-        ret = b""
-        bef = value[:1]
-        pos = 1
-        cnt = 1
-        while pos < len(value):
-            curr = value[pos:pos+1]
-            if bef == curr:
-                cnt += 1
-                pos += 1
-            else:
-                ret = ret + bytes([cnt - 1]) + bef
-                bef = curr
-                cnt = 0
-        if cnt >= 1:
-            ret = ret + bytes([cnt - 1]) + bef
-            cnt = 1
-        result = b""
-        temp = b""
+        # runs of 2 to 128 equal bytes are repeated, everything else is copied in literals of up to 128
+        ret = bytearray()
+        literal = bytearray()
         pos = 0
-        cnt = 0
-        while pos < len(ret):
-            N = ret[pos]
-            B = ret[pos + 1: pos + 2]
-            if N == 0 and cnt < 127:
-                cnt += 1
-                temp += B
-                pos += 2
+        while pos < len(value):
+            end = pos + 1
+            while end < len(value) and end - pos < 128 and value[end] == value[pos]:
+                end += 1
+            if end - pos > 1:
+                if literal:
+                    ret += bytes([len(literal) - 1]) + literal
+                    literal.clear()
+                ret += bytes([257 - (end - pos), value[pos]])
             else:
-                if cnt > 1:
-                    result = result + bytes([256-cnt]) + temp
-                    temp = b""
-                    cnt = 0
-                elif cnt == 1:
-                    result = result + bytes([0]) + temp
-                    temp = b""
-                    cnt = 0
-                else:
-                    result += ret[pos:pos + 2]
-                    pos += 2
-        if cnt > 1:
-            result = result + bytes([256 - cnt]) + temp
-        elif cnt == 1:
-            result = result + bytes([0]) + temp
-        result += bytes([128])
-        return result
+                literal.append(value[pos])
+                if len(literal) == 128:
+                    ret += bytes([127]) + literal
+                    literal.clear()
+            pos = end
+        if literal:
+            ret += bytes([len(literal) - 1]) + literal
+        ret.append(128)
+        return bytes(ret)
 
     @staticmethod
     def RunLengthDecode(value: bytes) -> bytes:
-        ret = b""
+        # 0-127: copy the next length + 1 bytes, 129-255: repeat the next byte 257 - length times, 128: EOD
+        ret = bytearray()
         pos = 0
         while pos < len(value):
             header = value[pos]
             if header < 128:
-                ret += bytes([value[pos+1]]*(header+1))
-                pos += 2
+                ret += value[pos + 1:pos + 2 + header]
+                pos += 2 + header
             elif header == 128:
                 break
             else:
-                ret += value[pos + 1:pos + 257 - header]
-                pos = pos + 257 - header
-        return ret
+                ret += value[pos + 1:pos + 2] * (257 - header)
+                pos += 2
+        return bytes(ret)
+
+
+FilterRegistry.register(FunctionBackend(b"ASCIIHexDecode", "python", Filter.ASCIIHexDecode, Filter.ASCIIHexEncode))
+FilterRegistry.register(FunctionBackend(b"ASCII85Decode", "python", Filter.ASCII85Decode, Filter.ASCII85Encode))
+FilterRegistry.register(FunctionBackend(b"LZWDecode", "python", Filter._lzw_decode, Filter.LZWEncode))
+FilterRegistry.register(FunctionBackend(b"RunLengthDecode", "python", Filter.RunLengthDecode, Filter.RunLengthEncode))
+FilterRegistry.register(FunctionBackend(PREDICTOR, "python", Filter.unpredict))
@@ -0,0 +1,448 @@
+from __future__ import annotations
+
+import copy
+import math
+import unicodedata
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterator, Iterable
+
+from .objects import *
+from .content import ContentParser, ContentLexer, Operation
+from .stream import Stream
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+    from .pages import Page
+
+
+Matrix = Tuple[float, float, float, float, float, float]
+IDENTITY: Matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+MAX_FORM_DEPTH = 8
+WORD_GAP = 250  # TJ adjustments (in thousandths of an em) wider than this become a space
+
+STANDARD_ENCODING_DIFF = {0x27: "’", 0x60: "‘"}
+GLYPH_NAMES = {
+    "space": " ", "exclam": "!", "quotedbl": "\"", "numbersign": "#", "dollar": "$", "percent": "%",
+    "ampersand": "&", "quotesingle": "'", "quoteright": "’", "quoteleft": "‘", "parenleft": "(",
+    "parenright": ")", "asterisk": "*", "plus": "+", "comma": ",", "hyphen": "-", "period": ".", "slash": "/",
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "colon": ":", "semicolon": ";", "less": "<", "equal": "=", "greater": ">",
+    "question": "?", "at": "@", "bracketleft": "[", "backslash": "\\", "bracketright": "]",
+    "asciicircum": "^", "underscore": "_", "grave": "`", "braceleft": "{", "bar": "|", "braceright": "}",
+    "asciitilde": "~", "bullet": "•", "endash": "–", "emdash": "—", "ellipsis": "…",
+    "quotedblleft": "“", "quotedblright": "”", "quotesinglbase": "‚",
+    "quotedblbase": "„", "dagger": "†", "daggerdbl": "‡", "trademark": "™",
+    "copyright": "©", "registered": "®", "degree": "°", "section": "§",
+    "paragraph": "¶", "fi": "fi", "fl": "fl", "ff": "ff", "ffi": "ffi", "ffl": "ffl",
+    "Euro": "€", "minus": "−", "nbspace": " ", "sfthyphen": "­",
+    "dotlessi": "ı", "germandbls": "ß", "ae": "æ", "AE": "Æ", "oe": "œ",
+    "OE": "Œ", "oslash": "ø", "Oslash": "Ø", "eth": "ð", "thorn": "þ",
+}
+ACCENTS = {"acute": "́", "grave": "̀", "circumflex": "̂", "dieresis": "̈",
+           "tilde": "̃", "ring": "̊", "cedilla": "̧", "caron": "̌"}
+
+
+def glyph_to_unicode(name: str) -> str:
+    name = name.split(".", 1)[0]
+    if name in GLYPH_NAMES:
+        return GLYPH_NAMES[name]
+    if len(name) == 1:
+        return name
+    try:
+        if name.startswith("uni") and len(name) >= 7:
+            return "".join(chr(int(name[i:i + 4], 16)) for i in range(3, len(name) - 3, 4))
+        if name.startswith("u") and 5 <= len(name) <= 7:
+            return chr(int(name[1:], 16))
+    except ValueError:
+        return ""
+    # composed latin letters such as eacute or Adieresis
+    for suffix, mark in ACCENTS.items():
+        if name.endswith(suffix) and len(name) == len(suffix) + 1:
+            return unicodedata.normalize("NFC", name[0] + mark)
+    return ""
+
+
+def multiply(a: Matrix, b: Matrix) -> Matrix:
+    return (a[0] * b[0] + a[1] * b[2], a[0] * b[1] + a[1] * b[3],
+            a[2] * b[0] + a[3] * b[2], a[2] * b[1] + a[3] * b[3],
+            a[4] * b[0] + a[5] * b[2] + b[4], a[4] * b[1] + a[5] * b[3] + b[5])
+
+
+def to_matrix(args: List[PDFObject]) -> Matrix:
+    return tuple(float(a.value) for a in args[:6]) if len(args) >= 6 else IDENTITY
+
+
+class CMap:
+    codespace: List[Tuple[int, int, int]]
+    chars: Dict[int, str]
+    ranges: List[Tuple[int, int, int, str]]
+
+    def __init__(self):
+        self.codespace = []
+        self.chars = dict()
+        self.ranges = []  # (low, high, code length, first string), sorted by low
+
+    @staticmethod
+    def _code(token: bytes) -> Tuple[int, int]:
+        raw = bytes.fromhex(token[1:-1].decode('ascii'))
+        return int.from_bytes(raw, "big"), len(raw)
+
+    @staticmethod
+    def _unicode(token: bytes) -> str:
+        if token.startswith(b"/"):
+            return glyph_to_unicode(token[1:].decode('latin-1'))
+        raw = bytes.fromhex(token[1:-1].decode('ascii'))
+        return raw.decode("utf-16-be", "replace")
+
+    @staticmethod
+    def parse(data: bytes) -> CMap:
+        ret = CMap()
+        tokens = [t for t in ContentLexer(memoryview(data)).tokens()]
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token == b"begincodespacerange":
+                i += 1
+                while i + 1 < len(tokens) and tokens[i] != b"endcodespacerange":
+                    (low, n), (high, _) = CMap._code(tokens[i]), CMap._code(tokens[i + 1])
+                    ret.codespace.append((n, low, high))
+                    i += 2
+            elif token == b"beginbfchar":
+                i += 1
+                while i + 1 < len(tokens) and tokens[i] != b"endbfchar":
+                    code, _ = CMap._code(tokens[i])
+                    ret.chars[code] = CMap._unicode(tokens[i + 1])
+                    i += 2
+            elif token == b"beginbfrange":
+                i += 1
+                while i + 2 < len(tokens) and tokens[i] != b"endbfrange":
+                    (low, n), (high, _) = CMap._code(tokens[i]), CMap._code(tokens[i + 1])
+                    if tokens[i + 2] == b"[":
+                        i += 3
+                        code = low
+                        while i < len(tokens) and tokens[i] != b"]":
+                            ret.chars[code] = CMap._unicode(tokens[i])
+                            code += 1
+                            i += 1
+                        i += 1
+                    else:
+                        ret.ranges.append((low, high, n, CMap._unicode(tokens[i + 2])))
+                        i += 3
+            i += 1
+        ret.ranges.sort()
+        ret.codespace.sort()
+        return ret
+
+    def code_lengths(self) -> List[int]:
+        return sorted({n for n, _, _ in self.codespace})
+
+    def split(self, data: bytes, default_length: int) -> List[int]:
+        codes = []
+        lengths = self.code_lengths()
+        i = 0
+        while i < len(data):
+            length = default_length
+            for n in lengths:
+                code = int.from_bytes(data[i:i + n], "big")
+                if any(n == m and low <= code <= high for m, low, high in self.codespace):
+                    length = n
+                    break
+            codes.append(int.from_bytes(data[i:i + length], "big"))
+            i += length
+        return codes
+
+    def lookup(self, code: int) -> Optional[str]:
+        ret = self.chars.get(code)
+        if ret is not None:
+            return ret
+        i = bisect_right(self.ranges, (code, float("inf"))) - 1
+        if i >= 0:
+            low, high, _, first = self.ranges[i]
+            if low <= code <= high and first:
+                return first[:-1] + chr(ord(first[-1]) + code - low)
+        return None
+
+    @staticmethod
+    def load(file: PDFFile, obj: PDFObject) -> Optional[CMap]:
+        ref = obj if isinstance(obj, IndRef) else None
+        if ref is not None and ref in file.resource_cache:
+            return file.resource_cache[ref]
+        stream = obj.resolve()
+        if not isinstance(stream, PDFStream):
+            return None
+        ret = CMap.parse(Stream(stream).decode())
+        if ref is not None:
+            file.resource_cache[ref] = ret
+        return ret
+
+
+class Font:
+    name: bytes
+    composite: bool
+    to_unicode: Optional[CMap]
+    table: Optional[List[str]]
+    widths: Dict[int, float]
+    default_width: float
+
+    def __init__(self, file: PDFFile, obj: PDFDict):
+        self.name = obj.get(b"BaseFont").value or b""
+        self.composite = obj.get(b"Subtype").value == b"Type0"
+        to_unicode = obj.value.get(b"ToUnicode")
+        self.to_unicode = CMap.load(file, to_unicode) if to_unicode is not None else None
+        self.table = None if self.composite else self._simple_table(obj)
+        self.widths = dict()
+        self.default_width = 0.0
+        if self.composite:
+            self._read_cid_widths(obj)
+        else:
+            self._read_simple_widths(obj)
+
+    @staticmethod
+    def _simple_table(obj: PDFDict) -> List[str]:
+        encoding = obj.get(b"Encoding")
+        base = encoding.get(b"BaseEncoding").value if isinstance(encoding, PDFDict) else encoding.value
+        if base == b"MacRomanEncoding":
+            table = list(bytes(range(256)).decode("mac_roman"))
+        elif base == b"WinAnsiEncoding":
+            table = list(bytes(range(256)).decode("cp1252", "replace"))
+        else:
+            table = list(bytes(range(256)).decode("latin-1"))
+            if base == b"StandardEncoding" or base is None:
+                for code, char in STANDARD_ENCODING_DIFF.items():
+                    table[code] = char
+        if isinstance(encoding, PDFDict):
+            code = 0
+            for item in encoding.get(b"Differences").value or []:
+                if isinstance(item, PDFInt):
+                    code = item.value
+                elif isinstance(item, PDFName) and 0 <= code < 256:
+                    table[code] = glyph_to_unicode(item.value.decode('latin-1'))
+                    code += 1
+        return table
+
+    def _read_simple_widths(self, obj: PDFDict) -> None:
+        first = obj.get(b"FirstChar")
+        widths = obj.get(b"Widths")
+        if isinstance(first, PDFInt) and isinstance(widths, PDFArray):
+            for i, w in enumerate(widths.value):
+                self.widths[first.value + i] = float(w.resolve().value)
+        # the standard 14 fonts come without widths, an average glyph keeps positions plausible
+        self.default_width = 0.0 if self.widths else 500.0
+
+    def _read_cid_widths(self, obj: PDFDict) -> None:
+        descendants = obj.get(b"DescendantFonts")
+        if not isinstance(descendants, PDFArray) or not descendants.value:
+            return
+        cid_font = descendants.value[0].resolve()
+        if not isinstance(cid_font, PDFDict):
+            return
+        dw = cid_font.get(b"DW")
+        self.default_width = float(dw.value) if isinstance(dw, PDFInt) else 1000.0
+        w = cid_font.get(b"W")
+        items = [v.resolve() for v in w.value] if isinstance(w, PDFArray) else []
+        i = 0
+        while i + 1 < len(items):
+            start = items[i].value
+            if isinstance(items[i + 1], PDFArray):
+                for j, width in enumerate(items[i + 1].value):
+                    self.widths[start + j] = float(width.value)
+                i += 2
+            elif i + 2 < len(items):
+                for cid in range(start, items[i + 1].value + 1):
+                    self.widths[cid] = float(items[i + 2].value)
+                i += 3
+            else:
+                break
+
+    def codes(self, data: bytes) -> List[int]:
+        if self.to_unicode is not None and self.to_unicode.codespace:
+            return self.to_unicode.split(data, 2 if self.composite else 1)
+        if self.composite:
+            return [int.from_bytes(data[i:i + 2], "big") for i in range(0, len(data), 2)]
+        return list(data)
+
+    def decode(self, data: bytes) -> Tuple[str, float, int, int]:
+        # returns text, sum of glyph widths in text space units / 1000, spaces and code count
+        codes = self.codes(data)
+        chars = []
+        for code in codes:
+            char = self.to_unicode.lookup(code) if self.to_unicode is not None else None
+            if char is None:
+                if self.table is not None and code < 256:
+                    char = self.table[code]
+                else:
+                    char = "�"
+            chars.append(char)
+        widths = self.widths
+        width = sum(widths.get(code, self.default_width) for code in codes)
+        spaces = codes.count(32) if not self.composite else 0
+        return "".join(chars), width, spaces, len(codes)
+
+    @staticmethod
+    def load(file: PDFFile, obj: PDFObject) -> Optional[Font]:
+        ref = obj if isinstance(obj, IndRef) else None
+        if ref is not None and ref in file.resource_cache:
+            return file.resource_cache[ref]
+        font = obj.resolve()
+        if not isinstance(font, PDFDict):
+            return None
+        ret = Font(file, font)
+        if ref is not None:
+            file.resource_cache[ref] = ret
+        return ret
+
+
+@dataclass
+class TextSpan:
+    text: str
+    x: float
+    y: float
+    size: float
+    font: bytes
+
+
+class _TextState:
+    font: Optional[Font] = None
+    size: float = 0.0
+    char_spacing: float = 0.0
+    word_spacing: float = 0.0
+    scale: float = 1.0
+    leading: float = 0.0
+    rise: float = 0.0
+
+
+class TextExtractor:
+    file: PDFFile
+
+    def __init__(self, file: PDFFile):
+        self.file = file
+
+    def spans(self, pages: Optional[Iterable[Page]] = None) -> Iterator[TextSpan]:
+        for page in (self.file.pages if pages is None else pages):
+            yield from self.page_spans(page)
+
+    def page_spans(self, page: Page) -> Iterator[TextSpan]:
+        return self._run(ContentParser.page_operations(page), page.Resources, IDENTITY, 0)
+
+    def page_text(self, page: Page) -> str:
+        lines = []
+        line = []
+        last_y = None
+        for span in self.page_spans(page):
+            if last_y is not None and abs(span.y - last_y) > span.size * 0.5:
+                lines.append("".join(line))
+                line = []
+            line.append(span.text)
+            last_y = span.y
+        lines.append("".join(line))
+        return "\n".join(lines)
+
+    def _font(self, resources: PDFObject, name: bytes, local: Dict[bytes, Optional[Font]]) -> Optional[Font]:
+        if name not in local:
+            fonts = resources.get(b"Font") if isinstance(resources, PDFDict) else None
+            obj = fonts.value.get(name) if isinstance(fonts, PDFDict) else None
+            local[name] = Font.load(self.file, obj) if obj is not None else None
+        return local[name]
+
+    def _run(self, ops: Iterator[Operation], resources: PDFObject, ctm: Matrix, depth: int) -> Iterator[TextSpan]:
+        state = _TextState()
+        stack = []
+        tm = tlm = IDENTITY
+        fonts: Dict[bytes, Optional[Font]] = dict()
+
+        def show(data: bytes) -> Optional[TextSpan]:
+            nonlocal tm
+            font = state.font
+            if font is None:
+                return None
+            text, width, spaces, count = font.decode(data)
+            trm = multiply(multiply((state.size * state.scale, 0.0, 0.0, state.size, 0.0, state.rise), tm), ctm)
+            advance = (width / 1000 * state.size + count * state.char_spacing
+                       + spaces * state.word_spacing) * state.scale
+            tm = multiply((1.0, 0.0, 0.0, 1.0, advance, 0.0), tm)
+            size = math.hypot(trm[2], trm[3])
+            return TextSpan(text, trm[4], trm[5], size, font.name)
+
+        def next_line(tx: float, ty: float) -> None:
+            nonlocal tm, tlm
+            tlm = multiply((1.0, 0.0, 0.0, 1.0, tx, ty), tlm)
+            tm = tlm
+
+        for op, args in ops:
+            try:
+                if op == b"Tj" or op == b"'" or op == b'"':
+                    if op == b'"':
+                        state.word_spacing, state.char_spacing = float(args[0].value), float(args[1].value)
+                    if op != b"Tj":
+                        next_line(0.0, -state.leading)
+                    span = show(args[-1].value)
+                    if span is not None:
+                        yield span
+                elif op == b"TJ":
+                    first = None
+                    parts = []
+                    for item in args[0].value:
+                        if isinstance(item, PDFString):
+                            span = show(item.value)
+                            if span is not None:
+                                first = first or span
+                                parts.append(span.text)
+                        else:
+                            offset = float(item.value)
+                            tm = multiply((1.0, 0.0, 0.0, 1.0, -offset / 1000 * state.size * state.scale, 0.0), tm)
+                            if offset < -WORD_GAP and parts:
+                                parts.append(" ")
+                    if first is not None:
+                        first.text = "".join(parts)
+                        yield first
+                elif op == b"Tf":
+                    state.font = self._font(resources, args[0].value, fonts)
+                    state.size = float(args[1].value)
+                elif op == b"Td":
+                    next_line(float(args[0].value), float(args[1].value))
+                elif op == b"TD":
+                    state.leading = -float(args[1].value)
+                    next_line(float(args[0].value), float(args[1].value))
+                elif op == b"Tm":
+                    tm = tlm = to_matrix(args)
+                elif op == b"T*":
+                    next_line(0.0, -state.leading)
+                elif op == b"BT":
+                    tm = tlm = IDENTITY
+                elif op == b"TL":
+                    state.leading = float(args[0].value)
+                elif op == b"Tc":
+                    state.char_spacing = float(args[0].value)
+                elif op == b"Tw":
+                    state.word_spacing = float(args[0].value)
+                elif op == b"Tz":
+                    state.scale = float(args[0].value) / 100
+                elif op == b"Ts":
+                    state.rise = float(args[0].value)
+                elif op == b"q":
+                    stack.append((ctm, copy.copy(state)))
+                elif op == b"Q" and stack:
+                    ctm, state = stack.pop()
+                elif op == b"cm":
+                    ctm = multiply(to_matrix(args), ctm)
+                elif op == b"Do" and depth < MAX_FORM_DEPTH:
+                    yield from self._form(resources, args[0].value, ctm, depth)
+            except (IndexError, AttributeError, TypeError, ValueError):
+                # malformed operands are skipped like a viewer would
+                continue
+
+    def _form(self, resources: PDFObject, name: bytes, ctm: Matrix, depth: int) -> Iterator[TextSpan]:
+        xobjects = resources.get(b"XObject") if isinstance(resources, PDFDict) else None
+        if not isinstance(xobjects, PDFDict):
+            return
+        form = xobjects.get(name)
+        if not isinstance(form, PDFStream) or form.extent.get(b"Subtype").value != b"Form":
+            return
+        matrix = form.extent.get(b"Matrix")
+        if isinstance(matrix, PDFArray):
+            ctm = multiply(to_matrix([v.resolve() for v in matrix.value]), ctm)
+        form_resources = form.extent.get(b"Resources")
+        if not isinstance(form_resources, PDFDict):
+            form_resources = resources
+        yield from self._run(ContentParser.stream_operations(form), form_resources, ctm, depth + 1)
@@ -1,12 +1,35 @@
 
 from __future__ import annotations
 
-from typing import Dict, Optional, Tuple
+from bisect import bisect_right
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple, Iterator, MutableMapping, Sequence
 import io
+import re
 
 from .objects import *
 from .reader import Tokenizer, Parser
-from .stream import Stream
+from .source import ReaderView
+from .stream import Stream, ObjectStream
+from .stats import Instrumentation, XREF_PARSE, OBJECT_PARSE, OBJSTM_PARSE, RESOLVE_HIT, RESOLVE_MISS
+
+if TYPE_CHECKING:
+    from .file import PDFFile
+
+# bytes fetched ahead for an object whose end is not known, larger streams are read when they are decoded
+OBJECT_SPAN = 1 << 12
+XREF_STREAM_KEYS = (b"Type", b"W", b"Index", b"Filter", b"DecodeParms", b"Length", b"DL", b"Prev", b"XRefStm")
+
+# kinds of the IndexedTable columns
+FREE, IN_FILE, IN_OBJSTM, MISSING = 0, 1, 2, 255
+
+# recovery matches object headers on the reversed buffer, so that every pattern starts with a literal
+# and the regex engine can skip ahead with its substring search
+_white = rb"[\x00\t\n\f\r ]"
+_token_end = rb"(?![^\x00\t\n\f\r ()<>\[\]{}/%])"
+REVERSED_OBJ_HEADER = re.compile(rb"jbo" + _white + rb"+(\d{1,5})" + _white + rb"+(\d{1,10})(?![0-9])")
+TRAILER_MARKER = re.compile(rb"trailer(?=" + _white + rb"*<<)")
+TYPE_MARKER = re.compile(rb"/Type" + _white + rb"*/(XRef|ObjStm|Catalog)" + _token_end)
 
 
 class RefSrc:
@@ -20,6 +43,10 @@ class RefSrc:
     def read(self) -> PDFObject:
         return self.obj
 
+    def parse(self) -> PDFObject:
+        # the object without keeping it, for a pass over every object that must not load the whole file
+        return self.obj
+
 
 class RefSrcFromTk(RefSrc):
     tk: Tokenizer
@@ -33,48 +60,254 @@ class RefSrcFromTk(RefSrc):
         self.obj_wrap = obj_wrap
 
     def read(self) -> PDFObject:
-        tk = self.tk
+        if self.obj is None:
+            self.obj = self.parse()
+        return self.obj
+
+    def parse(self) -> PDFObject:
+        if self.obj is not None:
+            return self.obj
         ref = self.ref
+        obj = None
+        start = Instrumentation.clock()
+        # a tokenizer of its own, objects may be read from several threads at once
+        tk = Tokenizer(self.tk.doc)
+        tk.seek(self.offset)
+        if self.obj_wrap:
+            N, G = int(tk.next()), int(tk.next())
+            if N != ref.N or G != ref.G:
+                raise SyntaxError("IndRef is different from expected")
+            if tk.next() != b'obj':
+                raise SyntaxError("Expected obj but not found")
+            obj = Parser.parse_object(tk, self.ref._file)
+            if tk.next() != b'endobj':
+                raise SyntaxError("Expected endobj but not found")
+            security = ref._file.security
+            if security is not None:
+                security.decrypt_object(obj, ref)
+        if Instrumentation.enabled:
+            Instrumentation.record(ref._file, OBJECT_PARSE, tk.pos - self.offset, start)
+        return obj
+
+
+class RefSrcFromObjStm(RefSrc):
+    file: PDFFile
+    stream_num: int
+    index: int
 
+    def __init__(self, ref: IndRef, file: PDFFile, stream_num: int, index: int):
+        super().__init__(ref, None)
+        self.file = file
+        self.stream_num = stream_num
+        self.index = index
+
+    def read(self) -> PDFObject:
         if self.obj is None:
-            self.tk.seek(self.offset)
-            if self.obj_wrap:
-                N, G = int(tk.next()), int(tk.next())
-                if N != ref.N or G != ref.G:
-                    raise SyntaxError("IndRef is different from expected")
-                if tk.next() != b'obj':
-                    raise SyntaxError("Expected obj but not found")
-                self.obj = Parser.parse_object(tk, self.ref._file)
-                if tk.next() != b'endobj':
-                    raise SyntaxError("Expected endobj but not found")
+            self.obj = self.parse()
         return self.obj
 
+    def parse(self) -> PDFObject:
+        if self.obj is not None:
+            return self.obj
+        start = Instrumentation.clock()
+        obj = self.file.object_stream(self.stream_num).read_object(self.index, self.ref.N)
+        if Instrumentation.enabled:
+            Instrumentation.record(self.file, OBJSTM_PARSE, 1, start)
+        return obj
+
+
+class IndexedTable(MutableMapping):
+    # xref table backed by per object number columns, RefSrc entries are only built when looked up
+    file: PDFFile
+    tk: Tokenizer
+    kinds: Sequence[int]
+    gens: Sequence[int]
+    offsets: Sequence[int]
+    indices: Sequence[int]
+    entries: Dict[int, RefSrc]
+    removed: Set[int]
+    _size: int
+
+    def __init__(self, file: PDFFile, kinds: Sequence[int], gens: Sequence[int],
+                 offsets: Sequence[int], indices: Sequence[int]):
+        self.file = file
+        self.tk = file.tk
+        self.kinds = kinds
+        self.gens = gens
+        self.offsets = offsets
+        self.indices = indices
+        self.entries = dict()
+        self.removed = set()
+        self._size = len(kinds) - kinds.tobytes().count(MISSING)
+
+    def _load(self, num: int) -> Optional[RefSrc]:
+        if num in self.removed or not 0 <= num < len(self.kinds):
+            return None
+        kind = self.kinds[num]
+        ref = IndRef(self.file, num, self.gens[num])
+        if kind == FREE:
+            src = RefSrc(ref, PDFNull(self.file))
+        elif kind == IN_FILE:
+            src = RefSrcFromTk(ref, self.tk, self.offsets[num])
+        elif kind == IN_OBJSTM:
+            src = RefSrcFromObjStm(ref, self.file, self.offsets[num], self.indices[num])
+        else:
+            return None
+        self.entries[num] = src
+        return src
+
+    def __getitem__(self, num: int) -> RefSrc:
+        src = self.entries.get(num)
+        if src is None:
+            src = self._load(num)
+            if src is None:
+                raise KeyError(num)
+        return src
+
+    def get(self, num: int, default: Any = None) -> Optional[RefSrc]:
+        src = self.entries.get(num)
+        if src is None:
+            src = self._load(num)
+        return default if src is None else src
+
+    def __contains__(self, num: object) -> bool:
+        if num in self.entries:
+            return True
+        return isinstance(num, int) and 0 <= num < len(self.kinds) \
+            and self.kinds[num] != MISSING and num not in self.removed
+
+    def __setitem__(self, num: int, src: RefSrc) -> None:
+        if num not in self:
+            self._size += 1
+        self.removed.discard(num)
+        self.entries[num] = src
+
+    def __delitem__(self, num: int) -> None:
+        if num not in self:
+            raise KeyError(num)
+        self._size -= 1
+        self.entries.pop(num, None)
+        if 0 <= num < len(self.kinds):
+            self.removed.add(num)
+
+    def __iter__(self) -> Iterator[int]:
+        kinds = self.kinds
+        for num in range(len(kinds)):
+            if num in self.entries or (kinds[num] != MISSING and num not in self.removed):
+                yield num
+        for num in list(self.entries):
+            if num >= len(kinds):
+                yield num
+
+    def __len__(self) -> int:
+        return self._size
+
 
 class XRef:
     table: Dict[int, RefSrc]
     file: PDFFile
+    max_num: int
+    free_nums: List[int]
 
     def __init__(self, file: PDFFile):
         self.file = file
         self.table = {0: RefSrc(IndRef(file, 0, 65535), PDFNull(file))}
+        self.max_num = 0
+        self.free_nums = []
 
     def update(self, num: int, src: RefSrc, equal_update: bool = False) -> bool:
         if num not in self.table:
-            self.table[num] = src
+            self._set(num, src)
             return True
         else:
             if src.ref.G > self.table[num].ref.G:
-                self.table[num] = src
+                self._set(num, src)
                 return True
             if equal_update and src.ref.G == self.table[num].ref.G:
-                self.table[num] = src
+                self._set(num, src)
                 return True
         return False
 
+    def _set(self, num: int, src: RefSrc) -> None:
+        self.table[num] = src
+        if num > self.max_num:
+            self.max_num = num
+        if num != 0 and src.ref.G < 65535 and src.obj is PDFNull(self.file):
+            self.free_nums.append(num)
+
+    def merge(self, older: XRef) -> None:
+        # sections are read newest first, an entry already present shadows the older one
+        for num, src in older.table.items():
+            if num not in self.table:
+                self._set(num, src)
+
+    def is_free(self, num: int) -> bool:
+        src = self.table.get(num)
+        return src is not None and type(src) is RefSrc and src.obj is PDFNull(self.file)
+
+    def free(self, num: int) -> None:
+        gen = self.table[num].ref.G + 1
+        self.table[num] = RefSrc(IndRef(self.file, num, gen), PDFNull(self.file))
+        if gen < 65535:
+            self.free_nums.append(num)
+
+    def allocate(self) -> IndRef:
+        # entries on the free list may have been reused since, so they are checked lazily
+        while self.free_nums:
+            num = self.free_nums.pop()
+            if self.is_free(num):
+                return IndRef(self.file, num, self.table[num].ref.G)
+        return IndRef(self.file, self.max_num + 1, 0)
+
+    def read_many(self, nums: Iterable[int]) -> int:
+        # parses the entries in file order: objects in the file sorted by offset (their bytes fetched
+        # together first), then the members of each object stream, so that every container is decoded once
+        in_file: Dict[int, RefSrcFromTk] = dict()
+        members: Dict[int, List[RefSrcFromObjStm]] = dict()
+        for num in nums:
+            src = self.table.get(num)
+            if src is None or src.obj is not None:
+                continue
+            if isinstance(src, RefSrcFromTk):
+                in_file[num] = src
+            elif isinstance(src, RefSrcFromObjStm):
+                members.setdefault(src.stream_num, []).append(src)
+        for stream_num in members:
+            container = self.table.get(stream_num)
+            if isinstance(container, RefSrcFromTk) and container.obj is None:
+                in_file[stream_num] = container
+        ordered = sorted(in_file.values(), key=lambda src: src.offset)
+        if ordered:
+            XRef._fetch(ordered)
+        for src in ordered:
+            src.read()
+        containers = sorted(members, key=lambda num: getattr(self.table.get(num), "offset", 0))
+        for stream_num in containers:
+            for src in sorted(members[stream_num], key=lambda src: src.index):
+                src.read()
+        return len(ordered) + sum(len(srcs) for srcs in members.values())
+
+    @staticmethod
+    def _fetch(ordered: List[RefSrcFromTk]) -> None:
+        # an object ends at the next one, or is assumed to end within OBJECT_SPAN
+        doc = ordered[0].tk.doc
+        if not isinstance(doc, ReaderView):
+            return
+        ranges = []
+        for src, after in zip(ordered, ordered[1:] + [None]):
+            end = src.offset + OBJECT_SPAN if after is None else min(after.offset, src.offset + OBJECT_SPAN)
+            ranges.append((doc.start + src.offset, max(1, end - src.offset)))
+        doc.reader.prefetch(ranges)
+
     def resolve(self, ref: IndRef) -> PDFObject:
-        if ref.N in self.table:
-            if ref.G == self.table[ref.N].ref.G:
-                return self.table[ref.N].read()
+        src = self.table.get(ref.N)
+        if src is not None and ref.G == src.ref.G:
+            if Instrumentation.enabled:
+                Instrumentation.record(self.file, RESOLVE_MISS if src.obj is None else RESOLVE_HIT, 1)
+            obj = src.read()
+            if obj is not PDFNull(self.file):
+                obj._ref = src.ref
+            return obj
         return PDFNull(self.file)
 
 
@@ -96,12 +329,18 @@ class XRefStream(Stream):
 
     @property
     def Index(self) -> list:
+        if b'Index' not in self.extent:
+            return [0, self.Size]
         return self.extent.get_expected('Index', PDFArray).to_python()
 
     @Index.setter
     def Index(self, index: list) -> None:
         self.extent[b'Index'] = PDFArray(self.file, index)
 
+    @property
+    def W(self) -> list:
+        return self.extent.get_expected('W', PDFArray).to_python()
+
     @property
     def Prev(self) -> int:
         return self.extent.get_expected('Prev', PDFInt).to_python()
@@ -114,10 +353,15 @@ class XRefStream(Stream):
 class XRefParser:
     @staticmethod
     def parse_xref(tk: Tokenizer, file: PDFFile, offset: int) -> Tuple[XRef, PDFDict]:
+        start = Instrumentation.clock()
         tk.seek(offset)
         if tk.peek() == b"xref":
-            return XRefParser.parse_xref_table(tk, file)
-        return XRefParser.parse_xref_stream(tk, file)
+            ret = XRefParser.parse_xref_table(tk, file)
+        else:
+            ret = XRefParser.parse_xref_stream(tk, file)
+        if Instrumentation.enabled:
+            Instrumentation.record(file, XREF_PARSE, tk.pos - offset, start)
+        return ret
 
     @staticmethod
     def parse_xref_table(tk: Tokenizer, file: PDFFile) -> Tuple[XRef, PDFDict]:
@@ -152,4 +396,130 @@ class XRefParser:
         stream = XRefStream(Parser.parse_object(tk, file))
         if tk.next() != b'endobj':
             raise SyntaxError("Expected endobj but not found")
-        
+
+        widths = stream.W
+        index = stream.Index
+        data = stream.decode()
+        row = sum(widths)
+        pos = 0
+        for i in range(0, len(index) - 1, 2):
+            for num in range(index[i], index[i] + index[i + 1]):
+                if pos + row > len(data):
+                    break
+                fields = []
+                for w in widths:
+                    fields.append(int.from_bytes(data[pos:pos + w], 'big'))
+                    pos += w
+                kind = fields[0] if widths[0] else 1
+                if kind == 0:
+                    xref.update(num, RefSrc(IndRef(file, num, fields[2]), PDFNull(file)))
+                elif kind == 1:
+                    xref.update(num, RefSrcFromTk(IndRef(file, num, fields[2]), tk, fields[1]))
+                elif kind == 2:
+                    xref.update(num, RefSrcFromObjStm(IndRef(file, num, 0), file, fields[1], fields[2]))
+        return xref, stream.extent
+
+    @staticmethod
+    def reconstruct(tk: Tokenizer, file: PDFFile) -> Tuple[XRef, PDFDict]:
+        # rebuilds the table from the objects themselves, a later definition wins over an earlier one
+        doc = tk.doc
+        if not isinstance(doc, memoryview):
+            # the scan needs every byte, fetch them once instead of block by block
+            doc = memoryview(doc.tobytes())
+        size = len(doc)
+        positions, nums, gens = array("Q"), array("I"), array("H")
+        for m in REVERSED_OBJ_HEADER.finditer(doc.tobytes()[::-1]):
+            gen, num = m.groups()
+            positions.append(size - m.end())
+            nums.append(int(num[::-1]))
+            gens.append(int(gen[::-1]))
+        positions.reverse()
+        nums.reverse()
+        gens.reverse()
+
+        count = max(nums, default=0) + 1
+        kinds = array("B", bytes([MISSING])) * count
+        gen_col = array("H", bytes(2 * count))
+        offsets = array("Q", bytes(8 * count))
+        kinds[0], gen_col[0] = FREE, 65535
+        for offset, num, gen in zip(positions, nums, gens):
+            if gen < 65535:
+                kinds[num], gen_col[num], offsets[num] = IN_FILE, gen, offset
+        xref = XRef(file)
+        xref.table = IndexedTable(file, kinds, gen_col, offsets, array("I", bytes(4 * count)))
+        xref.max_num = count - 1
+
+        def owner(pos: int) -> Optional[RefSrcFromTk]:
+            # the object a marker lies in, if that definition is still the current one
+            i = bisect_right(positions, pos) - 1
+            if i < 0 or kinds[nums[i]] != IN_FILE or offsets[nums[i]] != positions[i]:
+                return None
+            return xref.table[nums[i]]
+
+        markers = [(m.start(), None) for m in TRAILER_MARKER.finditer(doc)]
+        markers += [(m.start(), m.group(1)) for m in TYPE_MARKER.finditer(doc)]
+        markers.sort()
+
+        trailer = PDFDict(file)
+        catalog = None
+        streams = []
+        for pos, kind in markers:
+            try:
+                if kind is None:
+                    local = Tokenizer(doc)
+                    local.seek(pos + 7)
+                    extent = Parser.parse_object(local, file)
+                else:
+                    src = owner(pos)
+                    if src is None:
+                        continue
+                    if kind == b"Catalog":
+                        catalog = src.ref
+                        continue
+                    if kind == b"ObjStm":
+                        streams.append(src)
+                        continue
+                    extent = src.read()
+                    extent = extent.extent if isinstance(extent, PDFStream) else None
+            except (SyntaxError, ValueError, IndexError):
+                continue
+            if isinstance(extent, PDFDict):
+                for k, v in extent.value.items():
+                    if k not in XREF_STREAM_KEYS:
+                        trailer.value[k] = trailer._adopt(v)
+
+        for src in streams:
+            try:
+                stream = ObjectStream(src.read())
+            except Exception:
+                continue
+            file.resource_cache[IndRef(file, src.ref.N, 0)] = stream
+            for index, (num, _) in enumerate(stream.offsets):
+                cur = xref.table.get(num)
+                if isinstance(cur, RefSrcFromTk) and cur.offset > src.offset:
+                    continue
+                xref._set(num, RefSrcFromObjStm(IndRef(file, num, 0), file, src.ref.N, index))
+
+        root = trailer.value.get(b"Root")
+        if not isinstance(root, IndRef) or not isinstance(xref.resolve(root), PDFDict):
+            if catalog is None:
+                catalog = XRefParser._find_catalog(xref, streams)
+            if catalog is not None:
+                trailer.value[b"Root"] = catalog
+        trailer.value[b"Size"] = PDFInt(file, xref.max_num + 1)
+        return xref, trailer
+
+    @staticmethod
+    def _find_catalog(xref: XRef, streams: List[RefSrcFromTk]) -> Optional[IndRef]:
+        # a catalog inside an object stream is not visible to the byte scan
+        stream_nums = {src.ref.N for src in streams}
+        for num, src in list(xref.table.items()):
+            if isinstance(src, RefSrcFromObjStm) and src.stream_num in stream_nums:
+                try:
+                    obj = src.read()
+                except (SyntaxError, ValueError, IndexError):
+                    continue
+                if isinstance(obj, PDFDict) and isinstance(obj.value.get(b"Type"), PDFName) \
+                        and obj.value[b"Type"].value == b"Catalog":
+                    return src.ref
+        return None
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from src.core.aio import AsyncPDFFile, LocalStorage
+from src.core.file import PDFFile
+from src.core.objects import PDFStream
+
+PAYLOAD = b"0123456789abcdef" * 256
+
+
+class SlowStorage(LocalStorage):
+    # a blocking client of remote storage, every chunk costs a round trip
+    def __init__(self, executor=None, chunk: int = 1 << 12, latency: float = 0.005):
+        super().__init__(executor)
+        self.chunk = chunk
+        self.latency = latency
+
+    def _read(self, path: str) -> bytes:
+        data = LocalStorage._read(path)
+        for _ in range(0, len(data), self.chunk):
+            time.sleep(self.latency)
+        return data
+
+    def _write(self, path: str, data: bytes) -> None:
+        time.sleep(self.latency)
+        LocalStorage._write(path, data)
+
+
+class Gauge:
+    # counts the calls running at once
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def wrap(self, fn, delay: float = 0.02):
+        def call(*args):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            try:
+                time.sleep(delay)
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+        return call
+
+
+def write_document(path: str, count: int = 40) -> None:
+    payload = zlib.compress(PAYLOAD)
+    offsets = []
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.7\n")
+        for num in range(1, count + 1):
+            offsets.append(f.tell())
+            if num == 1:
+                body = b"<< /Type /Catalog /Pages 2 0 R >>"
+            elif num == 2:
+                body = b"<< /Type /Pages /Count 0 /Kids [] >>"
+            else:
+                body = b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(payload), payload)
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (num, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f\r\n" % (count + 1))
+        f.write(b"".join(b"%010d 00000 n\r\n" % off for off in offsets))
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count + 1, xref))
+
+
+async def longest_stall(work, interval: float = 0.001):
+    # (longest time the loop did not run the ticker while work() ran, result of work())
+    stalls = []
+    stop = asyncio.Event()
+
+    async def tick():
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            stalls.append(now - last - interval)
+            last = now
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(interval * 10)
+    try:
+        result = await work()
+    finally:
+        stop.set()
+        await ticker
+    return max(stalls), result
+
+
+def test_slow_read_does_not_stall_the_loop(tmp_path):
+    path = str(tmp_path / "doc.pdf")
+    write_document(path)
+    storage = SlowStorage(chunk=64, latency=0.005)
+    # the read alone blocks for far longer than the allowed stall
+    assert os.path.getsize(path) // storage.chunk * storage.latency > 0.2
+
+    async def main():
+        f = await AsyncPDFFile.open(path, storage=storage)
+        return await asyncio.gather(*(f.decode_stream(num) for num in range(3, 41)))
+
+    stall, decoded = asyncio.run(longest_stall(main))
+    assert decoded == [PAYLOAD] * 38
+    assert stall < 0.1
+
+
+def test_reads_overlap_up_to_the_concurrency_bound(tmp_path):
+    path = str(tmp_path / "doc.pdf")
+    write_document(path)
+    gauge = Gauge()
+
+    async def main():
+        with ThreadPoolExecutor(8) as executor:
+            f = await AsyncPDFFile.open(path, executor=executor, concurrency=3)
+            f._decode = gauge.wrap(f._decode)
+            return await asyncio.gather(*(f.decode_stream(num) for num in range(3, 15)))
+
+    assert asyncio.run(main()) == [PAYLOAD] * 12
+    assert gauge.peak == 3
+
+
+def test_save_excludes_concurrent_resolves(tmp_path):
+    path = str(tmp_path / "doc.pdf")
+    out = str(tmp_path / "out.pdf")
+    write_document(path)
+    gauge = Gauge()
+    during_render = []
+
+    async def main():
+        with ThreadPoolExecutor(8) as executor:
+            f = await AsyncPDFFile.open(path, storage=SlowStorage(executor), executor=executor, concurrency=4)
+            f._resolve = gauge.wrap(f._resolve)
+            render = f.file.render
+
+            def watched(*args):
+                during_render.append(gauge.running)
+                time.sleep(0.05)
+                during_render.append(gauge.running)
+                return render(*args)
+
+            f.file.render = watched
+            before = [asyncio.ensure_future(f.resolve(num)) for num in range(3, 11)]
+            await asyncio.sleep(0)
+            save = asyncio.ensure_future(f.save(out))
+            await asyncio.sleep(0)
+            after = [asyncio.ensure_future(f.resolve(num)) for num in range(11, 19)]
+            return await asyncio.gather(*before, save, *after)
+
+    results = asyncio.run(main())
+    assert during_render == [0, 0]
+    assert gauge.peak == 4
+    assert all(isinstance(obj, PDFStream) for obj in results[:8] + results[9:])
+    assert len(PDFFile(out).xref.table) == 41
@@ -0,0 +1,122 @@
+import random
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from src.core.filters import FilterRegistry, Backend, PassthroughBackend, PREDICTOR, row_length
+import src.core.stream  # registers the pure Python backends
+
+# every backend of every filter is checked against the lowest priority available backend of the same
+# filter, the pure Python (or stdlib zlib) reference
+CHUNK_SIZES = (1, 7, 4096)
+# filter: [(encoded, params, decoded)], the LZW one is the example of the PDF specification
+VECTORS: Dict[bytes, List[Tuple[bytes, Dict[str, Any], bytes]]] = {
+    b"ASCIIHexDecode": [(b"48 65 6C6c 6F>", {}, b"Hello"), (b"7>", {}, b"p"), (b">", {}, b"")],
+    b"ASCII85Decode": [(b"87cURD]i,\"Ebo80~>", {}, b"Hello World!"), (b"z~>", {}, bytes(4)),
+                       (b"~>", {}, b"")],
+    b"LZWDecode": [(bytes.fromhex("800b6050220c0c8501"), {}, b"-----A---B")],
+    b"RunLengthDecode": [(b"\x02abc\xfdd\x80", {}, b"abcdddd"), (b"\x80", {}, b"")],
+    b"FlateDecode": [(bytes.fromhex("789c4b4c4a0600024d0127"), {}, b"abc"),
+                     (bytes.fromhex("789c63626462626402000029000b"), {"predictor": 12, "columns": 2},
+                      b"\x01\x02\x02\x04")],
+}
+PREDICTOR_PARAMS = [
+    {"predictor": 2, "colors": 3, "columns": 5},
+    {"predictor": 12, "columns": 4},
+    {"predictor": 15, "colors": 3, "columns": 7},
+    {"predictor": 15, "colors": 1, "bits_per_component": 4, "columns": 9},
+    {"predictor": 13, "colors": 2, "bits_per_component": 16, "columns": 3},
+]
+
+
+def content(rng: random.Random, size: int) -> bytes:
+    # text operators, what most streams of a document hold
+    ops = []
+    while sum(map(len, ops)) < size:
+        ops.append(b"BT /F1 %d Tf %d %d Td (%s) Tj ET\n" % (
+            rng.randint(6, 24), rng.randint(0, 600), rng.randint(0, 800), rng.choice([b"lorem", b"ipsum", b"dolor"])))
+    return b"".join(ops)[:size]
+
+
+def corpus() -> List[bytes]:
+    rng = random.Random(0)
+    return [b"", b"\x00", b"a" * 1000, bytes(range(256)) * 4, b"x" * 127 + b"y" * 128 + b"z" * 129,
+            content(rng, 1 << 14), rng.randbytes(1 << 15)]
+
+
+def predicted(rng: random.Random, params: Dict[str, Any], rows: int) -> bytes:
+    _, row_len = row_length(params.get("colors", 1), params.get("bits_per_component", 8), params["columns"])
+    if params["predictor"] == 2:
+        return rng.randbytes(rows * row_len + row_len // 2)
+    data = b"".join(bytes([rng.randrange(5)]) + rng.randbytes(row_len) for _ in range(rows))
+    # a truncated last row, decoders pad it with zeros
+    return data + bytes([rng.randrange(5)]) + rng.randbytes(row_len // 2)
+
+
+def streamed(backend: Backend, value: bytes, size: int, params: Dict[str, Any]) -> bytes:
+    decoder = FilterRegistry.decoder(backend.filter, backend, **params)
+    ret = [decoder.update(value[i:i + size]) for i in range(0, len(value), size)]
+    return b"".join(ret) + decoder.flush()
+
+
+def backends(predictor: bool) -> list:
+    return [pytest.param(backend, id=f"{name.decode('ascii')}-{backend.name}")
+            for name in sorted(FilterRegistry.backends) if (name == PREDICTOR) == predictor
+            for backend in FilterRegistry.backends[name]]
+
+
+def reference_of(backend: Backend) -> Backend:
+    if not backend.available():
+        pytest.skip(f"{backend.name} is not installed")
+    return FilterRegistry.available(backend.filter)[-1]
+
+
+@pytest.mark.parametrize("backend", backends(False))
+def test_vectors(backend):
+    reference_of(backend)
+    for encoded, params, decoded in VECTORS.get(backend.filter, []):
+        own, predictor = FilterRegistry._split(backend.filter, params)
+        assert FilterRegistry.unpredict(backend.decode(encoded, **own), **predictor) == decoded
+        for size in CHUNK_SIZES:
+            assert streamed(backend, encoded, size, params) == decoded, f"chunks of {size}"
+
+
+@pytest.mark.parametrize("backend", backends(False))
+def test_round_trips(backend):
+    reference = reference_of(backend)
+    if isinstance(backend, PassthroughBackend):
+        pytest.skip("the data is not decoded")
+    for data in corpus():
+        assert backend.decode(reference.encode(data)) == data, f"reference encoding of {len(data)} bytes"
+        try:
+            own = backend.encode(data)
+        except Exception:
+            continue
+        assert reference.decode(own) == data, f"own encoding of {len(data)} bytes, decoded by the reference"
+        assert backend.decode(own) == data, f"own encoding of {len(data)} bytes"
+
+
+@pytest.mark.parametrize("backend", backends(False))
+def test_streamed_decoding(backend):
+    reference = reference_of(backend)
+    if isinstance(backend, PassthroughBackend):
+        pytest.skip("the data is not decoded")
+    for data in corpus():
+        encoded = reference.encode(data)
+        for size in CHUNK_SIZES[1:] if len(encoded) > 1 << 12 else CHUNK_SIZES:
+            assert streamed(backend, encoded, size, {}) == data, f"{len(data)} bytes in chunks of {size}"
+
+
+@pytest.mark.parametrize("params", PREDICTOR_PARAMS, ids=str)
+@pytest.mark.parametrize("backend", backends(True))
+def test_predictor(backend, params):
+    reference = reference_of(backend)
+    rng = random.Random(0)
+    _, row_len = row_length(params.get("colors", 1), params.get("bits_per_component", 8), params["columns"])
+    for rows in (0, 1, 50, 3000):
+        value = predicted(rng, params, rows)
+        prev = rng.randbytes(row_len)
+        for carried in (None, prev):
+            expected = reference.decode(value, prev=carried, **params)
+            assert backend.decode(value, prev=carried, **params) == expected, \
+                f"rows={rows} prev={carried is not None}"